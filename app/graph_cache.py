@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from itertools import accumulate, compress
+
+from splitter import LEADING_ZERO, NON_ID_BYTES, SCAN_BLOCK_BYTES, UserSet
+
+# Binary CSR cache of an adjacency file, built once and memory-mapped by every later run.
+#
+# <source>.csr sits next to the source: a header, then five little-endian int64 arrays:
+#   ids           dense ID -> original user ID, ascending (so dense order is user order)
+#   line_users    dense ID of the user of every line, in file order (-1 for lines without one)
+#   line_offsets  byte offset of every line in the source, plus the source size
+#   offsets       CSR row pointers into `neighbours`, one row per line
+#   neighbours    dense IDs of the friends listed on each line
+# Rows follow the lines rather than the users so byte ranges and per-line work stay addressable.
+# The header records the source's size, mtime and BLAKE2b digest: a matching size and mtime
+# is trusted, a matching size with another mtime is re-hashed, anything else is rebuilt.
+
+MAGIC = b"FRCSR001"
+# magic, source size, source mtime (ns), source digest, users, lines, neighbour entries
+HEADER = struct.Struct("<8sQq16sQQQ")
+DIGEST_BYTES = 16
+MTIME_OFFSET = 16
+
+
+def cache_path(path):
+    """data/soc-LiveJournal1Adj.txt -> data/soc-LiveJournal1Adj.csr"""
+    return os.path.splitext(path)[0] + ".csr"
+
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=DIGEST_BYTES)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(SCAN_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def build_cache(path, output=None):
+    """Parse the adjacency file once and write its CSR cache; returns (users, lines, neighbour entries).
+
+    Raises ValueError for inputs with non-numeric or zero-padded IDs, which keep the text path.
+    """
+    output = output or cache_path(path)
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=DIGEST_BYTES)
+    users = UserSet()
+    line_users = array("q")
+    line_offsets = array("q")
+    offsets = array("q", [0])
+    neighbours = array("q")
+
+    if stat.st_size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            position = 0
+            while position < stat.st_size:
+                end = mm.find(b"\n", min(position + SCAN_BLOCK_BYTES, stat.st_size) - 1)
+                end = stat.st_size if end < 0 else end + 1
+                block = mm[position:end]
+                digest.update(block)
+                if block.translate(None, NON_ID_BYTES) or LEADING_ZERO.search(block):
+                    raise ValueError("only inputs with plain numeric user IDs are cached")
+                users.add_block(block)
+                offset = position
+                lines = block.split(b"\n")
+                tail = lines.pop()
+                for line in lines + ([tail] if tail else []):
+                    line_offsets.append(offset)
+                    offset += len(line) + 1
+                    user, tab, friends = line.partition(b"\t")
+                    if not user.strip():
+                        line_users.append(-1)
+                        offsets.append(len(neighbours))
+                        continue
+                    line_users.append(int(user))
+                    # Same fields as the mapper: the second one, without empty entries
+                    friends = friends.partition(b"\t")[0]
+                    if friends.strip():
+                        neighbours.extend(map(int, filter(bytes.strip, friends.split(b","))))
+                    offsets.append(len(neighbours))
+                position = end
+    line_offsets.append(stat.st_size)
+
+    # Dense ID of an original ID v: how many IDs are below it
+    rank = array("q", accumulate(users.flags, initial=-1))
+    rank.pop(0)
+    ids = array("q", compress(range(len(users.flags)), users.flags))
+    line_users = array("q", (rank[user] if user >= 0 else -1 for user in line_users))
+    neighbours = array("q", map(rank.__getitem__, neighbours))
+
+    partial = f"{output}.part"
+    try:
+        with open(partial, "wb") as out:
+            out.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, digest.digest(),
+                                  len(ids), len(line_users), len(neighbours)))
+            for values in (ids, line_users, line_offsets, offsets, neighbours):
+                values.tofile(out)
+        os.replace(partial, output)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return len(ids), len(line_users), len(neighbours)
+
+
+def cache_state(path):
+    """"fresh", "touched" (same size, other mtime: needs a hash check), "stale" or "missing"."""
+    cache = cache_path(path)
+    if not os.path.exists(cache):
+        return "missing"
+    with open(cache, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return "stale"
+    magic, size, mtime_ns, _, num_users, num_lines, num_entries = HEADER.unpack(header)
+    expected = HEADER.size + 8 * (num_users + 3 * num_lines + 2 + num_entries)
+    stat = os.stat(path)
+    if magic != MAGIC or size != stat.st_size or os.path.getsize(cache) != expected:
+        return "stale"
+    return "fresh" if mtime_ns == stat.st_mtime_ns else "touched"
+
+
+class CSRGraph:
+    """A memory-mapped CSR cache; every array is an int64 memoryview straight into the mapping."""
+
+    def __init__(self, path):
+        self.source = path
+        self.path = cache_path(path)
+        self.file = open(self.path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.map, 0)
+        self.size = header[1]
+        self.num_users, self.num_lines, self.num_entries = header[4:]
+        self.views = []
+        position = HEADER.size
+        for name, length in (("ids", self.num_users), ("line_users", self.num_lines),
+                             ("line_offsets", self.num_lines + 1), ("offsets", self.num_lines + 1),
+                             ("neighbours", self.num_entries)):
+            view = memoryview(self.map)[position:position + 8 * length].cast("q")
+            self.views.append(view)
+            setattr(self, name, view)
+            position += 8 * length
+
+    def degree(self, line):
+        return self.offsets[line + 1] - self.offsets[line]
+
+    def friends(self, line):
+        """Dense friend IDs of one line."""
+        return self.neighbours[self.offsets[line]:self.offsets[line + 1]]
+
+    def dense_id(self, user_id):
+        """Dense ID of an original (int) user ID, or None."""
+        dense = bisect.bisect_left(self.ids, user_id)
+        return dense if dense < self.num_users and self.ids[dense] == user_id else None
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_graph(path, rebuild=True, log=None):
+    """Open the CSR cache of `path`, (re)building it first when it is missing or out of date.
+
+    `log(message)` hears about rebuilds; rebuild=False raises ValueError instead of building.
+    """
+    state = cache_state(path)
+    if state == "touched":
+        with open(cache_path(path), "rb") as f:
+            expected = HEADER.unpack(f.read(HEADER.size))[3]
+        if file_digest(path) == expected:
+            # Same bytes under a new mtime (copied or touched): remember the mtime, keep the arrays
+            with open(cache_path(path), "r+b") as f:
+                f.seek(MTIME_OFFSET)
+                f.write(struct.pack("<q", os.stat(path).st_mtime_ns))
+            state = "fresh"
+    if state != "fresh":
+        if not rebuild:
+            raise ValueError(f"{cache_path(path)} is {state}; run: graph_cache.py {path}")
+        started = time.perf_counter()
+        users, lines, entries = build_cache(path)
+        if log:
+            log(f"Built {cache_path(path)} ({state}): {users} users, {lines} lines, {entries} entries "
+                f"in {time.perf_counter() - started:.2f}s")
+    return CSRGraph(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="graph_cache.py [--force] <adjacency_file>")
+    parser.add_argument("adjacency_file")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the cache is up to date")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        if args.force:
+            build_cache(args.adjacency_file)
+        with load_graph(args.adjacency_file, log=lambda message: print(f"[Graph] {message}", file=sys.stderr)) as graph:
+            print(f"[Graph] {graph.path}: {graph.num_users} users, {graph.num_lines} lines, "
+                  f"{graph.num_entries} entries ({os.path.getsize(graph.path) / (1024 * 1024):.2f} MB) "
+                  f"ready in {time.perf_counter() - started:.3f}s", file=sys.stderr)
+    except (OSError, ValueError) as exc:
+        print(f"[Graph] ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from lookup import build_index, index_path
+from reducer import DEFAULT_TOP_K, rank_candidates
+from splitter import user_order_key
+
+# Incremental update of a finished run: apply a delta of added / removed friendships to the
+# adjacency file and recompute only the users whose recommendations can change.
+#
+# Adding or removing the friendship a-b changes the lines of a and b only. The mutual-friend
+# counts that move are those of pairs inside those two lines, so the affected users are a, b
+# and every friend of a or b (before or after the change). Their new recommendations only need
+# the lines that mention them, which one pass over the adjacency file collects.
+
+
+def parse_delta(path):
+    """Changes in file order as (added, user_a, user_b); one `+ a b` or `- a b` per line, # comments."""
+    changes = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.split("#", 1)[0].replace(",", " ").strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) == 2 and fields[0][:1] in "+-" and len(fields[0]) > 1:
+                fields = [fields[0][0], fields[0][1:], fields[1]]
+            if len(fields) != 3 or fields[0] not in ("+", "-") or fields[1] == fields[2]:
+                raise ValueError(f"{path}:{number}: expected '+ a b' or '- a b', got {line!r}")
+            changes.append((fields[0] == "+", fields[1], fields[2]))
+    return changes
+
+
+def split_line(raw):
+    """(user, friends) of one adjacency line, or None for blank and malformed lines.
+
+    `user<TAB>` (no friends) strips down to one field; it is still a user of the output.
+    """
+    parts = raw.decode("utf-8").strip().split("\t")
+    if len(parts) > 3 or not parts[0].strip():
+        return None
+    if len(parts) == 1:
+        return parts[0].strip(), []
+    return parts[0].strip(), [friend.strip() for friend in parts[1].split(",") if friend.strip()]
+
+
+def apply_changes(lines, changes):
+    """Apply the delta to the friend lists of its endpoints (edited in place, order preserved)."""
+    for added, user_a, user_b in changes:
+        for user, friend in ((user_a, user_b), (user_b, user_a)):
+            friends = lines.setdefault(user, [])
+            if added and friend not in friends:
+                friends.append(friend)
+            elif not added:
+                lines[user] = [existing for existing in friends if existing != friend]
+
+
+def update_graph(graph_file, graph_output, changes):
+    """Stage the adjacency file with the delta applied; returns (affected users, their lines, stats, staged path).
+
+    The lines kept are those of affected users and every line that lists an affected user. The
+    staged file sits next to graph_output; the caller moves it there once the output is patched.
+    """
+    endpoints = {user for _, user_a, user_b in changes for user in (user_a, user_b)}
+    old_lines = {}
+    with open(graph_file, "rb") as f:
+        for raw in f:
+            parsed = split_line(raw)
+            if parsed and parsed[0] in endpoints:
+                old_lines[parsed[0]] = parsed[1]
+    new_lines = {user: list(friends) for user, friends in old_lines.items()}
+    apply_changes(new_lines, changes)
+    affected = set(endpoints)
+    for friends in list(old_lines.values()) + list(new_lines.values()):
+        affected.update(friends)
+
+    kept = {}
+    lines = 0
+    rewritten = 0
+    output_dir = os.path.dirname(os.path.abspath(graph_output))
+    fd, partial = tempfile.mkstemp(prefix=".graph.", suffix=".part", dir=output_dir)
+    try:
+        with open(graph_file, "rb") as f, os.fdopen(fd, "wb") as out:
+            for raw in f:
+                lines += 1
+                parsed = split_line(raw)
+                if parsed is None:
+                    out.write(raw)
+                    continue
+                user, friends = parsed
+                if user in new_lines:
+                    friends = new_lines.pop(user)
+                    out.write(f"{user}\t{','.join(friends)}\n".encode("utf-8"))
+                    rewritten += 1
+                else:
+                    if raw and not raw.endswith(b"\n"):
+                        raw += b"\n"
+                    out.write(raw)
+                if user in affected or not affected.isdisjoint(friends):
+                    kept[user] = friends
+            # Endpoints that had no line of their own yet
+            for user in sorted((user for user, friends in new_lines.items() if friends), key=user_order_key):
+                out.write(f"{user}\t{','.join(new_lines[user])}\n".encode("utf-8"))
+                kept[user] = new_lines[user]
+                rewritten += 1
+    except BaseException:
+        os.remove(partial)
+        raise
+    stats = {"graph_lines": lines, "rewritten_lines": rewritten, "kept_lines": len(kept)}
+    return affected, kept, stats, partial
+
+
+def recommend_affected(affected, kept, top_k=DEFAULT_TOP_K):
+    """Recommendations (candidate list) of every affected user still in the graph; None if it left."""
+    # Lines that list each affected user: their owners are its friends on the other side
+    listed_by = {user: [] for user in affected}
+    for owner, friends in kept.items():
+        for friend in friends:
+            if friend in listed_by:
+                listed_by[friend].append(owner)
+
+    recommendations = {}
+    for user in affected:
+        if user not in kept and not listed_by[user]:
+            recommendations[user] = None
+            continue
+        counts = Counter()
+        for owner in listed_by[user]:
+            counts.update(friend for friend in kept[owner] if friend != user)
+        blocked = set(kept.get(user, ())) | set(listed_by[user])
+        candidates = {candidate: count for candidate, count in counts.items() if candidate not in blocked}
+        recommendations[user] = [candidate for candidate, _ in rank_candidates(candidates, top_k)]
+    return recommendations
+
+
+def patch_recommendations(path, recommendations):
+    """Rewrite the lines of the updated users, insert new users in order and drop the ones that left."""
+    pending = sorted((user for user, recs in recommendations.items() if recs is not None), key=user_order_key)
+    next_new = 0
+    seen = set()
+    changed = 0
+    fd, partial = tempfile.mkstemp(prefix=".recommendations.", suffix=".part",
+                                   dir=os.path.dirname(os.path.abspath(path)))
+
+    def line_for(user):
+        return f"{user}\t{','.join(recommendations[user])}\n"
+
+    try:
+        with open(path) as f, os.fdopen(fd, "w") as out:
+            for line in f:
+                user = line.split("\t", 1)[0].strip()
+                while next_new < len(pending) and user_order_key(pending[next_new]) < user_order_key(user):
+                    if pending[next_new] not in seen:
+                        out.write(line_for(pending[next_new]))
+                        changed += 1
+                    next_new += 1
+                if user not in recommendations:
+                    out.write(line)
+                    continue
+                seen.add(user)
+                if recommendations[user] is not None:
+                    new_line = line_for(user)
+                    changed += new_line != line
+                    out.write(new_line)
+                else:
+                    changed += 1
+            for user in pending[next_new:]:
+                if user not in seen:
+                    out.write(line_for(user))
+                    changed += 1
+        os.replace(partial, path)
+    except BaseException:
+        os.remove(partial)
+        raise
+    return changed
+
+
+def update(delta_file, graph_file, recommendations_file, graph_output=None, top_k=DEFAULT_TOP_K):
+    started = time.perf_counter()
+    changes = parse_delta(delta_file)
+    stats = {"delta_file": delta_file, "changes": len(changes), "top_k": top_k}
+    graph_output = graph_output or graph_file
+    affected, kept, graph_stats, staged_graph = update_graph(graph_file, graph_output, changes)
+    stats.update(graph_stats)
+    stats["graph_seconds"] = time.perf_counter() - started
+    print(
+        f"[Incremental] Applied {len(changes)} change(s): {len(affected)} affected users, "
+        f"{len(kept)} adjacency lines kept in {stats['graph_seconds']:.2f}s",
+        file=sys.stderr,
+    )
+
+    # The graph is replaced last: if anything before fails, it still predates the delta and
+    # rerunning the same delta gives the same output instead of applying it twice.
+    try:
+        recommendations = recommend_affected(affected, kept, top_k)
+        stats["affected_users"] = len(affected)
+        stats["changed_lines"] = patch_recommendations(recommendations_file, recommendations)
+        # Line offsets moved, so a lookup index next to the output is rebuilt
+        if os.path.exists(index_path(recommendations_file)):
+            build_index(recommendations_file)
+    except BaseException:
+        os.remove(staged_graph)
+        raise
+    os.replace(staged_graph, graph_output)
+    stats["elapsed_seconds"] = time.perf_counter() - started
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        usage="incremental.py [options] <delta_file> <graph_file> <recommendations_file>"
+    )
+    parser.add_argument("delta_file", help="one '+ a b' (add) or '- a b' (remove) friendship per line")
+    parser.add_argument("graph_file", help="adjacency file of the previous run")
+    parser.add_argument("recommendations_file", help="final output of the previous run, patched in place")
+    parser.add_argument("--graph-output", default=None,
+                        help="where the updated adjacency is written (default: graph_file, in place)")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--stats", default=None,
+                        help="write update statistics as JSON to this path")
+    args = parser.parse_args()
+
+    try:
+        stats = update(args.delta_file, args.graph_file, args.recommendations_file, args.graph_output, args.top_k)
+    except (OSError, ValueError) as exc:
+        print(f"[Incremental] ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
+    print(
+        f"Incremental update complete: {stats['affected_users']} affected users, "
+        f"{stats['changed_lines']} output lines changed in {stats['elapsed_seconds']:.2f}s",
+        file=sys.stderr,
+    )
+
+    if args.stats:
+        os.makedirs(os.path.dirname(args.stats) or ".", exist_ok=True)
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
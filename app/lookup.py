@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Point lookups into the final recommendations file (one "user<TAB>rec,rec,..." line per user,
+# in driver order: digit IDs by value, zero-padded ones too, then the other IDs sorted).
+#
+# The sidecar index next to it (friend_recommendations.idx) is a header followed by one
+# <uint64 user ID><uint64 line offset> entry per line, in file order. Digit IDs share an entry
+# ID with their zero-padded forms ("7", "007"), so a match is confirmed against the user field
+# of its line. Non-numeric IDs sit at the end with ID OTHER_ID and are compared by that field.
+# Both files are memory-mapped and binary-searched, so a lookup touches O(log n) pages and
+# nothing is loaded.
+
+# Version 2: zero-padded digit IDs moved from the end into the numeric entries
+MAGIC = b"FRECIDX2"
+# magic, entries, numeric entries, size and mtime (ns) of the recommendations file it indexes
+HEADER = struct.Struct("<8sQQQq")
+ENTRY = struct.Struct("<QQ")
+OTHER_ID = (1 << 64) - 1
+DEFAULT_PORT = 8080
+
+
+def index_path(path):
+    """artifacts/friend_recommendations.txt -> artifacts/friend_recommendations.idx"""
+    return os.path.splitext(path)[0] + ".idx"
+
+
+def numeric_id(user_id):
+    # Same rule as splitter.user_order_key: any digit string, by value
+    if user_id.isdigit():
+        value = int(user_id)
+        if value < OTHER_ID:
+            return value
+    return None
+
+
+class IndexWriter:
+    """Streams index entries to disk while the recommendations file is written (no entry is kept)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.partial = f"{path}.part"
+        self.file = open(self.partial, "wb")
+        self.file.write(bytes(HEADER.size))
+        self.entries = 0
+        self.numeric = 0
+        self.last = None
+
+    def add(self, user_id, offset):
+        value = numeric_id(user_id)
+        if value is None:
+            value = OTHER_ID
+            key = (1, user_id)
+        else:
+            self.numeric += 1
+            key = (0, value)
+        # Equal keys are the same value written with different zero padding
+        if self.last is not None and (key < self.last or (key == self.last and value == OTHER_ID)):
+            raise ValueError(f"user {user_id} at byte {offset} is out of order; the index needs driver order")
+        self.last = key
+        self.file.write(ENTRY.pack(value, offset))
+        self.entries += 1
+
+    def finish(self, output_file):
+        """Seal the index against the final size and mtime of `output_file`."""
+        stat = os.stat(output_file)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.entries, self.numeric, stat.st_size, stat.st_mtime_ns))
+        self.file.close()
+        os.replace(self.partial, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.partial)
+
+
+def build_index(path):
+    """Index an existing recommendations file with one pass over its memory map; returns the entry count."""
+    writer = IndexWriter(index_path(path))
+    try:
+        if os.path.getsize(path):
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = 0
+                while offset < len(mm):
+                    end = mm.find(b"\n", offset)
+                    end = len(mm) if end < 0 else end + 1
+                    tab = mm.find(b"\t", offset, end)
+                    if tab >= 0:
+                        writer.add(mm[offset:tab].decode("utf-8"), offset)
+                    offset = end
+    except BaseException:
+        writer.abort()
+        raise
+    writer.finish(path)
+    return writer.entries
+
+
+class RecommendationIndex:
+    """Memory-mapped recommendations file plus its index; get() is a binary search, not a scan.
+
+    A missing or stale index (the file changed since it was built) is rebuilt on open
+    unless rebuild=False, which raises ValueError instead.
+    """
+
+    def __init__(self, path, rebuild=True):
+        self.path = path
+        self.index_file = index_path(path)
+        if not self._fresh():
+            if not rebuild:
+                raise ValueError(f"{self.index_file} is missing or stale; run: lookup.py index {path}")
+            print(f"[Lookup] Building {self.index_file}...", file=sys.stderr)
+            build_index(path)
+        self.size = os.path.getsize(path)
+        self.data_file = open(path, "rb")
+        self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.index_handle = open(self.index_file, "rb")
+        self.index = mmap.mmap(self.index_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self.entries, self.numeric, _, _ = HEADER.unpack_from(self.index, 0)
+
+    def _fresh(self):
+        if not os.path.exists(self.index_file):
+            return False
+        stat = os.stat(self.path)
+        with open(self.index_file, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return False
+        magic, entries, _, size, mtime_ns = HEADER.unpack(header)
+        return (magic == MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+                and os.path.getsize(self.index_file) == HEADER.size + entries * ENTRY.size)
+
+    def __len__(self):
+        return self.entries
+
+    def _entry(self, position):
+        return ENTRY.unpack_from(self.index, HEADER.size + position * ENTRY.size)
+
+    def _user_at(self, offset):
+        return self.data[offset:self.data.find(b"\t", offset)].decode("utf-8")
+
+    def _find(self, user_id):
+        """Line offset of `user_id`, or None."""
+        value = numeric_id(user_id)
+        if value is None:
+            low, high = self.numeric, self.entries
+            while low < high:
+                middle = (low + high) // 2
+                offset = self._entry(middle)[1]
+                key = self._user_at(offset)
+                if key == user_id:
+                    return offset
+                if key < user_id:
+                    low = middle + 1
+                else:
+                    high = middle
+            return None
+        # First entry with this value, then its (rare) other paddings
+        low, high = 0, self.numeric
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < value:
+                low = middle + 1
+            else:
+                high = middle
+        while low < self.numeric:
+            entry_id, offset = self._entry(low)
+            if entry_id != value:
+                return None
+            if self._user_at(offset) == user_id:
+                return offset
+            low += 1
+        return None
+
+    def get(self, user_id):
+        """Recommended user IDs of `user_id` (best first), or None for a user not in the output."""
+        offset = self._find(str(user_id).strip())
+        if offset is None:
+            return None
+        end = self.data.find(b"\n", offset)
+        line = self.data[offset:end if end >= 0 else len(self.data)].decode("utf-8")
+        recs = line.partition("\t")[2]
+        return recs.split(",") if recs else []
+
+    def get_many(self, user_ids):
+        return {user_id: self.get(user_id) for user_id in user_ids}
+
+    def close(self):
+        if self.size:
+            self.data.close()
+        self.index.close()
+        self.data_file.close()
+        self.index_handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    """GET /users/<id>, GET /users?ids=a,b,c, POST /users with a JSON list (or {"users": [...]}), GET /health."""
+
+    index = None
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _batch(self, user_ids):
+        self._reply(200, {"results": self.index.get_many(user_ids)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            return self._reply(200, {"users": len(self.index)})
+        if url.path.startswith("/users/"):
+            user_id = unquote(url.path[len("/users/"):])
+            recs = self.index.get(user_id)
+            if recs is None:
+                return self._reply(404, {"user": user_id, "error": "unknown user"})
+            return self._reply(200, {"user": user_id, "recommendations": recs})
+        if url.path == "/users":
+            ids = ",".join(parse_qs(url.query).get("ids", []))
+            return self._batch([user_id for user_id in ids.split(",") if user_id.strip()])
+        self._reply(404, {"error": f"no route for {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/users":
+            return self._reply(404, {"error": f"no route for {self.path}"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"[]")
+            user_ids = body["users"] if isinstance(body, dict) else body
+            if not isinstance(user_ids, list):
+                raise ValueError
+        except (ValueError, KeyError):
+            return self._reply(400, {"error": 'expected a JSON list of user IDs or {"users": [...]}'})
+        self._batch([str(user_id) for user_id in user_ids])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(index, port=DEFAULT_PORT, bind="127.0.0.1"):
+    LookupHandler.index = index
+    server = ThreadingHTTPServer((bind, port), LookupHandler)
+    server.daemon_threads = True
+    print(f"LISTENING: {server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="lookup.py index|get|serve <recommendations_file> [options]")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_parser = commands.add_parser("index", help="(re)build the sidecar index of a recommendations file")
+    index_parser.add_argument("recommendations_file")
+    get_parser = commands.add_parser("get", help="print the recommendations of some users")
+    get_parser.add_argument("recommendations_file")
+    get_parser.add_argument("users", nargs="+", help="user IDs ('-' reads one ID per line from stdin)")
+    serve_parser = commands.add_parser("serve", help="answer lookups over HTTP")
+    serve_parser.add_argument("recommendations_file")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--bind", default="127.0.0.1")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "index":
+            started = time.perf_counter()
+            entries = build_index(args.recommendations_file)
+            print(f"[Lookup] Indexed {entries} users into {index_path(args.recommendations_file)} "
+                  f"in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+            sys.exit(0)
+        index = RecommendationIndex(args.recommendations_file)
+    except (OSError, ValueError) as exc:
+        print(f"[Lookup] ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    with index:
+        if args.command == "serve":
+            serve(index, args.port, args.bind)
+            sys.exit(0)
+        users = args.users
+        if users == ["-"]:
+            users = [line.strip() for line in sys.stdin if line.strip()]
+        started = time.perf_counter()
+        results = index.get_many(users)
+        elapsed = time.perf_counter() - started
+        missing = 0
+        for user_id in users:
+            recs = results[user_id]
+            if recs is None:
+                missing += 1
+                print(f"{user_id}\tNOT FOUND")
+            else:
+                print(f"{user_id}\t{','.join(recs)}")
+        print(f"[Lookup] {len(users)} lookup(s) in {elapsed * 1000:.2f} ms "
+              f"({elapsed * 1e6 / max(1, len(users)):.1f} us each), {missing} not found", file=sys.stderr)
+        if missing:
+            sys.exit(1)
@@ -1,58 +1,262 @@
-#!/usr/bin/env python3
-import sys
-import os
-
-def emit(key, value):
-    print(f"{key}\t{value}")
-
-def map_friends(input_file, output_file):
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        # Redirect stdout to output file
-        original_stdout = sys.stdout
-        sys.stdout = outfile
-
-        for line in infile:
-            line = line.strip()
-            if not line:
-                continue
-
-            parts = line.split('\t')
-            if len(parts) != 2:
-                continue
-
-            user = parts[0].strip()
-            friends_str = parts[1].strip()
-
-            if not friends_str:
-                friends = []
-            else:
-                friends = [f.strip() for f in friends_str.split(',') if f.strip()]
-
-            # Mark existing friendships with -1 (to filter them out in reduce)
-            for friend in friends:
-                pair = tuple(sorted([user, friend]))
-                emit(f"{pair[0]},{pair[1]}", "-1")
-
-            # Emit potential recommendations:
-            # For each pair of this user's friends, they should be recommended to each other
-            # because 'user' is their mutual friend
-            for i in range(len(friends)):
-                for j in range(i + 1, len(friends)):
-                    friend_a = friends[i]
-                    friend_b = friends[j]
-                    pair = tuple(sorted([friend_a, friend_b]))
-                    emit(f"{pair[0]},{pair[1]}", user)
-
-        sys.stdout = original_stdout
-
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: mapper.py <input_file> <output_file>", file=sys.stderr)
-        sys.exit(1)
-
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-
-    print(f"Mapper processing: {input_file} -> {output_file}", file=sys.stderr)
-    map_friends(input_file, output_file)
-    print(f"Mapper complete: {output_file}", file=sys.stderr)
+#!/usr/bin/env python3
+import argparse
+import json
+import shutil
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import records
+from metrics import Meter, report
+from partition import PartitionTable, open_writer, partition_path
+from records import NONE, TEXT
+from spill import merge_runs, remove_runs, write_run
+from splitter import line_aligned_ranges, read_lines
+
+FRIENDS_MARKER = -1
+DEFAULT_MEMORY_MB = 256
+# Approximate footprint of one pending pair in the combiner dict (tuple key + dict slot)
+COMBINER_ENTRY_BYTES = 200
+
+def parse_line(line, parse_id=str):
+    line = line.strip()
+    if not line:
+        return None
+
+    parts = line.split('\t')
+    # A third field marks a hub row band from the driver: only the first `rows` friends start rows
+    if len(parts) not in (2, 3):
+        return None
+
+    user = parse_id(parts[0].strip())
+    friends_str = parts[1].strip()
+
+    if not friends_str:
+        friends = []
+    else:
+        friends = [parse_id(f.strip()) for f in friends_str.split(',') if f.strip()]
+    rows = int(parts[2]) if len(parts) == 3 else len(friends)
+    return user, friends, rows
+
+def map_friends(input_file, output_file, fmt=TEXT, byte_range=(0, None), table=None,
+                compression=NONE, level=None):
+    parse_id = records.parse_id(fmt)
+    lines = 0
+    input_bytes = 0
+    with open_writer(output_file, fmt, table, compression, level) as writer:
+        emit = writer.write
+        for line in read_lines(input_file, *byte_range):
+            lines += 1
+            input_bytes += len(line)
+            parsed = parse_line(line, parse_id)
+            if parsed is None:
+                continue
+            user, friends, rows = parsed
+
+            # Mark existing friendships with -1 (to filter them out in reduce)
+            for friend in friends[:rows]:
+                if user < friend:
+                    emit(user, friend, FRIENDS_MARKER)
+                else:
+                    emit(friend, user, FRIENDS_MARKER)
+
+            # Emit potential recommendations:
+            # For each pair of this user's friends, they should be recommended to each other
+            # because 'user' is their mutual friend
+            for i in range(rows):
+                friend_a = friends[i]
+                for j in range(i + 1, len(friends)):
+                    friend_b = friends[j]
+                    if friend_a < friend_b:
+                        emit(friend_a, friend_b, user)
+                    else:
+                        emit(friend_b, friend_a, user)
+    return dict(writer.stats(), input_lines=lines, input_bytes=input_bytes)
+
+def merge_combined(a, b):
+    if a == FRIENDS_MARKER or b == FRIENDS_MARKER:
+        return FRIENDS_MARKER
+    return a + b
+
+def combine_friends(input_file, output_file, memory_mb=DEFAULT_MEMORY_MB, spill_dir=None, fmt=TEXT,
+                    byte_range=(0, None), table=None, compression=NONE, level=None):
+    # Same pairs as map_friends, but pre-aggregated: one "a,b<TAB>count" record per pair,
+    # or "a,b<TAB>-1" once the pair is known to be friends already.
+    parse_id = records.parse_id(fmt)
+    max_entries = max(1, memory_mb * 1024 * 1024 // COMBINER_ENTRY_BYTES)
+    pairs = {}
+    runs = []
+    lines = 0
+    input_bytes = 0
+
+    def spill():
+        runs.append(write_run(sorted(pairs.items()), spill_dir))
+        print(f"[Mapper] Spilled {len(pairs)} pairs to run {len(runs)}", file=sys.stderr)
+        pairs.clear()
+
+    for line in read_lines(input_file, *byte_range):
+        lines += 1
+        input_bytes += len(line)
+        parsed = parse_line(line, parse_id)
+        if parsed is None:
+            continue
+        user, friends, rows = parsed
+
+        for friend in friends[:rows]:
+            pair = (user, friend) if user < friend else (friend, user)
+            pairs[pair] = FRIENDS_MARKER
+
+        for i in range(rows):
+            friend_a = friends[i]
+            for j in range(i + 1, len(friends)):
+                friend_b = friends[j]
+                pair = (friend_a, friend_b) if friend_a < friend_b else (friend_b, friend_a)
+                count = pairs.get(pair, 0)
+                if count != FRIENDS_MARKER:
+                    pairs[pair] = count + 1
+            if len(pairs) >= max_entries:
+                spill()
+
+    try:
+        with open_writer(output_file, fmt, table, compression, level) as writer:
+            if not runs:
+                writer.write_many((a, b, value) for (a, b), value in pairs.items())
+            else:
+                current_pair, current_value = None, 0
+                for pair, value in merge_runs(runs, sorted(pairs.items())):
+                    if pair == current_pair:
+                        current_value = merge_combined(current_value, value)
+                        continue
+                    if current_pair is not None:
+                        writer.write(current_pair[0], current_pair[1], current_value)
+                    current_pair, current_value = pair, value
+                if current_pair is not None:
+                    writer.write(current_pair[0], current_pair[1], current_value)
+        return dict(writer.stats(), input_lines=lines, input_bytes=input_bytes)
+    finally:
+        remove_runs(runs)
+
+def available_cpus():
+    # Respects CPU pinning (taskset, local host pools), unlike os.cpu_count()
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def parse_workers(value):
+    workers = available_cpus() if value == "auto" else int(value)
+    if workers <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'")
+    return workers
+
+def output_paths(output_file, table=None):
+    if output_file == "-":
+        return [output_file]
+    if table is not None:
+        return [partition_path(output_file, p) for p in range(table.num_shards)]
+    return [output_file]
+
+def run_mapper(input_file, output_file, options, byte_range=(0, None)):
+    if options.combine:
+        stats = combine_friends(input_file, output_file, options.memory_mb, options.spill_dir, options.format,
+                                byte_range, options.table, options.compression, options.compression_level)
+    else:
+        stats = map_friends(input_file, output_file, options.format, byte_range, options.table,
+                            options.compression, options.compression_level)
+    return output_paths(output_file, options.table), stats
+
+def merge_stats(all_stats):
+    totals = {}
+    for stats in all_stats:
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+def concatenate(sources, destination):
+    with open(destination, 'wb') as out:
+        for source in sources:
+            with open(source, 'rb') as src:
+                shutil.copyfileobj(src, out, 1 << 20)
+            os.remove(source)
+
+def run_parallel(input_file, output_file, options, merge=True):
+    # Each worker maps one line-aligned byte range into its own file(s); nothing is shared
+    # between processes, and merging is a plain sequential concatenation per partition.
+    ranges = line_aligned_ranges(input_file, options.workers)
+    worker_options = argparse.Namespace(**vars(options))
+    worker_options.memory_mb = max(1, options.memory_mb // max(1, len(ranges)))
+    root, ext = os.path.splitext(output_file)
+    worker_files = [f"{root}.w{idx}{ext}" for idx in range(len(ranges))]
+    print(f"[Mapper] {len(ranges)} workers over byte ranges {ranges}", file=sys.stderr)
+    with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        futures = [
+            pool.submit(run_mapper, input_file, worker_file, worker_options, byte_range)
+            for worker_file, byte_range in zip(worker_files, ranges)
+        ]
+        results = [future.result() for future in futures]
+    worker_outputs = [paths for paths, _ in results]
+    stats = merge_stats(worker_stats for _, worker_stats in results)
+
+    if not merge:
+        return [path for paths in worker_outputs for path in paths], stats
+    # Compressed outputs concatenate too: gzip members and zstd frames are read back to back
+    merged = output_paths(output_file, options.table)
+    for idx, destination in enumerate(merged):
+        concatenate([paths[idx] for paths in worker_outputs], destination)
+    return merged, stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        usage="mapper.py [options] <input_file> <output_file>  ('-' = stdin / stdout; "
+              "partitioned stdout is framed, see partition.FramedWriter)"
+    )
+    parser.add_argument("input_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--combine", action="store_true",
+                        help="emit one pre-aggregated (count or -1) record per pair")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+                        help="combiner memory budget before spilling sorted runs to disk")
+    parser.add_argument("--spill-dir", default=None,
+                        help="directory for combiner spill runs (default: system temp dir)")
+    parser.add_argument("--format", choices=records.FORMATS, default=TEXT,
+                        help="intermediate record format (text is kept for debugging)")
+    parser.add_argument("--workers", type=parse_workers, default=1,
+                        help="map line-aligned byte ranges in N processes ('auto' = one per core)")
+    parser.add_argument("--no-merge", action="store_true",
+                        help="with --workers, keep per-worker <output>.w<k> files instead of concatenating")
+    parser.add_argument("--num-partitions", type=int, default=None,
+                        help="write one <output>.p<r> file per reducer shard instead of a single output")
+    parser.add_argument("--partition-table", default=None,
+                        help="bucket -> reducer table from the driver (implies its number of partitions)")
+    parser.add_argument("--compression", choices=records.COMPRESSIONS, default=NONE,
+                        help="stream-compress the output files")
+    parser.add_argument("--compression-level", type=int, default=None,
+                        help="compressor level (default: gzip 6, zstd 3)")
+    args = parser.parse_args()
+    meter = Meter("mapper")
+    if args.partition_table:
+        args.table = PartitionTable.load(args.partition_table)
+    elif args.num_partitions:
+        args.table = PartitionTable.uniform(args.num_partitions)
+    else:
+        args.table = None
+
+    input_file = args.input_file
+    output_file = args.output_file
+    if "-" in (input_file, output_file) and args.workers > 1:
+        # Byte ranges need a seekable input and per-worker files; a pipe is mapped by one process
+        print(f"[Mapper] Streaming over stdin/stdout: ignoring --workers {args.workers}", file=sys.stderr)
+        args.workers = 1
+
+    print(f"Mapper processing: {input_file} -> {output_file}", file=sys.stderr)
+    if args.workers > 1:
+        outputs, stats = run_parallel(input_file, output_file, args, merge=not args.no_merge)
+    else:
+        outputs, stats = run_mapper(input_file, output_file, args)
+    stats["compression"] = args.compression
+    stats["compressed_bytes"] = sum(os.path.getsize(path) for path in outputs if path != "-")
+    print(f"Mapper complete: {', '.join(outputs)}", file=sys.stderr)
+    # Parsed by the driver to weigh compression time against transfer time
+    print(f"COMPRESSION_STATS: {json.dumps(stats)}", file=sys.stderr)
+    meter.add(records_in=stats["input_lines"], records_out=stats["records"], bytes_read=stats["input_bytes"],
+              bytes_written=stats["compressed_bytes"] or stats["raw_bytes"])
+    report(meter.result(workers=args.workers))
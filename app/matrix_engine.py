@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    print("ERROR: numpy not installed")
+    print("Run: pip install numpy")
+    sys.exit(1)
+
+from graph_cache import load_graph
+
+DEFAULT_TOP_K = 10
+DEFAULT_MEMORY_MB = 256
+# Peak bytes per intermediate two-hop entry inside a row block (keys, gather indices, sort scratch)
+BYTES_PER_ENTRY = 64
+
+
+class Adjacency:
+    """CSR adjacency of the input lines: row u holds the friend list written on u's line."""
+
+    def __init__(self, ids, indptr, indices):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+
+    @property
+    def num_users(self):
+        return len(self.ids)
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    def transpose(self):
+        n = self.num_users
+        rows = np.repeat(np.arange(n, dtype=np.int64), self.degrees())
+        order = np.argsort(self.indices, kind="stable")
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=n), out=indptr[1:])
+        return Adjacency(self.ids, indptr, rows[order])
+
+
+def load_adjacency(path, use_cache=True):
+    if use_cache:
+        try:
+            return load_cached_adjacency(path)
+        except ValueError as exc:
+            print(f"[Engine] Graph cache unavailable ({exc}); parsing the text input", file=sys.stderr)
+    users = []
+    degrees = []
+    friends = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.strip().split("\t")
+            if not parts[0].strip():
+                continue
+            # Malformed lines still name a user, they just contribute no friendships
+            friend_ids = [int(x) for x in parts[1].split(",") if x.strip()] if len(parts) == 2 else []
+            users.append(int(parts[0]))
+            degrees.append(len(friend_ids))
+            friends.extend(friend_ids)
+
+    users = np.asarray(users, dtype=np.int64)
+    degrees = np.asarray(degrees, dtype=np.int64)
+    friends = np.asarray(friends, dtype=np.int64)
+
+    # Dense IDs follow numeric order, so comparing dense IDs is comparing user IDs
+    ids = np.unique(np.concatenate([users, friends]))
+    rows = np.repeat(np.searchsorted(ids, users), degrees)
+    cols = np.searchsorted(ids, friends)
+    return group_rows(ids, rows, cols)
+
+
+def load_cached_adjacency(path):
+    """load_adjacency() from the memory-mapped CSR cache (app/graph_cache.py); IDs are already dense."""
+    graph = load_graph(path, log=lambda message: print(f"[Engine] {message}", file=sys.stderr))
+    # Views into the mapping, no copy; the arrays keep the mapping alive
+    ids = np.frombuffer(graph.ids, dtype=np.int64)
+    users = np.frombuffer(graph.line_users, dtype=np.int64)
+    degrees = np.diff(np.frombuffer(graph.offsets, dtype=np.int64))
+    # Lines without a user have no friends, so their -1 is never repeated
+    rows = np.repeat(users, degrees)
+    return group_rows(ids, rows, np.frombuffer(graph.neighbours, dtype=np.int64))
+
+
+def group_rows(ids, rows, cols):
+    """Adjacency from (row, col) entries in line order; several lines of one user merge into its row."""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+    return Adjacency(ids, indptr, cols[order])
+
+
+def gather_rows(adj, rows):
+    """Concatenate the CSR rows listed in `rows`; returns (entries, owner position in `rows`)."""
+    lengths = adj.indptr[rows + 1] - adj.indptr[rows]
+    total = int(lengths.sum())
+    if total == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    ends = np.cumsum(lengths)
+    positions = np.repeat(adj.indptr[rows] - (ends - lengths), lengths) + np.arange(total)
+    owners = np.repeat(np.arange(len(rows), dtype=np.int64), lengths)
+    return adj.indices[positions], owners
+
+
+def row_blocks(adj, adj_t, max_entries):
+    # Work for row x of A^T.A is the number of two-hop entries sum(deg(u) for u with x in A[u])
+    deg = adj.degrees()
+    two_hop = np.zeros(len(adj_t.indices) + 1, dtype=np.int64)
+    np.cumsum(deg[adj_t.indices], out=two_hop[1:])
+    work = two_hop[adj_t.indptr[1:]] - two_hop[adj_t.indptr[:-1]]
+
+    cumulative = np.zeros(adj.num_users + 1, dtype=np.int64)
+    np.cumsum(work, out=cumulative[1:])
+    start = 0
+    while start < adj.num_users:
+        end = int(np.searchsorted(cumulative, cumulative[start] + max_entries, side="right")) - 1
+        end = max(end, start + 1)
+        yield start, end
+        start = end
+
+
+def recommend_block(adj, adj_t, start, end, top_k):
+    """Top-k (count desc, id asc) candidates for dense rows [start, end) of A^T.A."""
+    n = adj.num_users
+    block_rows = np.arange(start, end, dtype=np.int64)
+
+    # Lines u whose friend list contains x, then every friend y on those lines
+    via, via_owner = gather_rows(adj_t, block_rows)
+    candidates, hop_owner = gather_rows(adj, via)
+    local_rows = via_owner[hop_owner]
+
+    keys, counts = np.unique(local_rows * n + candidates, return_counts=True)
+    rows = keys // n
+    cands = keys % n
+
+    # Existing friendships (listed on either side) and self-pairs are never recommended
+    out_friends, out_owner = gather_rows(adj, block_rows)
+    in_friends, in_owner = gather_rows(adj_t, block_rows)
+    friend_keys = np.unique(np.concatenate([out_owner * n + out_friends, in_owner * n + in_friends]))
+    keep = (cands != rows + start) & ~np.isin(keys, friend_keys, assume_unique=True)
+    rows, cands, counts = rows[keep], cands[keep], counts[keep]
+
+    order = np.lexsort((cands, -counts, rows))
+    rows, cands = rows[order], cands[order]
+    row_starts = np.searchsorted(rows, np.arange(end - start + 1))
+    rank = np.arange(len(rows)) - row_starts[rows]
+    top = rank < top_k
+    rows, cands = rows[top], cands[top]
+    bounds = np.searchsorted(rows, np.arange(end - start + 1))
+    return bounds, adj.ids[cands], int(len(keys))
+
+
+def recommend(input_file, output_file, top_k=DEFAULT_TOP_K, memory_mb=DEFAULT_MEMORY_MB, use_cache=True):
+    stats = {"input_file": input_file, "top_k": top_k, "memory_mb": memory_mb}
+    started = time.perf_counter()
+
+    adj = load_adjacency(input_file, use_cache)
+    adj_t = adj.transpose()
+    stats["load_seconds"] = time.perf_counter() - started
+    print(
+        f"[Engine] Loaded {adj.num_users} users, {len(adj.indices)} adjacency entries "
+        f"in {stats['load_seconds']:.2f}s",
+        file=sys.stderr,
+    )
+
+    max_entries = max(1, memory_mb * 1024 * 1024 // BYTES_PER_ENTRY)
+    candidate_pairs = 0
+    blocks = 0
+    ids = adj.ids
+    with open(output_file, "w") as f:
+        for start, end in row_blocks(adj, adj_t, max_entries):
+            bounds, top_ids, pairs = recommend_block(adj, adj_t, start, end, top_k)
+            candidate_pairs += pairs
+            blocks += 1
+            lines = []
+            for local in range(end - start):
+                recs = top_ids[bounds[local]:bounds[local + 1]]
+                lines.append(f"{ids[start + local]}\t{','.join(map(str, recs.tolist()))}\n")
+            f.write("".join(lines))
+
+    elapsed = time.perf_counter() - started
+    stats.update({
+        "users": int(adj.num_users),
+        "row_blocks": blocks,
+        "candidate_pairs": candidate_pairs,
+        "elapsed_seconds": elapsed,
+        "users_per_second": adj.num_users / elapsed if elapsed else 0.0,
+        "pairs_per_second": candidate_pairs / elapsed if elapsed else 0.0,
+    })
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="matrix_engine.py [options] <input_file> <output_file>")
+    parser.add_argument("input_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+                        help="budget for the two-hop entries of one row block of A^T.A")
+    parser.add_argument("--no-graph-cache", action="store_true",
+                        help="parse the text input instead of its CSR cache (app/graph_cache.py)")
+    parser.add_argument("--compare", default=None,
+                        help="MapReduce output to check byte-for-byte against")
+    parser.add_argument("--stats", default=None,
+                        help="write throughput statistics as JSON to this path")
+    args = parser.parse_args()
+
+    print(f"Engine processing: {args.input_file} -> {args.output_file}", file=sys.stderr)
+    stats = recommend(args.input_file, args.output_file, args.top_k, args.memory_mb, not args.no_graph_cache)
+    print(
+        f"Engine complete: {stats['users']} users, {stats['candidate_pairs']} candidate pairs, "
+        f"{stats['row_blocks']} row blocks in {stats['elapsed_seconds']:.2f}s "
+        f"({stats['users_per_second']:.0f} users/s, {stats['pairs_per_second']:.0f} pairs/s)",
+        file=sys.stderr,
+    )
+
+    if args.compare:
+        with open(args.output_file, "rb") as ours, open(args.compare, "rb") as theirs:
+            identical = ours.read() == theirs.read()
+        stats["compared_with"] = args.compare
+        stats["identical"] = identical
+        print(f"Output identical to {args.compare}: {identical}", file=sys.stderr)
+
+    if args.stats:
+        os.makedirs(os.path.dirname(args.stats) or ".", exist_ok=True)
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
+
+    if args.compare and not stats["identical"]:
+        sys.exit(1)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+import json
+import resource
+import sys
+import time
+
+# Structured metrics of one pipeline stage or task. Mapper and reducer processes print theirs as a
+# single TASK_METRICS line on stderr, which the driver parses like COMPRESSION_STATS.
+
+COUNTERS = ("records_in", "records_out", "bytes_read", "bytes_written")
+
+
+def usage_targets(children):
+    return (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN) if children else (resource.RUSAGE_SELF,)
+
+
+def cpu_seconds(children=True):
+    """User + system CPU of this process and, with children=True, of its reaped children (mapper worker pools)."""
+    total = 0.0
+    for who in usage_targets(children):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def peak_rss_mb(children=True):
+    """Largest resident set so far of this process or any one child (ru_maxrss is KiB on Linux)."""
+    return max(resource.getrusage(who).ru_maxrss for who in usage_targets(children)) / 1024
+
+
+class Meter:
+    """Wall time, CPU time and peak RSS since construction, plus record and byte counters.
+
+    children=False leaves out child processes, for the driver whose children are the remote
+    commands (or, on the local backend, the tasks themselves).
+    """
+
+    def __init__(self, name, children=True):
+        self.name = name
+        self.children = children
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started = time.perf_counter()
+        self.cpu_started = cpu_seconds(children)
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counters[key] = self.counters.get(key, 0) + (value or 0)
+
+    def result(self, **extra):
+        metrics = {
+            "name": self.name,
+            "wall_seconds": time.perf_counter() - self.started,
+            "cpu_seconds": cpu_seconds(self.children) - self.cpu_started,
+            "peak_rss_mb": peak_rss_mb(self.children),
+        }
+        metrics.update(self.counters)
+        metrics.update(extra)
+        return metrics
+
+
+def report(metrics, stream=None):
+    print(f"TASK_METRICS: {json.dumps(metrics)}", file=stream or sys.stderr, flush=True)
+
+
+def parse_task_metrics(output):
+    """The TASK_METRICS dict in a task's output, or None."""
+    for line in output.splitlines():
+        if "TASK_METRICS:" in line:
+            try:
+                return json.loads(line.split("TASK_METRICS:", 1)[1])
+            except ValueError:
+                return None
+    return None
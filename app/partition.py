@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import heapq
+import json
+import os
+import random
+import struct
+import time
+import zlib
+
+from records import (
+    BINARY, BLOCK_RECORDS, COMPRESSION_EXT, NONE, RECORD_SIZE, RecordWriter, encode_records, open_stream, parse_id,
+)
+
+# Pairs hash into num_shards * BUCKETS_PER_SHARD virtual buckets; a partition table maps
+# buckets to reducers so heavy buckets can be spread out without changing the hash.
+BUCKETS_PER_SHARD = 64
+DEFAULT_SAMPLE_RATE = 0.01
+# Header of one block in a partitioned stream: <uint32 partition><uint32 payload bytes>
+FRAME = struct.Struct("<II")
+# Users whose friend-pair triangle is larger than this are estimated from a random subset of pairs
+MAX_SAMPLED_PAIRS = 200
+
+
+def id_value(user_id):
+    if isinstance(user_id, int):
+        return user_id
+    if user_id.isdigit():
+        return int(user_id)
+    return zlib.crc32(user_id.encode("utf-8"))
+
+
+def pair_hash(user_a, user_b):
+    """32-bit multiplicative hash of a numeric pair key (no string formatting, no digest)."""
+    h = (id_value(user_a) * 0x9E3779B1 + id_value(user_b) * 0x85EBCA77) & 0xFFFFFFFF
+    h ^= h >> 15
+    h = (h * 0x2C1B3C6D) & 0xFFFFFFFF
+    return h ^ (h >> 12)
+
+
+def shard_for_pair(user_a, user_b, num_reducers):
+    return pair_hash(user_a, user_b) % num_reducers
+
+
+class PartitionTable:
+    def __init__(self, assignment, num_shards, predicted=None):
+        self.assignment = list(assignment)
+        self.num_buckets = len(self.assignment)
+        self.num_shards = num_shards
+        self.predicted = predicted or {}
+
+    @classmethod
+    def uniform(cls, num_shards, buckets_per_shard=BUCKETS_PER_SHARD):
+        num_buckets = num_shards * buckets_per_shard
+        return cls([bucket % num_shards for bucket in range(num_buckets)], num_shards)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["assignment"], data["num_shards"], data.get("predicted"))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "num_shards": self.num_shards,
+                "num_buckets": self.num_buckets,
+                "assignment": self.assignment,
+                "predicted": self.predicted,
+            }, f)
+
+    def shard(self, user_a, user_b):
+        return self.assignment[pair_hash(user_a, user_b) % self.num_buckets]
+
+
+class LoadEstimator:
+    """Estimates mapper records and bytes per bucket from a random sample of adjacency lines."""
+
+    def __init__(self, num_buckets, fmt=BINARY, sample_rate=DEFAULT_SAMPLE_RATE,
+                 max_pairs=MAX_SAMPLED_PAIRS, seed=0):
+        self.num_buckets = num_buckets
+        self.fmt = fmt
+        self.parse_id = parse_id(fmt)
+        self.sample_rate = sample_rate
+        self.max_pairs = max_pairs
+        self.random = random.Random(seed)
+        self.records = [0.0] * num_buckets
+        self.bytes = [0.0] * num_buckets
+        self.sampled_users = 0
+
+    def _add(self, user_a, user_b, value, weight):
+        if user_b < user_a:
+            user_a, user_b = user_b, user_a
+        bucket = pair_hash(user_a, user_b) % self.num_buckets
+        self.records[bucket] += weight
+        if self.fmt == BINARY:
+            self.bytes[bucket] += weight * RECORD_SIZE
+        else:
+            self.bytes[bucket] += weight * (len(str(user_a)) + len(str(user_b)) + len(str(value)) + 3)
+
+    def observe(self, user, friends):
+        """Feed one adjacency line (raw string IDs); only sampled lines are parsed."""
+        if self.random.random() < self.sample_rate:
+            self._observe(user, friends)
+
+    def observe_line(self, line):
+        """observe() for a raw adjacency line (bytes); only sampled lines are decoded."""
+        if self.random.random() >= self.sample_rate:
+            return
+        user, _, friends = line.decode("utf-8").strip().partition("\t")
+        friends = [friend.strip() for friend in friends.split(",") if friend.strip()]
+        if user and friends:
+            self._observe(user, friends)
+
+    def observe_row(self, graph, line):
+        """observe() for one line of a CSR graph cache; only sampled lines are resolved to user IDs."""
+        if self.random.random() >= self.sample_rate:
+            return
+        ids = graph.ids
+        self._observe(str(ids[graph.line_users[line]]), [str(ids[friend]) for friend in graph.friends(line)])
+
+    def _observe(self, user, friends):
+        self.sampled_users += 1
+        user = self.parse_id(user)
+        friends = [self.parse_id(friend) for friend in friends]
+        scale = 1.0 / self.sample_rate
+        for friend in friends:
+            self._add(user, friend, -1, scale)
+
+        degree = len(friends)
+        total_pairs = degree * (degree - 1) // 2
+        if total_pairs == 0:
+            return
+        if total_pairs <= self.max_pairs:
+            for i in range(degree):
+                for j in range(i + 1, degree):
+                    self._add(friends[i], friends[j], user, scale)
+            return
+        weight = scale * total_pairs / self.max_pairs
+        for _ in range(self.max_pairs):
+            i, j = self.random.sample(range(degree), 2)
+            self._add(friends[i], friends[j], user, weight)
+
+
+def assign_buckets(records, bytes_, num_shards):
+    """Greedy longest-processing-time assignment balancing both records and bytes per shard."""
+    total_records = sum(records) or 1.0
+    total_bytes = sum(bytes_) or 1.0
+    cost = [records[b] / total_records + bytes_[b] / total_bytes for b in range(len(records))]
+
+    assignment = [0] * len(records)
+    shard_records = [0.0] * num_shards
+    shard_bytes = [0.0] * num_shards
+    heap = [(0.0, shard) for shard in range(num_shards)]
+    for bucket in sorted(range(len(records)), key=lambda b: -cost[b]):
+        load, shard = heapq.heappop(heap)
+        assignment[bucket] = shard
+        shard_records[shard] += records[bucket]
+        shard_bytes[shard] += bytes_[bucket]
+        heapq.heappush(heap, (load + cost[bucket], shard))
+
+    predicted = {"records": shard_records, "bytes": shard_bytes}
+    return PartitionTable(assignment, num_shards, predicted)
+
+
+def imbalance(loads):
+    """max / mean: 1.0 is a perfect split."""
+    mean = sum(loads) / len(loads) if loads else 0
+    return max(loads) / mean if mean else 1.0
+
+
+def partition_path(output_file, partition):
+    """mapper_output_0.bin -> mapper_output_0.p3.bin (mapper_output_0.bin.gz -> mapper_output_0.p3.bin.gz)"""
+    root, ext = os.path.splitext(output_file)
+    if ext and ext in COMPRESSION_EXT.values():
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return f"{root}.p{partition}{ext}"
+
+
+class PartitionedWriter:
+    """RecordWriter look-alike that routes every pair to one file per reducer shard."""
+
+    def __init__(self, output_file, fmt, table, compression=NONE, level=None):
+        self.table = table
+        self.paths = [partition_path(output_file, p) for p in range(table.num_shards)]
+        self.writers = [RecordWriter(path, fmt, compression, level) for path in self.paths]
+
+    def write(self, a, b, value):
+        self.writers[self.table.shard(a, b)].write(a, b, value)
+
+    def write_many(self, records):
+        for a, b, value in records:
+            self.write(a, b, value)
+
+    @property
+    def records(self):
+        return sum(writer.records for writer in self.writers)
+
+    def stats(self):
+        totals = {"records": 0, "raw_bytes": 0, "write_seconds": 0.0}
+        for writer in self.writers:
+            for key, value in writer.stats().items():
+                totals[key] += value
+        return totals
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FramedWriter:
+    """Partitioned output on one stream (stdout): each block of a shard's records is one frame,
+    so a reader can forward payloads to the right reducer without decoding records."""
+
+    def __init__(self, stream, fmt, table):
+        self.stream = stream
+        self.fmt = fmt
+        self.table = table
+        self.pending = [[] for _ in range(table.num_shards)]
+        self.records = 0
+        self.raw_bytes = 0
+        self.write_seconds = 0.0
+
+    def write(self, a, b, value):
+        shard = self.table.shard(a, b)
+        pending = self.pending[shard]
+        pending.append((a, b, value))
+        if len(pending) >= BLOCK_RECORDS:
+            self.flush(shard)
+
+    def write_many(self, records):
+        for a, b, value in records:
+            self.write(a, b, value)
+
+    def flush(self, shard):
+        pending = self.pending[shard]
+        if not pending:
+            return
+        payload = encode_records(pending, self.fmt)
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8")
+        started = time.perf_counter()
+        self.stream.write(FRAME.pack(shard, len(payload)))
+        self.stream.write(payload)
+        self.write_seconds += time.perf_counter() - started
+        self.raw_bytes += len(payload)
+        self.records += len(pending)
+        self.pending[shard] = []
+
+    def stats(self):
+        return {"records": self.records, "raw_bytes": self.raw_bytes, "write_seconds": self.write_seconds}
+
+    def close(self):
+        for shard in range(self.table.num_shards):
+            self.flush(shard)
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_frames(stream):
+    """Yield (partition, payload) frames from a FramedWriter stream until EOF."""
+    while True:
+        header = stream.read(FRAME.size)
+        if len(header) < FRAME.size:
+            return
+        partition, size = FRAME.unpack(header)
+        payload = stream.read(size)
+        if len(payload) < size:
+            raise EOFError(f"Truncated frame for partition {partition}")
+        yield partition, payload
+
+
+def open_writer(output_file, fmt, table=None, compression=NONE, level=None):
+    if table is not None and output_file == "-":
+        return FramedWriter(open_stream("-", "wb"), fmt, table)
+    if table is not None:
+        return PartitionedWriter(output_file, fmt, table, compression, level)
+    return RecordWriter(output_file, fmt, compression, level)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import gzip
+import io
+import itertools
+import struct
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Intermediate (mapper -> partitioner -> reducer) record formats.
+#   text:   "a,b<TAB>value\n"        (human readable, kept for debugging)
+#   binary: <uint32 a><uint32 b><int32 value>, little-endian, fixed 12 bytes
+TEXT = "text"
+BINARY = "binary"
+FORMATS = (TEXT, BINARY)
+
+RECORD = struct.Struct("<IIi")
+RECORD_SIZE = RECORD.size
+BLOCK_RECORDS = 1 << 16
+IO_BUFFER_BYTES = 1 << 20
+
+# Optional stream compression of intermediate files. zstd needs `pip install zstandard`.
+NONE = "none"
+GZIP = "gzip"
+ZSTD = "zstd"
+COMPRESSIONS = (NONE, GZIP, ZSTD)
+COMPRESSION_EXT = {NONE: "", GZIP: ".gz", ZSTD: ".zst"}
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+
+
+def open_stream(path, mode="rb", compression=NONE, level=None):
+    """Open a file for binary ("rb"/"wb") or text ("r"/"w") I/O through the chosen compressor.
+
+    "-" is stdin (read) or stdout (write), left open for the rest of the process.
+    """
+    binary_mode = mode if mode.endswith("b") else mode + "b"
+    if path == "-":
+        if compression != NONE:
+            raise ValueError("stdin/stdout streams are not compressed here (the ssh transport can compress them)")
+        raw = open(0 if binary_mode == "rb" else 1, binary_mode, buffering=IO_BUFFER_BYTES, closefd=False)
+    elif compression == NONE:
+        raw = open(path, binary_mode, buffering=IO_BUFFER_BYTES)
+    elif compression == GZIP:
+        level = DEFAULT_LEVELS[GZIP] if level is None else level
+        raw = gzip.open(path, binary_mode, compresslevel=level)
+    elif compression == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package (pip install zstandard)")
+        f = open(path, binary_mode, buffering=IO_BUFFER_BYTES)
+        if binary_mode == "wb":
+            level = DEFAULT_LEVELS[ZSTD] if level is None else level
+            raw = zstandard.ZstdCompressor(level=level).stream_writer(f, closefd=True)
+        else:
+            # Concatenated per-worker outputs hold several frames
+            raw = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+        raw = io.BufferedWriter(raw, IO_BUFFER_BYTES) if binary_mode == "wb" else io.BufferedReader(raw, IO_BUFFER_BYTES)
+    else:
+        raise ValueError(f"Unknown compression: {compression}")
+    if mode.endswith("b"):
+        return raw
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+
+def encode_records(records, fmt=TEXT):
+    """One block of (a, b, value) records as bytes (binary) or str (text)."""
+    if fmt == BINARY:
+        return b"".join(itertools.starmap(RECORD.pack, records))
+    return "".join(f"{a},{b}\t{value}\n" for a, b, value in records)
+
+
+def parse_id(fmt):
+    """ID parser for a format: binary records carry integer IDs, text keeps the raw string."""
+    return int if fmt == BINARY else str
+
+
+class RecordWriter:
+    def __init__(self, path, fmt=TEXT, compression=NONE, level=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown record format: {fmt}")
+        self.fmt = fmt
+        self.compression = compression
+        self.records = 0
+        # Uncompressed payload size and time spent in (compressing) writes
+        self.raw_bytes = 0
+        self.write_seconds = 0.0
+        self.file = open_stream(path, "wb" if fmt == BINARY else "w", compression, level)
+        self.pending = []
+
+    def write(self, a, b, value):
+        self.pending.append((a, b, value))
+        if len(self.pending) >= BLOCK_RECORDS:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.pending.append(record)
+            if len(self.pending) >= BLOCK_RECORDS:
+                self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        payload = encode_records(self.pending, self.fmt)
+        started = time.perf_counter()
+        self.file.write(payload)
+        self.write_seconds += time.perf_counter() - started
+        self.raw_bytes += len(payload)
+        self.records += len(self.pending)
+        self.pending = []
+
+    def stats(self):
+        return {"records": self.records, "raw_bytes": self.raw_bytes, "write_seconds": self.write_seconds}
+
+    def close(self):
+        self.flush()
+        started = time.perf_counter()
+        self.file.close()
+        self.write_seconds += time.perf_counter() - started
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path, fmt=TEXT, compression=NONE):
+    """Yield (a, b, value) tuples; values are ints, IDs are ints (binary) or strings (text)."""
+    if fmt == BINARY:
+        block_bytes = RECORD_SIZE * BLOCK_RECORDS
+        with open_stream(path, "rb", compression) as f:
+            leftover = b""
+            while True:
+                block = f.read(block_bytes)
+                if not block:
+                    return
+                # Decompressors may return short reads that split a record
+                if leftover:
+                    block = leftover + block
+                usable = len(block) - len(block) % RECORD_SIZE
+                leftover = block[usable:]
+                yield from RECORD.iter_unpack(memoryview(block)[:usable])
+    elif fmt == TEXT:
+        with open_stream(path, "r", compression) as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 2:
+                    continue
+                users = parts[0].split(",")
+                if len(users) != 2:
+                    continue
+                try:
+                    value = int(parts[1])
+                except ValueError:
+                    continue
+                yield users[0], users[1], value
+    else:
+        raise ValueError(f"Unknown record format: {fmt}")
@@ -1,55 +1,142 @@
 #!/usr/bin/env python3
+import argparse
+import heapq
+import math
 import os
+import random
+import shutil
 import sys
+import tempfile
+from bisect import bisect_right
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, groupby, islice
 
+import records
+from metrics import Meter, report
+from records import BINARY, NONE, RECORD, RECORD_SIZE, TEXT, RecordWriter, open_stream, read_records
+from spill import external_sort
+
+DEFAULT_TOP_K = 10
+DEFAULT_MEMORY_MB = 256
+# Approximate footprint of one buffered (user, candidate, count) tuple during the external sort
+SORT_ENTRY_BYTES = 120
+
+FRIENDS_MARKER = -1
+# --aggregate: the input is raw mapper output partitioned by the mappers themselves.
+# "counts" for combiner records (-1 or a count), "mutual" for one record per mutual friend.
+AGGREGATE_COUNTS = "counts"
+AGGREGATE_MUTUAL = "mutual"
+# --workers: records sampled across the whole input to place the user-ID range boundaries
+RANGE_SAMPLE_RECORDS = 1 << 16
+
+
+def sort_user_key(user_id):
+    if isinstance(user_id, int):
+        return user_id
+    return int(user_id) if user_id.isdigit() else user_id
+
+
+def rank_candidates(candidate_counts, top_k=DEFAULT_TOP_K):
+    """Candidates as (candidate, count), ordered by count desc then id asc; top_k=0 keeps all."""
+    ranked = (
+        (-count, sort_user_key(candidate), candidate)
+        for candidate, count in candidate_counts.items()
+    )
+    if top_k:
+        ranked = heapq.nsmallest(top_k, ranked)
+    else:
+        ranked = sorted(ranked)
+    return [(candidate, -neg_count) for neg_count, _, candidate in ranked]
 
-def reduce_friends(input_files, output_file):
-    user_recommendations = defaultdict(dict)
 
+def read_inputs(input_files, fmt=TEXT, compression=NONE, counters=None):
+    """Records of every input file in turn; `counters` gets records_in and bytes_read added."""
+    counters = {} if counters is None else counters
+    counters.setdefault("records_in", 0)
+    counters.setdefault("bytes_read", 0)
     print(f"[Reducer] Reading {len(input_files)} mapper output files...", file=sys.stderr)
     for idx, input_file in enumerate(input_files):
         print(f"[Reducer] Processing file {idx+1}/{len(input_files)}: {input_file}", file=sys.stderr)
         line_count = 0
-        with open(input_file, "r") as f:
-            for raw_line in f:
-                line_count += 1
-                if line_count % 100000 == 0:
-                    print(
-                        f"[Reducer]   ... processed {line_count} lines from this file",
-                        file=sys.stderr,
-                    )
-
-                line = raw_line.rstrip("\n")
-                if not line:
-                    continue
-
-                parts = line.split("\t")
-                if len(parts) != 2:
-                    continue
-
-                pair_key, count_str = parts
-                try:
-                    mutual_count = int(count_str)
-                except ValueError:
-                    continue
-
-                if mutual_count <= 0:
-                    continue
-
-                users = pair_key.split(",")
-                if len(users) != 2:
-                    continue
-
-                user1, user2 = users
-                user_recommendations[user1][user2] = mutual_count
-                user_recommendations[user2][user1] = mutual_count
+        for record in read_records(input_file, fmt, compression):
+            line_count += 1
+            if line_count % 100000 == 0:
+                print(
+                    f"[Reducer]   ... processed {line_count} lines from this file",
+                    file=sys.stderr,
+                )
+            yield record
 
+        counters["records_in"] += line_count
+        if input_file != "-":
+            counters["bytes_read"] += os.path.getsize(input_file)
+        elif fmt == BINARY:
+            counters["bytes_read"] += line_count * RECORD_SIZE
         print(
             f"[Reducer] ✓ Completed file {idx+1}/{len(input_files)} ({line_count} lines total)",
             file=sys.stderr,
         )
 
+
+def fold_pair(values, counted):
+    # Same rule as the driver-side partitioner: any -1 blocks the pair, otherwise values
+    # are mutual-friend counts (combiner output) or one mutual friend each (plain mapper).
+    total = 0
+    for value in values:
+        if value == FRIENDS_MARKER:
+            return 0
+        total += value if counted else 1
+    return total
+
+
+def aggregate_pairs(records, counted):
+    """Aggregate raw mapper records into one (a, b, mutual_count) per recommendable pair."""
+    pairs = {}
+    for user1, user2, value in records:
+        pair = (user1, user2)
+        state = pairs.get(pair)
+        if state is None:
+            state = pairs[pair] = [0, False]
+        if value == FRIENDS_MARKER:
+            state[1] = True
+        elif not state[1]:
+            state[0] += value if counted else 1
+    print(f"[Reducer] Aggregated {len(pairs)} distinct pairs", file=sys.stderr)
+    for (user1, user2), (count, blocked) in pairs.items():
+        if not blocked and count > 0:
+            yield user1, user2, count
+
+
+def aggregate_pairs_streaming(records, counted, max_items, spill_dir=None):
+    sorted_records = external_sort(records, max_items, spill_dir)
+    for (user1, user2), group in groupby(sorted_records, key=lambda record: record[:2]):
+        count = fold_pair((value for _, _, value in group), counted)
+        if count > 0:
+            yield user1, user2, count
+
+
+def reduce_friends(input_files, output_file, fmt=TEXT, top_k=DEFAULT_TOP_K, aggregate=None,
+                   compression=NONE, level=None, keep_user=None):
+    """Returns records_in, bytes_read, records_out (users) and bytes_written (uncompressed).
+
+    keep_user(user) limits the output to some users (a --workers sub-partition).
+    """
+    user_recommendations = defaultdict(dict)
+    counters = {}
+
+    pair_records = read_inputs(input_files, fmt, compression, counters)
+    if aggregate:
+        pair_records = aggregate_pairs(pair_records, aggregate == AGGREGATE_COUNTS)
+    for user1, user2, mutual_count in pair_records:
+        if mutual_count <= 0:
+            continue
+
+        if keep_user is None or keep_user(user1):
+            user_recommendations[user1][user2] = mutual_count
+        if keep_user is None or keep_user(user2):
+            user_recommendations[user2][user1] = mutual_count
+
     print(
         f"[Reducer] Aggregated recommendations for {len(user_recommendations)} users",
         file=sys.stderr,
@@ -59,28 +146,279 @@ def reduce_friends(input_files, output_file):
         f"[Reducer] Writing intermediate recommendations to {output_file}...",
         file=sys.stderr,
     )
-    with open(output_file, "w") as f:
-        for user in sorted(user_recommendations.keys(), key=lambda x: int(x) if x.isdigit() else x):
-            rec_items = user_recommendations[user].items()
-            sorted_recs = sorted(
-                rec_items,
-                key=lambda x: (-x[1], int(x[0]) if x[0].isdigit() else x[0]),
-            )
+    written = 0
+    with open_stream(output_file, "w", compression, level) as f:
+        for user in sorted(user_recommendations.keys(), key=sort_user_key):
+            sorted_recs = rank_candidates(user_recommendations[user], top_k)
             formatted = ",".join(f"{candidate}:{count}" for candidate, count in sorted_recs)
-            f.write(f"{user}\t{formatted}\n")
+            line = f"{user}\t{formatted}\n"
+            f.write(line)
+            written += len(line)
+    return dict(counters, records_out=len(user_recommendations), bytes_written=written)
+
+
+def directed_records(pair_records, keep_user=None):
+    for user1, user2, mutual_count in pair_records:
+        if mutual_count <= 0:
+            continue
+        user1 = sort_user_key(user1)
+        user2 = sort_user_key(user2)
+        if keep_user is None or keep_user(user1):
+            yield user1, user2, mutual_count
+        if keep_user is None or keep_user(user2):
+            yield user2, user1, mutual_count
+
+
+def user_groups(sorted_records):
+    for user, group in groupby(sorted_records, key=lambda record: record[0]):
+        yield user, {candidate: count for _, candidate, count in group}
+
+
+def format_recommendations(groups, top_k):
+    for user, candidate_counts in groups:
+        ranked = rank_candidates(candidate_counts, top_k)
+        formatted = ",".join(f"{candidate}:{count}" for candidate, count in ranked)
+        yield f"{user}\t{formatted}\n"
+
+
+def reduce_friends_streaming(input_files, output_file, fmt=TEXT, top_k=DEFAULT_TOP_K,
+                             memory_mb=DEFAULT_MEMORY_MB, spill_dir=None, aggregate=None,
+                             compression=NONE, level=None, keep_user=None):
+    # records -> (user, candidate, count) in both directions -> external sort by
+    # (user, candidate) -> one user group at a time -> formatted lines.
+    # Only the sort buffer and the current user's candidates are ever held in memory.
+    max_items = max(1, memory_mb * 1024 * 1024 // SORT_ENTRY_BYTES)
+    print(
+        f"[Reducer] Streaming {len(input_files)} input file(s), sort buffer {max_items} records",
+        file=sys.stderr,
+    )
+    counters = {}
+    pair_records = read_inputs(input_files, fmt, compression, counters)
+    if aggregate:
+        # Two sorts are live at once (pairs, then users), so they share the budget
+        max_items = max(1, max_items // 2)
+        pair_records = aggregate_pairs_streaming(
+            pair_records, aggregate == AGGREGATE_COUNTS, max_items, spill_dir
+        )
+    sorted_records = external_sort(directed_records(pair_records, keep_user), max_items, spill_dir)
+    users = 0
+    written = 0
+    with open_stream(output_file, "w", compression, level) as f:
+        for line in format_recommendations(user_groups(sorted_records), top_k):
+            f.write(line)
+            users += 1
+            written += len(line)
+    print(f"[Reducer] Wrote recommendations for {users} users", file=sys.stderr)
+    return dict(counters, records_out=users, bytes_written=written)
+
+
+def available_cpus():
+    # Respects CPU pinning (taskset, local host pools), unlike os.cpu_count()
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def parse_workers(value):
+    workers = available_cpus() if value == "auto" else int(value)
+    if workers <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'")
+    return workers
+
+
+def user_order_key(user):
+    # Order of every reducer output (sort_user_key), comparable across numeric and other IDs
+    key = sort_user_key(user)
+    return (0, key, "") if isinstance(key, int) else (1, 0, key)
+
+
+def range_key(fmt):
+    # Binary IDs are ints already: compare them directly
+    return (lambda user: user) if fmt == BINARY else user_order_key
+
+
+def range_boundaries(sample, workers, fmt=TEXT):
+    """Up to workers - 1 keys cutting the users of the sampled records into ranges of equal weight."""
+    key = range_key(fmt)
+    keys = sorted(key(user) for user1, user2, _ in sample for user in (user1, user2))
+    if not keys:
+        return []
+    return [keys[len(keys) * k // workers] for k in range(1, workers)]
+
+
+def stride_sample(input_files, size):
+    """Evenly spaced records of uncompressed binary files, read at their offsets without a pass."""
+    counts = [os.path.getsize(path) // RECORD_SIZE for path in input_files]
+    total = sum(counts)
+    positions = sorted({total * k // size for k in range(min(size, total))})
+    sample = []
+    first = 0
+    next_position = 0
+    for path, count in zip(input_files, counts):
+        with open(path, "rb") as f:
+            while next_position < len(positions) and positions[next_position] < first + count:
+                f.seek((positions[next_position] - first) * RECORD_SIZE)
+                sample.append(RECORD.unpack(f.read(RECORD_SIZE)))
+                next_position += 1
+        first += count
+    return sample
+
+
+def reservoir_sample(pair_records, size, seed=0):
+    """Uniform sample of `size` records in one pass (Li's algorithm L: O(size) random draws, not one per record)."""
+    rng = random.Random(seed)
+    pair_records = iter(pair_records)
+    sample = list(islice(pair_records, size))
+    if len(sample) < size:
+        return sample
+    # 1 - random() is in (0, 1], so the logs stay finite
+    weight = math.exp(math.log(1.0 - rng.random()) / size)
+    while weight < 1.0:
+        skip = math.floor(math.log(1.0 - rng.random()) / math.log(1.0 - weight))
+        record = next(islice(pair_records, skip, None), None)
+        if record is None:
+            break
+        sample[rng.randrange(size)] = record
+        weight *= math.exp(math.log(1.0 - rng.random()) / size)
+    return sample
+
+
+def sample_records(input_files, fmt, compression=NONE, size=RANGE_SAMPLE_RECORDS):
+    """Records spread over all of the input files, which are read again afterwards.
+
+    Mapper partitions come out in insertion order, or sorted by (a, b) after a combiner spill,
+    so no prefix of the input is a fair sample of its users.
+    """
+    if fmt == BINARY and compression == NONE:
+        return stride_sample(input_files, size)
+    return reservoir_sample(chain.from_iterable(read_records(path, fmt, compression) for path in input_files), size)
+
+
+def split_by_user_range(pair_records, fmt, boundaries, work_dir):
+    """Write each record to the sub-partition of both of its users; returns one path per range.
+
+    A pair lands whole in every range that outputs one of its users, so each sub-partition
+    aggregates its pairs on its own.
+    """
+    key = range_key(fmt)
+    paths = [os.path.join(work_dir, f"range_{k}{'.bin' if fmt == BINARY else '.txt'}")
+             for k in range(len(boundaries) + 1)]
+    writers = [RecordWriter(path, fmt) for path in paths]
+    try:
+        for user1, user2, value in pair_records:
+            first = bisect_right(boundaries, key(user1))
+            writers[first].write(user1, user2, value)
+            second = bisect_right(boundaries, key(user2))
+            if second != first:
+                writers[second].write(user1, user2, value)
+    finally:
+        for writer in writers:
+            writer.close()
+    print(f"[Reducer] Split {sum(writer.records for writer in writers)} records into {len(paths)} user ranges "
+          f"({', '.join(str(writer.records) for writer in writers)})", file=sys.stderr)
+    return paths
+
+
+def reduce_range(index, boundaries, input_file, output_file, options):
+    """Reduce one sub-partition into an uncompressed output holding only the users of range `index`."""
+    key = range_key(options.format)
+
+    def keep_user(user):
+        return bisect_right(boundaries, key(user)) == index
+
+    if options.streaming:
+        return reduce_friends_streaming([input_file], output_file, options.format, options.top_k,
+                                        options.memory_mb, options.spill_dir, options.aggregate,
+                                        keep_user=keep_user)
+    return reduce_friends([input_file], output_file, options.format, options.top_k, options.aggregate,
+                          keep_user=keep_user)
+
+
+def reduce_parallel(input_files, output_file, options):
+    # A sample of the whole input places the user-ID range boundaries and one pass splits the input
+    # by range. Each range is reduced in its own process with the usual semantics and outputs its
+    # users in order, so the outputs concatenate in user order.
+    counters = {}
+    work_dir = tempfile.mkdtemp(prefix="reducer-ranges-", dir=options.spill_dir)
+    try:
+        pair_records = read_inputs(input_files, options.format, options.compression, counters)
+        if "-" in input_files:
+            # stdin can only be read once: stage it for the sampling pass
+            staged = os.path.join(work_dir, "input")
+            with RecordWriter(staged, options.format) as writer:
+                writer.write_many(pair_records)
+            sample = sample_records([staged], options.format)
+            pair_records = read_records(staged, options.format)
+        else:
+            sample = sample_records(input_files, options.format, options.compression)
+        boundaries = range_boundaries(sample, options.workers, options.format)
+        paths = split_by_user_range(pair_records, options.format, boundaries, work_dir)
+        outputs = [os.path.join(work_dir, f"output_{k}.txt") for k in range(len(paths))]
+        worker_options = argparse.Namespace(**vars(options))
+        worker_options.memory_mb = max(1, options.memory_mb // options.workers)
+        with ProcessPoolExecutor(max_workers=len(paths)) as pool:
+            futures = [
+                pool.submit(reduce_range, index, boundaries, path, worker_output, worker_options)
+                for index, (path, worker_output) in enumerate(zip(paths, outputs))
+            ]
+            results = [future.result() for future in futures]
+        with open_stream(output_file, "w", options.compression, options.compression_level) as out:
+            for worker_output in outputs:
+                with open(worker_output, encoding="utf-8", newline="") as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return dict(counters, records_out=sum(stats["records_out"] for stats in results),
+                bytes_written=sum(stats["bytes_written"] for stats in results))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
+    parser = argparse.ArgumentParser(
+        usage="reducer.py [options] <input_file1> [<input_file2> ...] <output_file>  ('-' = stdin / stdout)"
+    )
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--format", choices=records.FORMATS, default=TEXT,
+                        help="format of the input partition records")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K,
+                        help="candidates kept per user (0 writes every candidate)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="external-sort the input in bounded memory instead of loading it")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+                        help="sort buffer budget for --streaming")
+    parser.add_argument("--spill-dir", default=None,
+                        help="directory for sorted runs (default: system temp dir)")
+    parser.add_argument("--aggregate", choices=(AGGREGATE_COUNTS, AGGREGATE_MUTUAL), default=None,
+                        help="inputs are mapper-partitioned raw records that still need per-pair aggregation")
+    parser.add_argument("--compression", choices=records.COMPRESSIONS, default=NONE,
+                        help="compression of the input partitions and of the output file")
+    parser.add_argument("--compression-level", type=int, default=None,
+                        help="compressor level for the output (default: gzip 6, zstd 3)")
+    parser.add_argument("--workers", type=parse_workers, default=1,
+                        help="reduce N user-ID ranges in parallel processes ('auto' = one per core)")
+    args = parser.parse_args()
+    meter = Meter("reducer")
+    if len(args.paths) < 2:
         print("Usage: reducer.py <input_file1> [<input_file2> ...] <output_file>", file=sys.stderr)
         sys.exit(1)
 
-    input_files = sys.argv[1:-1]
-    output_file = sys.argv[-1]
+    input_files = args.paths[:-1]
+    output_file = args.paths[-1]
 
     print(
         f"Reducer processing {len(input_files)} mapper output(s) -> {output_file}",
         file=sys.stderr,
     )
-    reduce_friends(input_files, output_file)
+    if args.workers > 1:
+        stats = reduce_parallel(input_files, output_file, args)
+    elif args.streaming:
+        stats = reduce_friends_streaming(input_files, output_file, args.format, args.top_k,
+                                 args.memory_mb, args.spill_dir, args.aggregate,
+                                 args.compression, args.compression_level)
+    else:
+        stats = reduce_friends(input_files, output_file, args.format, args.top_k, args.aggregate,
+                       args.compression, args.compression_level)
     print(f"Reducer complete: {output_file}", file=sys.stderr)
+    if output_file != "-" and args.compression != NONE:
+        stats["bytes_written"] = os.path.getsize(output_file)
+    meter.add(**stats)
+    report(meter.result(streaming=args.streaming, workers=args.workers))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+# Direct mapper -> reducer shuffle over the cluster's private network.
+# Every reducer runs `shuffle.py serve` and every mapper pushes its partition files with
+# `shuffle.py send`, so shuffle bytes never go through the driver.
+#
+# One connection carries one file: <uint16 name length><uint64 payload bytes><name><payload>,
+# answered with a single ACK byte once the file is on the reducer's disk.
+
+HEADER = struct.Struct("<HQ")
+ACK = b"\x01"
+IO_BUFFER_BYTES = 1 << 20
+CONNECT_RETRY_SECONDS = 60
+
+
+def recv_exact(conn, size):
+    data = bytearray()
+    while len(data) < size:
+        block = conn.recv(min(size - len(data), IO_BUFFER_BYTES))
+        if not block:
+            raise EOFError(f"connection closed after {len(data)} of {size} bytes")
+        data += block
+    return bytes(data)
+
+
+def receive_file(conn, output_dir):
+    name_size, size = HEADER.unpack(recv_exact(conn, HEADER.size))
+    name = os.path.basename(recv_exact(conn, name_size).decode("utf-8"))
+    if not name:
+        raise ValueError("empty file name")
+    path = os.path.join(output_dir, name)
+    # Retried or speculative mappers may push the same file concurrently: each copy lands in its own
+    # partial file and the rename keeps whichever completes last (the contents are identical)
+    fd, partial = tempfile.mkstemp(prefix=f"{name}.", suffix=".part", dir=output_dir)
+    remaining = size
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while remaining:
+                block = conn.recv(min(remaining, IO_BUFFER_BYTES))
+                if not block:
+                    raise EOFError(f"{name}: connection closed with {remaining} bytes left")
+                f.write(block)
+                remaining -= len(block)
+        os.replace(partial, path)
+    except BaseException:
+        os.remove(partial)
+        raise
+    conn.sendall(ACK)
+    return name, size
+
+
+def serve(port, output_dir, expected, bind="0.0.0.0", timeout=None):
+    """Accept files into `output_dir` until `expected` distinct names arrived, then return
+    {"files", "bytes", "seconds"}. A failed or duplicate transfer is logged, not fatal: the
+    mapper task retries it."""
+    os.makedirs(output_dir, exist_ok=True)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((bind, port))
+    server.listen(16)
+    server.settimeout(1.0)
+    # The driver waits for this line before it starts the mappers
+    print(f"LISTENING: {port}", flush=True)
+
+    received = {}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    last_activity = time.monotonic()
+
+    def handle(conn, address):
+        try:
+            with conn:
+                name, size = receive_file(conn, output_dir)
+            with lock:
+                received[name] = size
+            print(f"[Shuffle] Received {name} ({size} bytes) from {address[0]}", file=sys.stderr)
+        except (OSError, EOFError, ValueError) as exc:
+            print(f"[Shuffle] Transfer from {address[0]} failed: {exc}", file=sys.stderr)
+
+    handlers = []
+    try:
+        while True:
+            with lock:
+                if len(received) >= expected:
+                    break
+            if timeout is not None and time.monotonic() - last_activity > timeout:
+                raise RuntimeError(f"timed out with {len(received)} of {expected} files")
+            try:
+                conn, address = server.accept()
+            except socket.timeout:
+                continue
+            last_activity = time.monotonic()
+            handler = threading.Thread(target=handle, args=(conn, address), daemon=True)
+            handler.start()
+            handlers.append(handler)
+    finally:
+        server.close()
+    for handler in handlers:
+        handler.join()
+    return {"files": len(received), "bytes": sum(received.values()), "seconds": time.perf_counter() - started}
+
+
+def send(host, port, path, name=None):
+    """Push one file to a reducer's `serve`; retries the connection while the receiver starts."""
+    name = (name or os.path.basename(path)).encode("utf-8")
+    size = os.path.getsize(path)
+    deadline = time.monotonic() + CONNECT_RETRY_SECONDS
+    while True:
+        try:
+            conn = socket.create_connection((host, port), timeout=30)
+            break
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.5)
+    with conn, open(path, "rb") as f:
+        conn.settimeout(None)
+        conn.sendall(HEADER.pack(len(name), size) + name)
+        with conn.makefile("wb", buffering=IO_BUFFER_BYTES) as stream:
+            shutil.copyfileobj(f, stream, IO_BUFFER_BYTES)
+        if recv_exact(conn, 1) != ACK:
+            raise EOFError(f"{host}:{port} did not acknowledge {path}")
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="shuffle.py serve|send [options]")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="receive partition files from the mappers")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--dir", required=True, help="directory the received files are written to")
+    serve_parser.add_argument("--expect", type=int, required=True,
+                              help="number of distinct files to receive before exiting")
+    serve_parser.add_argument("--bind", default="0.0.0.0")
+    serve_parser.add_argument("--timeout", type=float, default=3600,
+                              help="seconds to wait for the next sender before giving up")
+    send_parser = commands.add_parser("send", help="push files to one reducer")
+    send_parser.add_argument("host")
+    send_parser.add_argument("port", type=int)
+    send_parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            stats = serve(args.port, os.path.expanduser(args.dir), args.expect, args.bind, args.timeout)
+        except (OSError, RuntimeError) as exc:
+            print(f"[Shuffle] ERROR: {exc}", file=sys.stderr)
+            sys.exit(1)
+        print(f"SHUFFLE_STATS: {json.dumps(stats)}", flush=True)
+    else:
+        started = time.perf_counter()
+        total = 0
+        for path in args.files:
+            total += send(args.host, args.port, path)
+        elapsed = time.perf_counter() - started
+        print(f"[Shuffle] Sent {len(args.files)} file(s), {total} bytes to {args.host}:{args.port} "
+              f"in {elapsed:.2f}s", file=sys.stderr)
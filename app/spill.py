@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import heapq
+import os
+import pickle
+import tempfile
+
+# Tuples are pickled in small batches: a k-way merge holds one batch per run in memory
+RUN_BATCH_SIZE = 4096
+
+
+def write_run(items, spill_dir=None):
+    fd, path = tempfile.mkstemp(prefix="run_", suffix=".bin", dir=spill_dir)
+    with os.fdopen(fd, "wb") as f:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= RUN_BATCH_SIZE:
+                pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+                batch = []
+        if batch:
+            pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def read_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+
+def merge_runs(run_paths, tail=(), key=None):
+    """Yield items of sorted runs on disk (plus an optional sorted in-memory tail) in order."""
+    streams = [read_run(path) for path in run_paths]
+    streams.append(iter(tail))
+    return heapq.merge(*streams, key=key)
+
+
+def remove_runs(run_paths):
+    for path in run_paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def external_sort(items, max_items, spill_dir=None, key=None):
+    """Sort an arbitrarily long stream holding at most `max_items` in memory at a time."""
+    runs = []
+    buffer = []
+    try:
+        for item in items:
+            buffer.append(item)
+            if len(buffer) >= max_items:
+                buffer.sort(key=key)
+                runs.append(write_run(buffer, spill_dir))
+                buffer = []
+        buffer.sort(key=key)
+        if not runs:
+            yield from buffer
+            return
+        yield from merge_runs(runs, buffer, key=key)
+    finally:
+        remove_runs(runs)
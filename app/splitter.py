@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+import bisect
+import heapq
+import mmap
+import os
+import re
+import sys
+from array import array
+from collections import deque
+from itertools import accumulate, compress, repeat
+from operator import add, floordiv, mul, sub
+
+
+def line_aligned_ranges(path, parts):
+    """Split a file into at most `parts` (start, end) byte ranges that begin and end on line boundaries."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    cuts = [0]
+    with open(path, "rb") as f:
+        for i in range(1, parts):
+            target = max(size * i // parts, cuts[-1], 1)
+            if target >= size:
+                break
+            # Move the cut to just after the next newline, unless it already sits on one
+            f.seek(target - 1)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > cuts[-1]:
+                cuts.append(position)
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def read_lines(path, start=0, end=None):
+    """Yield decoded lines of the byte range [start, end) of a file (the whole file by default); "-" is stdin."""
+    if path == "-":
+        for raw in sys.stdin.buffer:
+            yield raw.decode("utf-8")
+        return
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        for raw in f:
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                remaining -= len(raw)
+            yield raw.decode("utf-8")
+
+
+def pair_work(degree, rows=None):
+    """Records a mapper emits for the first `rows` rows of a friend list: one marker plus one pair per later friend."""
+    rows = degree if rows is None else rows
+    return rows + rows * (2 * degree - rows - 1) // 2
+
+
+def row_bands(degree, max_work):
+    """Cut the friend-pair triangle of one adjacency line into (start, end) row bands of at most `max_work` records.
+
+    Row i holds the friendship marker for friends[i] and the pairs (friends[i], friends[j]) for j > i,
+    so the bands together emit exactly the records of the whole line.
+    """
+    bands = []
+    start = 0
+    work = 0
+    for i in range(degree):
+        row = degree - i
+        if work and work + row > max_work:
+            bands.append((start, i))
+            start, work = i, 0
+        work += row
+    if degree:
+        bands.append((start, degree))
+    return bands
+
+
+def format_band(user, friends, start, end):
+    """Adjacency line for rows [start, end): only friends[start:] are needed, the third field counts the rows."""
+    return f"{user}\t{','.join(friends[start:])}\t{end - start}\n"
+
+
+# Single-pass scan of the adjacency file for the driver: mapper work per line, sparse
+# (offset, cumulative work) checkpoints, the heaviest lines and the user universe.
+SCAN_BLOCK_BYTES = 16 << 20
+CHECKPOINT_LINES = 1024
+ID_SEPARATORS = bytes.maketrans(b"\t,\r", b"   ")
+NON_ID_BYTES = b"0123456789\t,\r\n "
+LEADING_ZERO = re.compile(rb"(?:^|[\t, \n])0\d")
+
+
+def line_work(line):
+    """Mapper records of one raw adjacency line (bytes), without decoding it."""
+    tab = line.find(b"\t")
+    if tab < 0:
+        return 0
+    friends = line[tab + 1:].strip()
+    return pair_work(friends.count(b",") + 1) if friends else 0
+
+
+def user_order_key(user_id):
+    """Order of every user listing: the final output, the reducer outputs and UserSet.
+
+    Digit strings sort by value (zero-padded ones too), then the other IDs as strings.
+    """
+    return (0, int(user_id), "") if user_id.isdigit() else (1, 0, user_id)
+
+
+class UserSet:
+    """User-ID universe: one flag byte per numeric ID (the IDs are dense), a set for anything else.
+
+    Zero-padded digit IDs such as "007" stay in the set, as their own users.
+    """
+
+    def __init__(self):
+        self.flags = bytearray()
+        self.other = set()
+
+    def _flag(self, ids):
+        top = max(ids, default=-1)
+        if top >= len(self.flags):
+            self.flags.extend(bytes(top + 1 - len(self.flags)))
+        # map() keeps the per-ID loop in C
+        deque(map(self.flags.__setitem__, ids, repeat(1)), maxlen=0)
+
+    def add_block(self, block):
+        """Add every ID of a block of whole adjacency lines."""
+        if not block.translate(None, NON_ID_BYTES) and not LEADING_ZERO.search(block):
+            self._flag(array("q", map(int, block.translate(ID_SEPARATORS).split())))
+            return
+        for token in block.translate(ID_SEPARATORS).split():
+            self.add(token.decode("utf-8"))
+
+    def add(self, user_id):
+        if user_id.isdigit() and (user_id == "0" or not user_id.startswith("0")):
+            self._flag([int(user_id)])
+        else:
+            self.other.add(user_id)
+
+    def __contains__(self, user_id):
+        if user_id.isdigit() and (user_id == "0" or not user_id.startswith("0")):
+            value = int(user_id)
+            return value < len(self.flags) and self.flags[value] == 1
+        return user_id in self.other
+
+    def __len__(self):
+        return self.flags.count(1) + len(self.other)
+
+    def __iter__(self):
+        """Every ID as a string, in user_order_key order: the final merge walks it next to the reducer outputs."""
+        numeric = map(str, compress(range(len(self.flags)), self.flags))
+        padded = sorted((user_id for user_id in self.other if user_id.isdigit()), key=user_order_key)
+        if padded:
+            numeric = heapq.merge(numeric, padded, key=user_order_key)
+        yield from numeric
+        yield from sorted(user_id for user_id in self.other if not user_id.isdigit())
+
+
+def join_users(users, entries, counters):
+    """(user, value or None) for every user of `users`, joined with (user, value) `entries`.
+
+    Both sides come in user_order_key order. IDs with equal keys ("7", "007") may come in any
+    order on either side, so entries are matched by exact ID within a key. Entries of users not
+    in `users` are skipped and counted in counters["unknown_users"].
+    """
+    counters.setdefault("unknown_users", 0)
+    entries = iter(entries)
+    pending = next(entries, None)
+    same_key = {}
+    current = None
+    for user in users:
+        key = user_order_key(user)
+        if key != current:
+            counters["unknown_users"] += len(same_key)
+            same_key = {}
+            current = key
+            while pending is not None and user_order_key(pending[0]) <= key:
+                if user_order_key(pending[0]) == key:
+                    same_key[pending[0]] = pending[1]
+                else:
+                    counters["unknown_users"] += 1
+                pending = next(entries, None)
+        yield user, same_key.pop(user, None)
+    counters["unknown_users"] += len(same_key) + (pending is not None) + sum(1 for _ in entries)
+
+
+class InputScan:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.lines = 0
+        self.total_work = 0
+        # Offset of every CHECKPOINT_LINES-th line and the work of all lines before it
+        self.checkpoint_offsets = array("Q")
+        self.checkpoint_work = array("Q")
+        # (work, offset, length, work before the line) of the heaviest lines, as a min-heap
+        self.heavy = []
+        self.users = UserSet()
+
+
+def scan_input(path, keep_heaviest, observe=None):
+    """One pass over a memory-mapped adjacency file; `observe(line)` sees every non-empty raw line."""
+    scan = InputScan(path, os.path.getsize(path))
+    if scan.size == 0:
+        return scan
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = 0
+        while position < scan.size:
+            end = mm.find(b"\n", min(position + SCAN_BLOCK_BYTES, scan.size) - 1)
+            end = scan.size if end < 0 else end + 1
+            block = mm[position:end]
+            scan.users.add_block(block)
+            offset = position
+            lines = block.split(b"\n")
+            tail = lines.pop()
+            for line in lines + ([tail] if tail else []):
+                if scan.lines % CHECKPOINT_LINES == 0:
+                    scan.checkpoint_offsets.append(offset)
+                    scan.checkpoint_work.append(scan.total_work)
+                work = line_work(line)
+                if work:
+                    entry = (work, offset, min(len(line) + 1, scan.size - offset), scan.total_work)
+                    if len(scan.heavy) < keep_heaviest:
+                        heapq.heappush(scan.heavy, entry)
+                    elif work > scan.heavy[0][0]:
+                        heapq.heappushpop(scan.heavy, entry)
+                    if observe is not None:
+                        observe(line)
+                scan.total_work += work
+                scan.lines += 1
+                offset += len(line) + 1
+            position = end
+    return scan
+
+
+def scan_graph(graph, keep_heaviest, observe=None):
+    """scan_input() from a CSR graph cache (app/graph_cache.py): the same InputScan, no text parsing.
+
+    `observe(graph, line)` sees every line with friends, in file order.
+    """
+    scan = InputScan(graph.source, graph.size)
+    scan.lines = graph.num_lines
+    degrees = array("q", map(sub, graph.offsets[1:], graph.offsets[:-1]))
+    # pair_work(d) = d(d + 1) / 2, element-wise in C
+    works = array("q", map(floordiv, map(mul, degrees, map(add, degrees, repeat(1))), repeat(2)))
+    before = array("q", accumulate(works, initial=0))
+    scan.total_work = before[-1]
+    scan.checkpoint_offsets = array("Q", graph.line_offsets[:-1:CHECKPOINT_LINES])
+    scan.checkpoint_work = array("Q", before[:-1:CHECKPOINT_LINES])
+    heaviest = heapq.nlargest(keep_heaviest, compress(range(graph.num_lines), works), key=works.__getitem__)
+    scan.heavy = [(works[line], graph.line_offsets[line], graph.line_offsets[line + 1] - graph.line_offsets[line],
+                   before[line]) for line in heaviest]
+    heapq.heapify(scan.heavy)
+    scan.users._flag(graph.ids)
+    if observe is not None:
+        for line in compress(range(graph.num_lines), degrees):
+            observe(graph, line)
+    return scan
+
+
+def line_end_at(mm, scan, target, start, start_work):
+    """End offset and cumulative work of the first line from `start` whose cumulative work reaches `target`."""
+    k = bisect.bisect_left(scan.checkpoint_work, target) - 1
+    offset, work = start, start_work
+    if k >= 0 and scan.checkpoint_offsets[k] > start:
+        offset, work = scan.checkpoint_offsets[k], scan.checkpoint_work[k]
+    while offset < scan.size:
+        end = mm.find(b"\n", offset)
+        end = scan.size if end < 0 else end + 1
+        work += line_work(mm[offset:end])
+        offset = end
+        if work >= target:
+            break
+    return offset, work
+
+
+def plan_chunks(scan, parts, max_piece=None):
+    """Cut a scanned input into `parts` chunks of about equal mapper work.
+
+    A chunk is a list of pieces: (offset, length) byte ranges of the input file, or band lines (str)
+    for the lines heavier than `max_piece`, split into row bands spread over consecutive chunks.
+    Returns (chunks, work per chunk, hub lines, hub bands).
+    """
+    chunks = [[] for _ in range(parts)]
+    chunk_work = [0] * parts
+    target = scan.total_work / parts
+    hubs = sorted((offset, length, before) for work, offset, length, before in scan.heavy
+                  if max_piece is not None and work > max_piece)
+    state = {"current": 0, "done": 0, "position": 0}
+
+    def advance():
+        while state["current"] < parts - 1 and state["done"] >= (state["current"] + 1) * target:
+            state["current"] += 1
+
+    def take(end, work):
+        if end > state["position"]:
+            chunks[state["current"]].append((state["position"], end - state["position"]))
+            chunk_work[state["current"]] += work - state["done"]
+        state["position"], state["done"] = end, work
+        advance()
+
+    def take_span(end, end_work):
+        # Regular lines up to `end`, cut wherever a chunk boundary falls inside them
+        while state["position"] < end:
+            boundary = (state["current"] + 1) * target
+            if state["current"] == parts - 1 or end_work < boundary:
+                take(end, end_work)
+                return
+            take(*line_end_at(mm, scan, boundary, state["position"], state["done"]))
+
+    bands = 0
+    with open(scan.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset, length, before in hubs:
+            take_span(offset, before)
+            user, _, friends = mm[offset:offset + length].decode("utf-8").strip().partition("\t")
+            friends = [friend.strip() for friend in friends.split(",") if friend.strip()]
+            for start, end in row_bands(len(friends), max_piece):
+                work = pair_work(len(friends) - start, end - start)
+                chunks[state["current"]].append(format_band(user, friends, start, end))
+                chunk_work[state["current"]] += work
+                state["done"] += work
+                bands += 1
+                advance()
+            state["position"] = offset + length
+        take_span(scan.size, scan.total_work)
+    return chunks, chunk_work, len(hubs), bands
+
+
+def write_chunk(stream, path, pieces, block_bytes=1 << 20):
+    """Write a planned chunk to a binary stream straight from the memory-mapped input."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            for piece in pieces:
+                if isinstance(piece, str):
+                    stream.write(piece.encode("utf-8"))
+                    continue
+                offset, length = piece
+                for start in range(offset, offset + length, block_bytes):
+                    stream.write(view[start:min(start + block_bytes, offset + length)])
+        finally:
+            view.release()
+
+
+def chunk_bytes(pieces):
+    return sum(len(piece.encode("utf-8")) if isinstance(piece, str) else piece[1] for piece in pieces)
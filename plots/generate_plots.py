@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import json
+import os
 import sys
 from collections import defaultdict
 
@@ -119,4 +120,145 @@ for method in sorted(method_times.keys()):
 with open("artifacts/summary_statistics.json", "w") as f:
     json.dump(summary_stats, f, indent=2)
 
+FRIEND_REC_METRICS = "artifacts/friend_rec_metrics.json"
+if os.path.exists(FRIEND_REC_METRICS):
+    with open(FRIEND_REC_METRICS) as f:
+        friend_rec = json.load(f)
+
+    print("Generating Plot 4: Friend recommendation stage breakdown...")
+    stages = friend_rec["stages"]
+    names = [s["stage"] for s in stages]
+    x = np.arange(len(names))
+    width = 0.38
+    fig, (ax_time, ax_bytes) = plt.subplots(1, 2, figsize=(14, 6))
+
+    ax_time.bar(x - width / 2, [s["wall_seconds"] for s in stages], width, label='Wall', alpha=0.7)
+    ax_time.bar(x + width / 2, [s["cpu_seconds"] or 0 for s in stages], width, label='CPU (all tasks)', alpha=0.7)
+    ax_time.set_ylabel('Time (s)')
+    ax_time.set_title(f'Stage Time ({friend_rec["mappers"]} mappers, {friend_rec["reducers"]} reducers, '
+                      f'{friend_rec["pipeline_seconds"]:.1f}s total)')
+    ax_time.set_xticks(x)
+    ax_time.set_xticklabels(names)
+    ax_time.legend()
+    ax_time.grid(axis='y', alpha=0.3)
+
+    width = 0.27
+    for i, (key, label) in enumerate([("bytes_read", "Read"), ("bytes_written", "Written"),
+                                      ("bytes_transferred", "Transferred")]):
+        ax_bytes.bar(x + (i - 1) * width, [s[key] / (1024 * 1024) for s in stages], width, label=label, alpha=0.7)
+    ax_bytes.set_ylabel('MB')
+    ax_bytes.set_title('Stage Data Volume')
+    ax_bytes.set_xticks(x)
+    ax_bytes.set_xticklabels(names)
+    ax_bytes.legend()
+    ax_bytes.grid(axis='y', alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig('artifacts/plot_stage_breakdown.png', dpi=150)
+    print("  Saved: artifacts/plot_stage_breakdown.png")
+
+    print("Generating Plot 5: Friend recommendation task timeline...")
+    # One row per host plus one for the driver's own stages; losing / failed attempts are hatched
+    hosts = sorted({t["host"] for t in friend_rec["tasks"]})
+    rows = ["driver"] + hosts
+    phase_colors = {"mappers": '#1f77b4', "reducers": '#ff7f0e'}
+    stage_colors = {"split": '#2ca02c', "partition": '#9467bd', "merge": '#8c564b'}
+    fig, ax = plt.subplots(figsize=(14, max(4, 0.5 * len(rows) + 2)))
+
+    for stage in stages:
+        if stage["stage"] in stage_colors and stage["start"] is not None:
+            ax.barh(0, stage["end"] - stage["start"], left=stage["start"], height=0.6,
+                    color=stage_colors[stage["stage"]], alpha=0.8, label=stage["stage"])
+    for task in friend_rec["tasks"]:
+        won = task["outcome"] == "won"
+        ax.barh(rows.index(task["host"]), task["end"] - task["start"], left=task["start"], height=0.6,
+                color=phase_colors.get(task.get("phase"), '#7f7f7f'), alpha=0.8 if won else 0.35,
+                hatch=None if won else '//', edgecolor='black', linewidth=0.5)
+        ax.text(task["start"] + (task["end"] - task["start"]) / 2, rows.index(task["host"]), task["task"],
+                ha='center', va='center', fontsize=7)
+
+    handles, labels = ax.get_legend_handles_labels()
+    handles += [plt.Rectangle((0, 0), 1, 1, color=color, alpha=0.8) for color in phase_colors.values()]
+    labels += list(phase_colors)
+    ax.legend(handles, labels, loc='upper left', fontsize=8)
+    ax.set_yticks(range(len(rows)))
+    ax.set_yticklabels(rows)
+    ax.invert_yaxis()
+    ax.set_xlabel('Seconds since pipeline start')
+    ax.set_title('Friend Recommendation Task Timeline')
+    ax.grid(axis='x', alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig('artifacts/plot_task_timeline.png', dpi=150)
+    print("  Saved: artifacts/plot_task_timeline.png")
+
+SCALING_STUDY = "artifacts/scaling_study.json"
+if os.path.exists(SCALING_STUDY):
+    with open(SCALING_STUDY) as f:
+        scaling = json.load(f)
+    modes = [mode for mode in ("strong", "weak") if mode in scaling]
+
+    print("Generating Plot 6: Scaling speedup...")
+    fig, axes = plt.subplots(1, len(modes), figsize=(7 * len(modes), 6), squeeze=False)
+    for ax, mode in zip(axes[0], modes):
+        points = scaling[mode]["points"]
+        base_hosts = points[0]["hosts"]
+        for reducers in scaling["reducers"]:
+            line = [p for p in points if p["reducers"] == reducers]
+            if line:
+                ax.plot([p["hosts"] for p in line], [p["speedup"] for p in line], marker='o',
+                        label=f'{reducers} reducer(s)')
+        hosts = sorted({p["hosts"] for p in points})
+        ax.plot(hosts, [h / base_hosts for h in hosts], linestyle='--', color='gray', label='Ideal')
+        ax.set_xlabel('Hosts (mappers + reducers)')
+        ax.set_ylabel('Speedup' if mode == "strong" else 'Scaled speedup')
+        ax.set_title(f'{mode.capitalize()} Scaling Speedup')
+        ax.legend()
+        ax.grid(alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig('artifacts/plot_scaling_speedup.png', dpi=150)
+    print("  Saved: artifacts/plot_scaling_speedup.png")
+
+    print("Generating Plot 7: Scaling efficiency...")
+    fig, axes = plt.subplots(len(modes), 2, figsize=(14, 6 * len(modes)), squeeze=False)
+    for (ax_grid, ax_phase), mode in zip(axes, modes):
+        points = scaling[mode]["points"]
+        # Parallel efficiency over the mapper x reducer grid (NaN where a run failed)
+        grid_values = np.full((len(scaling["mappers"]), len(scaling["reducers"])), np.nan)
+        for p in points:
+            grid_values[scaling["mappers"].index(p["mappers"]), scaling["reducers"].index(p["reducers"])] = \
+                p["efficiency"]
+        image = ax_grid.imshow(grid_values, cmap='RdYlGn', vmin=0, vmax=max(1.0, np.nanmax(grid_values)),
+                               origin='lower')
+        for i in range(grid_values.shape[0]):
+            for j in range(grid_values.shape[1]):
+                if not np.isnan(grid_values[i, j]):
+                    ax_grid.text(j, i, f'{grid_values[i, j]:.2f}', ha='center', va='center')
+        ax_grid.set_xticks(range(len(scaling["reducers"])))
+        ax_grid.set_xticklabels(scaling["reducers"])
+        ax_grid.set_yticks(range(len(scaling["mappers"])))
+        ax_grid.set_yticklabels(scaling["mappers"])
+        ax_grid.set_xlabel('Reducers')
+        ax_grid.set_ylabel('Mappers')
+        ax_grid.set_title(f'{mode.capitalize()} Scaling Parallel Efficiency')
+        fig.colorbar(image, ax=ax_grid)
+
+        for stage in ("map", "reduce"):
+            ax_phase.plot([p["hosts"] for p in points], [p["stage_efficiency"].get(stage, np.nan) for p in points],
+                          marker='o', linestyle='', label=stage)
+        ax_phase.plot([p["hosts"] for p in points], [p["efficiency"] for p in points], marker='s', linestyle='',
+                      color='black', label='pipeline')
+        ax_phase.axhline(scaling["efficiency_threshold"], linestyle='--', color='gray', label='Threshold')
+        ax_phase.set_xlabel('Hosts (mappers + reducers)')
+        ax_phase.set_ylabel('Efficiency')
+        ax_phase.set_title(f'{mode.capitalize()} Scaling Efficiency per Phase '
+                           f'(first to stop: {scaling[mode]["first_to_stop"] or "none"})')
+        ax_phase.legend()
+        ax_phase.grid(alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig('artifacts/plot_scaling_efficiency.png', dpi=150)
+    print("  Saved: artifacts/plot_scaling_efficiency.png")
+
 print("\nOK Plots generated")
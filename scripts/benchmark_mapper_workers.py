@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Local benchmark of `mapper.py --workers N` on one host.
+#   python scripts/benchmark_mapper_workers.py [input_file] [max_workers]
+
+INPUT_FILE = sys.argv[1] if len(sys.argv) > 1 else "data/soc-LiveJournal1Adj.txt"
+MAX_WORKERS = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+ITERATIONS = int(os.getenv("BENCHMARK_ITERATIONS", "3"))
+MAPPER_FORMAT = os.getenv("MAPREDUCE_INTERMEDIATE_FORMAT", "binary")
+MAPPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "mapper.py")
+
+if not os.path.exists(INPUT_FILE):
+    sys.exit(f"ERROR: Input file not found: {INPUT_FILE}")
+
+worker_counts = []
+n = 1
+while n < MAX_WORKERS:
+    worker_counts.append(n)
+    n *= 2
+worker_counts.append(MAX_WORKERS)
+
+print("=== Mapper Multi-core Benchmark ===\n")
+print(f"Input:      {INPUT_FILE} ({os.path.getsize(INPUT_FILE) / (1024 * 1024):.2f} MB)")
+print(f"CPU cores:  {os.cpu_count()}")
+print(f"Workers:    {worker_counts}")
+print(f"Iterations: {ITERATIONS}\n")
+
+results = []
+with tempfile.TemporaryDirectory() as tmp_dir:
+    output_file = os.path.join(tmp_dir, "mapper_output.bin")
+    for workers in worker_counts:
+        for iteration in range(1, ITERATIONS + 1):
+            cmd = [sys.executable, MAPPER, "--combine", "--format", MAPPER_FORMAT,
+                   "--workers", str(workers), "--spill-dir", tmp_dir, INPUT_FILE, output_file]
+            start = time.perf_counter()
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            elapsed = time.perf_counter() - start
+            success = result.returncode == 0
+            results.append({
+                "workers": workers,
+                "iteration": iteration,
+                "execution_time_seconds": elapsed,
+                "output_bytes": os.path.getsize(output_file) if success else 0,
+                "success": success,
+            })
+            status = "✓" if success else "✗"
+            print(f"  {status} workers={workers} iteration={iteration}: {elapsed:.2f}s")
+            if not success:
+                print(result.stderr)
+
+baseline = None
+summary = []
+print(f"\n{'Workers':<10} {'Mean (s)':<10} {'Speedup':<10} {'Efficiency':<10}")
+print("-" * 40)
+for workers in worker_counts:
+    times = [r["execution_time_seconds"] for r in results if r["workers"] == workers and r["success"]]
+    if not times:
+        continue
+    mean = sum(times) / len(times)
+    if baseline is None:
+        baseline = mean
+    speedup = baseline / mean
+    summary.append({
+        "workers": workers,
+        "mean_seconds": mean,
+        "speedup": speedup,
+        "efficiency": speedup / workers,
+    })
+    print(f"{workers:<10} {mean:<10.2f} {speedup:<10.2f} {speedup / workers:<10.2f}")
+
+os.makedirs("artifacts", exist_ok=True)
+output_path = "artifacts/mapper_workers_benchmark.json"
+with open(output_path, "w") as f:
+    json.dump({"input_file": INPUT_FILE, "cpu_count": os.cpu_count(),
+               "runs": results, "summary": summary}, f, indent=2)
+print(f"\nOK Results saved to {output_path}")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import json
+import os
+import subprocess
+import sys
+import time
+
+from generate_graph import DEFAULT_AVG_DEGREE, DEFAULT_EXPONENT, DEFAULT_USERS, cached_graph
+
+# End-to-end scale benchmark of the friend recommendation pipeline on synthetic graphs.
+#   python scripts/benchmark_scale.py [scale_factor ...]      (default: 1 2 5 10)
+#
+# Scale factor f runs scripts/run_friend_recommendation.py on a generated graph of
+# f * BENCHMARK_BASE_USERS users against the hosts in artifacts/mapreduce_instances.json
+# (deploy first). Graphs are cached under data/scale/ and every run writes its outputs to
+# data/scale/run_x<f>/, so artifacts/ keeps the real recommendations.
+
+SCALE_FACTORS = [float(arg) for arg in sys.argv[1:]] or [1, 2, 5, 10]
+BASE_USERS = int(os.getenv("BENCHMARK_BASE_USERS", DEFAULT_USERS))
+AVG_DEGREE = float(os.getenv("BENCHMARK_AVG_DEGREE", DEFAULT_AVG_DEGREE))
+EXPONENT = float(os.getenv("BENCHMARK_EXPONENT", DEFAULT_EXPONENT))
+MAX_DEGREE = int(os.getenv("BENCHMARK_MAX_DEGREE", "0")) or None
+SEED = int(os.getenv("BENCHMARK_SEED", "0"))
+SCALE_DIR = "data/scale"
+DRIVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_friend_recommendation.py")
+STAGES = ("split", "map", "partition", "reduce", "merge")
+
+if not os.path.exists("artifacts/mapreduce_instances.json"):
+    sys.exit("ERROR: artifacts/mapreduce_instances.json not found (provision and deploy first)")
+
+
+def scale_label(scale):
+    return f"{scale:g}"
+
+
+def graph_for(scale):
+    return cached_graph(SCALE_DIR, max(2, round(scale * BASE_USERS)), AVG_DEGREE, EXPONENT, SEED, MAX_DEGREE)
+
+
+print("=== Friend Recommendation Scale Benchmark ===\n")
+print(f"Scale factors: {[scale_label(scale) for scale in SCALE_FACTORS]} x {BASE_USERS} users")
+print(f"Graph:         mean degree {AVG_DEGREE:g}, exponent {EXPONENT:g}, "
+      f"max degree {MAX_DEGREE or 'uncapped'}, seed {SEED}\n")
+
+runs = []
+for scale in SCALE_FACTORS:
+    label = scale_label(scale)
+    print(f"Scale x{label}:")
+    graph_file, graph_stats = graph_for(scale)
+    print(f"  {graph_stats['users']} users, {graph_stats['edges']} friendships, "
+          f"{graph_stats['mapper_records']} mapper records, {graph_stats['bytes'] / (1024 * 1024):.2f} MB")
+
+    output_dir = os.path.join(SCALE_DIR, f"run_x{label}")
+    os.makedirs(output_dir, exist_ok=True)
+    metrics_path = os.path.join(output_dir, "friend_rec_metrics.json")
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    env = dict(os.environ, MAPREDUCE_INPUT=graph_file, MAPREDUCE_OUTPUT_DIR=output_dir)
+    log_path = os.path.join(output_dir, "driver.log")
+    start = time.perf_counter()
+    with open(log_path, "w") as log_file:
+        result = subprocess.run([sys.executable, DRIVER], env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0 or not os.path.exists(metrics_path):
+        print(f"  ✗ driver exited with code {result.returncode} after {elapsed:.2f}s (log: {log_path})\n")
+        runs.append({"scale": scale, "graph": graph_stats, "success": False, "execution_time_seconds": elapsed})
+        continue
+
+    with open(metrics_path) as f:
+        metrics = json.load(f)
+    stages = {stage["stage"]: stage for stage in metrics["stages"]}
+    seconds = metrics["pipeline_seconds"]
+    # Pairs are the records the mappers emit before the combiner (one marker per friend plus the
+    # friend-pair triangle of every line); the map stage's records_out counts combined records
+    pairs = graph_stats["mapper_records"]
+    run = {
+        "scale": scale,
+        "graph": graph_stats,
+        "success": True,
+        "execution_time_seconds": elapsed,
+        "pipeline_seconds": seconds,
+        "users": metrics["users"],
+        "pairs": pairs,
+        "map_records_out": stages["map"]["records_out"],
+        "users_per_second": metrics["users"] / seconds,
+        "pairs_per_second": pairs / seconds,
+        "stage_seconds": {name: stages[name]["wall_seconds"] for name in STAGES if name in stages},
+        "stage_cpu_seconds": {name: stages[name]["cpu_seconds"] for name in STAGES if name in stages},
+        "stage_peak_rss_mb": {name: stages[name]["peak_rss_mb"] for name in STAGES if name in stages},
+    }
+    runs.append(run)
+    print(f"  ✓ {seconds:.2f}s: {run['users_per_second']:.0f} users/s, {run['pairs_per_second']:.0f} pairs/s, "
+          f"peak RSS {max(run['stage_peak_rss_mb'].values()):.0f} MB\n")
+
+successful = [run for run in runs if run["success"]]
+print(f"{'Scale':<8} {'Users':>10} {'Pairs':>12} {'Time (s)':>10} {'Users/s':>10} {'Pairs/s':>12} "
+      f"{'Map MB':>8} {'Reduce MB':>10} {'Merge MB':>9}")
+print("-" * 97)
+for run in successful:
+    rss = run["stage_peak_rss_mb"]
+    print(f"x{scale_label(run['scale']):<7} {run['users']:>10} {run['pairs']:>12} {run['pipeline_seconds']:>10.2f} "
+          f"{run['users_per_second']:>10.0f} {run['pairs_per_second']:>12.0f} "
+          f"{rss.get('map', 0):>8.0f} {rss.get('reduce', 0):>10.0f} {rss.get('merge', 0):>9.0f}")
+
+os.makedirs("artifacts", exist_ok=True)
+output_path = "artifacts/scale_benchmark.json"
+with open(output_path, "w") as f:
+    json.dump({
+        "base_users": BASE_USERS, "avg_degree": AVG_DEGREE, "exponent": EXPONENT, "max_degree": MAX_DEGREE,
+        "seed": SEED, "instances": "artifacts/mapreduce_instances.json", "runs": runs,
+    }, f, indent=2)
+print(f"\nOK Results saved to {output_path}")
+
+if not successful:
+    sys.exit(1)
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+except ImportError:
+    print("WARN: matplotlib not installed; skipping the plots (pip install matplotlib)")
+    sys.exit(0)
+
+scales = [run["scale"] for run in successful]
+fig, (ax_time, ax_rate) = plt.subplots(1, 2, figsize=(14, 6))
+bottom = [0.0] * len(successful)
+for stage in STAGES:
+    values = [run["stage_seconds"].get(stage, 0.0) for run in successful]
+    ax_time.bar([scale_label(scale) for scale in scales], values, bottom=bottom, label=stage, alpha=0.7)
+    bottom = [b + v for b, v in zip(bottom, values)]
+ax_time.set_xlabel('Scale factor')
+ax_time.set_ylabel('Wall time (s)')
+ax_time.set_title('Stage Time by Scale')
+ax_time.legend()
+ax_time.grid(axis='y', alpha=0.3)
+
+ax_rate.plot(scales, [run["users_per_second"] for run in successful], marker='o', label='Users/s')
+ax_rate.set_xlabel('Scale factor')
+ax_rate.set_ylabel('Users/s')
+ax_pairs = ax_rate.twinx()
+ax_pairs.plot(scales, [run["pairs_per_second"] for run in successful], marker='s', color='#ff7f0e',
+              label='Pairs/s')
+ax_pairs.set_ylabel('Pairs/s')
+ax_rate.set_title('Throughput by Scale')
+ax_rate.legend(ax_rate.get_lines() + ax_pairs.get_lines(), ['Users/s', 'Pairs/s'], loc='best')
+ax_rate.grid(alpha=0.3)
+
+plt.tight_layout()
+plt.savefig('artifacts/plot_scale_throughput.png', dpi=150)
+print("  Saved: artifacts/plot_scale_throughput.png")
+
+fig, ax = plt.subplots(figsize=(10, 6))
+for stage in STAGES:
+    ax.plot(scales, [run["stage_peak_rss_mb"].get(stage, 0.0) for run in successful], marker='o', label=stage)
+ax.set_xlabel('Scale factor')
+ax.set_ylabel('Peak RSS (MB)')
+ax.set_title('Peak Memory per Stage by Scale (map / reduce: largest task)')
+ax.legend()
+ax.grid(alpha=0.3)
+
+plt.tight_layout()
+plt.savefig('artifacts/plot_scale_memory.png', dpi=150)
+print("  Saved: artifacts/plot_scale_memory.png")
@@ -1,61 +1,32 @@
 #!/usr/bin/env python3
-import json, os, sys, subprocess, time
+import json, os, sys, time
 
-KEY_PATH = os.getenv("AWS_KEY_PATH")
-if not KEY_PATH:
-    sys.exit("Missing AWS_KEY_PATH. Run: set -a; source .env; set +a")
+from remote import open_backend
 
 with open("artifacts/mapreduce_instances.json") as f:
     instances = json.load(f)
 
-SSH_USER = "ubuntu"
+# Local hosts (scripts/provision_local.py) need no key
+KEY_PATH = os.getenv("AWS_KEY_PATH")
+if not KEY_PATH and "local" not in instances:
+    sys.exit("Missing AWS_KEY_PATH. Run: set -a; source .env; set +a")
 
-SSH_BASE = [
-    "ssh",
-    "-o", "StrictHostKeyChecking=no",
-    "-o", "BatchMode=yes",
-    "-o", "ServerAliveInterval=15",
-    "-o", "ServerAliveCountMax=3",
-    "-o", "ConnectTimeout=20",
-    "-o", "ConnectionAttempts=10",
-]
+remote = open_backend(instances, KEY_PATH)
 
 def ssh(host, cmd, show_output=True):
-    remote = f"bash -lc '{cmd}'"
-    proc = subprocess.Popen(
-        SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{host}", remote],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-    )
-    output_lines = []
-    try:
-        if proc.stdout:
-            for line in proc.stdout:
-                output_lines.append(line)
-                if show_output:
-                    print(line, end="")
-    finally:
-        proc.wait()
-    return proc.returncode, "".join(output_lines)
-
-def scp_upload(host, local_path, remote_path):
-    result = subprocess.run(
-        ["scp", "-o", "StrictHostKeyChecking=no", "-i", KEY_PATH,
-         local_path, f"{SSH_USER}@{host}:{remote_path}"],
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-    )
-    return result
+    result = remote.run(host, cmd, stream=True,
+                        on_line=(lambda line: print(line, end="")) if show_output else (lambda line: None))
+    return result.returncode, result.stdout
+
+def scp_upload(host, local_paths, remote_path):
+    return remote.upload(host, local_paths, remote_path)
 
 def wait_for_ssh(host):
     print(f"  Waiting for SSH on {host}...")
     for i in range(30):
         try:
-            result = subprocess.run(
-                SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{host}", "echo ready"],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=10
-            )
+            # Opens the host's master connection; every later call reuses it
+            result = remote.connect(host, timeout=10)
             if result.returncode == 0:
                 print(f"  SSH ready on {host}")
                 return True
@@ -66,8 +37,10 @@ def wait_for_ssh(host):
 
 def setup_instance(host, role):
     print(f"\n  Setting up {host} ({role})...")
-    code, _ = ssh(host, "python3 --version", show_output=False)
-    if code == 0:
+    # One session for both small commands
+    results = remote.run_batch(host, ["mkdir -p ~/mapreduce ~/data", "python3 --version"],
+                               stop_on_error=False)
+    if len(results) == 2 and results[1].returncode == 0:
         print("  Python 3 already present; skipping install.")
     else:
         print("  Installing Python 3...")
@@ -82,8 +55,6 @@ def setup_instance(host, role):
             print(output)
             return False
 
-    ssh(host, "mkdir -p ~/mapreduce ~/data", show_output=False)
-
     print(f"  OK {host} setup complete")
     return True
 
@@ -106,27 +77,31 @@ for host, role in all_hosts:
     if not setup_instance(host, role):
         sys.exit(f"ERROR: Failed to setup {host}")
 
+# Helper modules imported by mapper.py / reducer.py, shipped next to them
+MAPPER_MODULES = ["metrics.py", "partition.py", "records.py", "shuffle.py", "spill.py", "splitter.py"]
+REDUCER_MODULES = ["metrics.py", "records.py", "shuffle.py", "spill.py"]
+
+def upload_modules(host, script, modules):
+    # Script and helper modules go in a single scp call
+    result = scp_upload(host, [f"app/{script}"] + [f"app/{module}" for module in modules], "~/mapreduce/")
+    if result.returncode != 0:
+        print(f"  ERROR: Failed to upload to {host}")
+        print(result.stderr)
+        sys.exit(1)
+    ssh(host, f"chmod +x ~/mapreduce/{script}", show_output=False)
+
 print("\nStep 3: Deploying mapper script to mapper instances...")
 for mapper in instances["mappers"]:
     host = mapper["public_ip"]
     print(f"  Uploading mapper.py to {host}...")
-    result = scp_upload(host, "app/mapper.py", "~/mapreduce/mapper.py")
-    if result.returncode != 0:
-        print(f"  ERROR: Failed to upload to {host}")
-        print(result.stdout)
-        sys.exit(1)
-    ssh(host, "chmod +x ~/mapreduce/mapper.py", show_output=False)
+    upload_modules(host, "mapper.py", MAPPER_MODULES)
 
 print("\nStep 4: Deploying reducer script to reducer instances...")
 for reducer in instances["reducers"]:
     host = reducer["public_ip"]
     print(f"  Uploading reducer.py to {host}...")
-    result = scp_upload(host, "app/reducer.py", "~/mapreduce/reducer.py")
-    if result.returncode != 0:
-        print(f"  ERROR: Failed to upload to {host}")
-        print(result.stdout)
-        sys.exit(1)
-    ssh(host, "chmod +x ~/mapreduce/reducer.py", show_output=False)
+    upload_modules(host, "reducer.py", REDUCER_MODULES)
 
 print("\nOK Deployment complete!")
 print(f"Deployed to {len(instances['mappers'])} mappers, {len(instances['reducers'])} reducers")
+remote.report()
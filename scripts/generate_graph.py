@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from array import array
+from itertools import accumulate
+
+# Seeded synthetic friendship graph in the soc-LiveJournal1Adj format (user<TAB>friend,friend,...).
+#   python scripts/generate_graph.py [--users N] [--avg-degree D] [--exponent G] [--seed S] <output_file>
+#
+# Chung-Lu model: user i gets an expected degree w_i ~ (i + 1)^(-1 / (G - 1)), scaled to the mean
+# degree D, and every edge joins two users drawn with probability proportional to w. Degrees then
+# follow a power law with exponent G (LiveJournal: about 2.5). Self-loops and repeated edges are
+# dropped, so the realised mean is slightly below D. The same arguments always give the same file.
+
+DEFAULT_USERS = 50000
+# Mean friend-list length of data/soc-LiveJournal1Adj.txt
+DEFAULT_AVG_DEGREE = 13.2
+DEFAULT_EXPONENT = 2.5
+EDGE_BATCH = 1 << 20
+# Users per edge block: write_graph holds one block's edges at a time
+BLOCK_USERS = 1 << 16
+
+
+def degree_weights(users, avg_degree, exponent, max_degree=None):
+    """Expected degree of every user, highest first: a power law with mean `avg_degree`."""
+    if exponent <= 2:
+        raise ValueError("the degree exponent must be > 2 (the mean degree is infinite otherwise)")
+    weights = [(i + 1) ** (-1 / (exponent - 1)) for i in range(users)]
+    scale = avg_degree * users / sum(weights)
+    # An expected degree above sqrt(total) would need edge probabilities over 1
+    cap = min(max_degree or users - 1, (avg_degree * users) ** 0.5)
+    return [min(weight * scale, cap) for weight in weights]
+
+
+def generate_edges(users, avg_degree, exponent, seed=0, max_degree=None):
+    """Both directions of every edge as u * users + v, in one int64 array per BLOCK_USERS sources.
+
+    Repeated edges are kept here (8 bytes each instead of a set entry); write_graph drops them
+    one block at a time.
+    """
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(degree_weights(users, avg_degree, exponent, max_degree)))
+    # Hubs get random IDs instead of the lowest ones, like a real crawl
+    ids = list(range(users))
+    rng.shuffle(ids)
+    population = range(users)
+    blocks = [array("q") for _ in range(0, users, BLOCK_USERS)]
+    remaining = round(avg_degree * users / 2)
+    while remaining > 0:
+        batch = min(remaining, EDGE_BATCH)
+        ends_a = rng.choices(population, cum_weights=cum_weights, k=batch)
+        ends_b = rng.choices(population, cum_weights=cum_weights, k=batch)
+        for a, b in zip(ends_a, ends_b):
+            a = ids[a]
+            b = ids[b]
+            if a != b:
+                blocks[a // BLOCK_USERS].append(a * users + b)
+                blocks[b // BLOCK_USERS].append(b * users + a)
+        remaining -= batch
+    return blocks
+
+
+def write_graph(path, users, blocks):
+    """One line per user, IDs 0..users-1 in order, friends ascending (users without friends too).
+
+    Each block is deduplicated and sorted on its own and freed once written, so only one block's
+    edges are ever held as Python ints.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    partial = f"{path}.part"
+    edges = 0
+    max_degree = 0
+    isolated = 0
+    mapper_records = 0
+    with open(partial, "w") as f:
+        for index, block in enumerate(blocks):
+            first = index * BLOCK_USERS
+            friends = [[] for _ in range(first, min(first + BLOCK_USERS, users))]
+            for edge in sorted(set(block)):
+                user, friend = divmod(edge, users)
+                friends[user - first].append(friend)
+            blocks[index] = None
+            for offset, listed in enumerate(friends):
+                f.write(f"{first + offset}\t{','.join(map(str, listed))}\n")
+                degree = len(listed)
+                edges += degree
+                max_degree = max(max_degree, degree)
+                isolated += degree == 0
+                # Mapper records of the line: one marker per friend plus the friend-pair triangle
+                mapper_records += degree + degree * (degree - 1) // 2
+    os.replace(partial, path)
+    edges //= 2
+    return {
+        "users": users,
+        "edges": edges,
+        "avg_degree": 2 * edges / users if users else 0.0,
+        "max_degree": max_degree,
+        "isolated_users": isolated,
+        "mapper_records": mapper_records,
+        "bytes": os.path.getsize(path),
+    }
+
+
+def generate_graph(path, users=DEFAULT_USERS, avg_degree=DEFAULT_AVG_DEGREE, exponent=DEFAULT_EXPONENT, seed=0,
+                   max_degree=None):
+    started = time.perf_counter()
+    blocks = generate_edges(users, avg_degree, exponent, seed, max_degree)
+    stats = write_graph(path, users, blocks)
+    stats.update(exponent=exponent, seed=seed, elapsed_seconds=time.perf_counter() - started)
+    return stats
+
+
+def cached_graph(directory, users, avg_degree=DEFAULT_AVG_DEGREE, exponent=DEFAULT_EXPONENT, seed=0,
+                 max_degree=None, log=print):
+    """(path, stats) of a generated graph under `directory`, reused when it exists with the same parameters."""
+    name = f"graph_u{users}_d{avg_degree:g}_g{exponent:g}_m{max_degree or 0}_s{seed}"
+    path = os.path.join(directory, f"{name}.txt")
+    stats_path = os.path.join(directory, f"{name}.json")
+    if os.path.exists(path) and os.path.exists(stats_path):
+        with open(stats_path) as f:
+            return path, json.load(f)
+    log(f"  Generating {path}...")
+    stats = generate_graph(path, users, avg_degree, exponent, seed, max_degree)
+    with open(stats_path, "w") as f:
+        json.dump(stats, f, indent=2)
+    return path, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="generate_graph.py [options] <output_file>")
+    parser.add_argument("output_file")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--avg-degree", type=float, default=DEFAULT_AVG_DEGREE)
+    parser.add_argument("--exponent", type=float, default=DEFAULT_EXPONENT,
+                        help="power-law exponent of the degree distribution (> 2; lower is more skewed)")
+    parser.add_argument("--max-degree", type=int, default=None, help="cap on any user's expected degree")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.users < 2 or args.avg_degree <= 0:
+        sys.exit("ERROR: --users must be >= 2 and --avg-degree > 0")
+
+    try:
+        stats = generate_graph(args.output_file, args.users, args.avg_degree, args.exponent, args.seed,
+                               args.max_degree)
+    except ValueError as exc:
+        sys.exit(f"ERROR: {exc}")
+    print(f"OK Wrote {args.output_file}: {stats['users']} users, {stats['edges']} friendships "
+          f"(mean degree {stats['avg_degree']:.2f}, max {stats['max_degree']}), "
+          f"{stats['mapper_records']} mapper records, {stats['bytes'] / (1024 * 1024):.2f} MB "
+          f"in {stats['elapsed_seconds']:.2f}s")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import json, os, sys
+
+# Local stand-in for provision_mapreduce.py: every "instance" is a directory on this machine.
+# deploy_mapreduce.py and run_friend_recommendation.py pick the local backend from the
+# "local" entry of the instances file and then run unchanged.
+
+ROOT = os.path.abspath(os.getenv("MAPREDUCE_LOCAL_ROOT", "data/local_hosts"))
+INSTANCES_FILE = "artifacts/mapreduce_instances.json"
+
+def parse_positive_int(env_key, default):
+    value = os.getenv(env_key)
+    if not value:
+        return default
+    try:
+        parsed = int(value)
+        if parsed <= 0:
+            raise ValueError
+        return parsed
+    except ValueError:
+        sys.exit(f"Invalid value for {env_key}: {value}. Must be a positive integer.")
+
+NUM_MAPPERS = parse_positive_int("MAPREDUCE_NUM_MAPPERS", 3)
+NUM_REDUCERS = parse_positive_int("MAPREDUCE_NUM_REDUCERS", 6)
+# Pin every host to this many CPUs (round-robin over the machine); unset = no pinning
+CPUS_PER_HOST = parse_positive_int("MAPREDUCE_LOCAL_CPUS_PER_HOST", 0)
+
+if CPUS_PER_HOST and not hasattr(os, "sched_setaffinity"):
+    sys.exit("ERROR: CPU pinning (MAPREDUCE_LOCAL_CPUS_PER_HOST) needs Linux sched_setaffinity")
+
+if os.path.exists(INSTANCES_FILE):
+    with open(INSTANCES_FILE) as f:
+        if "local" not in json.load(f) and os.getenv("MAPREDUCE_LOCAL_OVERWRITE") != "1":
+            sys.exit(f"ERROR: {INSTANCES_FILE} describes EC2 instances. "
+                     "Set MAPREDUCE_LOCAL_OVERWRITE=1 to replace it with local hosts.")
+
+available_cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+next_cpu = 0
+
+def local_host(role, i):
+    global next_cpu
+    name = f"{role}-{i+1}"
+    os.makedirs(os.path.join(ROOT, name), exist_ok=True)
+    host = {
+        "id": f"local-{name}",
+        "type": "local",
+        "state": "running",
+        "public_ip": name,
+        "private_ip": "127.0.0.1",
+        "role": role,
+    }
+    if CPUS_PER_HOST:
+        host["cpus"] = [available_cpus[(next_cpu + k) % len(available_cpus)] for k in range(CPUS_PER_HOST)]
+        next_cpu += CPUS_PER_HOST
+    print(f"  - {host['id']} | {os.path.join(ROOT, name)} | cpus {host.get('cpus', 'all')}")
+    return host
+
+print(f"Creating {NUM_MAPPERS} local mappers and {NUM_REDUCERS} local reducers under {ROOT}...")
+output_data = {
+    "local": {"root": ROOT},
+    "mappers": [local_host("mapper", i) for i in range(NUM_MAPPERS)],
+    "reducers": [local_host("reducer", i) for i in range(NUM_REDUCERS)],
+}
+if CPUS_PER_HOST and CPUS_PER_HOST * (NUM_MAPPERS + NUM_REDUCERS) > len(available_cpus):
+    print(f"WARN: {NUM_MAPPERS + NUM_REDUCERS} hosts x {CPUS_PER_HOST} CPUs share {len(available_cpus)} CPUs")
+
+os.makedirs("artifacts", exist_ok=True)
+with open(INSTANCES_FILE, "w") as f:
+    json.dump(output_data, f, indent=2)
+
+print(f"\nOK Wrote local host details to {INSTANCES_FILE}")
+print(f"Mappers: {NUM_MAPPERS}, Reducers: {NUM_REDUCERS}")
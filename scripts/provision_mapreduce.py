@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import json, os, sys, itertools
 import boto3
+from botocore.exceptions import ClientError
 
 REGION   = os.getenv("AWS_REGION", "us-east-1")
 KEY_NAME = os.getenv("AWS_KEY_NAME")
@@ -22,6 +23,8 @@ def parse_positive_int(env_key, default):
 
 NUM_MAPPERS = parse_positive_int("MAPREDUCE_NUM_MAPPERS", 3)
 NUM_REDUCERS = parse_positive_int("MAPREDUCE_NUM_REDUCERS", 6)
+# MAPREDUCE_SHUFFLE=direct: reducer r receives mapper partitions on SHUFFLE_PORT + r
+SHUFFLE_PORT = parse_positive_int("MAPREDUCE_SHUFFLE_PORT", 7070)
 
 if not (KEY_NAME and SG_ID and SUBNETS):
     sys.exit("Missing one of: AWS_KEY_NAME, AWS_INSTANCE_SG_ID, AWS_SUBNET_IDS")
@@ -41,6 +44,30 @@ if not AMI_ID:
         )["Parameter"]["Value"]
     print(f"Using Ubuntu 22.04 AMI: {AMI_ID}")
 
+def ensure_shuffle_access():
+    """Let instances of the security group reach each other on the reducer shuffle ports."""
+    ports = f"{SHUFFLE_PORT}-{SHUFFLE_PORT + NUM_REDUCERS - 1}"
+    print(f"Ensuring shuffle ports {ports} are open inside security group {SG_ID}...")
+    try:
+        ec2.meta.client.authorize_security_group_ingress(
+            GroupId=SG_ID,
+            IpPermissions=[{
+                "IpProtocol": "tcp",
+                "FromPort": SHUFFLE_PORT,
+                "ToPort": SHUFFLE_PORT + NUM_REDUCERS - 1,
+                "UserIdGroupPairs": [{
+                    "GroupId": SG_ID,
+                    "Description": "Lab2 mapper to reducer shuffle"
+                }]
+            }]
+        )
+        print(f"Authorized shuffle ports {ports}.")
+    except ClientError as err:
+        if "InvalidPermission.Duplicate" in str(err):
+            print(f"Shuffle rule for ports {ports} already exists.")
+        else:
+            print(f"WARN: Failed to authorize shuffle ports {ports}: {err}")
+
 def create_instances(instance_type, count, role_tag):
     subnet_cycle = itertools.cycle(SUBNETS)
     instances = []
@@ -77,6 +104,9 @@ def create_instances(instance_type, count, role_tag):
 print(f"Provisioning {NUM_MAPPERS} mappers and {NUM_REDUCERS} reducers...")
 print()
 
+ensure_shuffle_access()
+print()
+
 # Create mapper instances
 mapper_instances = create_instances("t2.micro", NUM_MAPPERS, "mapper")
 
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+import contextlib
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+# Shared ssh/scp transport for the orchestration scripts.
+# Every host gets one multiplexed master connection (ControlMaster) that later ssh and scp
+# calls reuse, so only the first call per host pays for the TCP + key exchange handshake.
+# ControlPersist keeps the master alive between scripts (deploy -> run) as well.
+
+SSH_USER = "ubuntu"
+CONTROL_PERSIST = os.getenv("SSH_CONTROL_PERSIST", "10m")
+CONTROL_DIR = os.path.join(tempfile.gettempdir(), f"lab2-ssh-{os.getuid()}")
+
+COMMON_OPTIONS = [
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "BatchMode=yes",
+    "-o", "ServerAliveInterval=15",
+    "-o", "ServerAliveCountMax=60",
+    "-o", "ConnectTimeout=20",
+    "-o", "ConnectionAttempts=10",
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Remote:
+    def __init__(self, key_path, user=SSH_USER, multiplex=True):
+        self.key_path = key_path
+        self.user = user
+        self.multiplex = multiplex
+        # (kind, host, seconds, returncode) for every call, for the latency report
+        self.calls = []
+        self.lock = threading.Lock()
+        # Running process -> group name (see group()), so one task attempt can be killed alone
+        self.processes = {}
+        self.pipes = {}
+        self.local = threading.local()
+        if multiplex:
+            os.makedirs(CONTROL_DIR, mode=0o700, exist_ok=True)
+
+    def options(self):
+        options = COMMON_OPTIONS + ["-i", self.key_path]
+        if self.multiplex:
+            options += [
+                "-o", "ControlMaster=auto",
+                "-o", f"ControlPath={os.path.join(CONTROL_DIR, '%C')}",
+                "-o", f"ControlPersist={CONTROL_PERSIST}",
+            ]
+        return options
+
+    def target(self, host):
+        return f"{self.user}@{host}"
+
+    def _record(self, kind, host, started, returncode):
+        with self.lock:
+            self.calls.append((kind, host, time.perf_counter() - started, returncode))
+
+    def _shell(self, host, cmd, compress=False):
+        """argv and extra Popen arguments that run `cmd` on `host`."""
+        options = self.options() + (["-C"] if compress else [])
+        return ["ssh"] + options + [self.target(host), f"bash -lc {shlex.quote(cmd)}"], {}
+
+    def _spawn(self, cmd, merge_stderr=False, **popen_args):
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            **popen_args,
+        )
+        self._register(process)
+        return process
+
+    def _register(self, process):
+        with self.lock:
+            self.processes[process] = getattr(self.local, "group", None)
+
+    def _finish(self, process):
+        with self.lock:
+            self.processes.pop(process, None)
+
+    def _communicate(self, kind, host, cmd, timeout=None, **popen_args):
+        started = time.perf_counter()
+        process = self._spawn(cmd, **popen_args)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            self._record(kind, host, started, None)
+            raise
+        finally:
+            self._finish(process)
+        self._record(kind, host, started, process.returncode)
+        return subprocess.CompletedProcess(args=cmd, returncode=process.returncode, stdout=stdout, stderr=stderr)
+
+    def connect(self, host, timeout=None):
+        """Open (or check) the master connection to `host`; later calls reuse it."""
+        if not self.multiplex:
+            return self.run(host, "true", timeout=timeout)
+        cmd = ["ssh"] + self.options() + ["-O", "check", self.target(host)]
+        if subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            return subprocess.CompletedProcess(args=cmd, returncode=0, stdout="", stderr="")
+        # The backgrounded master keeps its stdio, so it must not hold our pipes open
+        cmd = ["ssh"] + self.options() + ["-o", "ControlMaster=yes", "-f", "-N", self.target(host)]
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, timeout=timeout)
+        finally:
+            self._record("connect", host, started, None)
+        return result
+
+    def run(self, host, cmd, stream=False, on_line=None, timeout=None):
+        """Run `cmd` through `bash -lc` on `host`.
+
+        With stream=True stdout and stderr are merged and every line is passed to `on_line`
+        (printed by default) while the command runs; the result's stdout holds all of it.
+        """
+        ssh_cmd, popen_args = self._shell(host, cmd)
+        if not stream:
+            return self._communicate("ssh", host, ssh_cmd, timeout, **popen_args)
+
+        on_line = on_line or (lambda line: print(line, end=""))
+        started = time.perf_counter()
+        process = self._spawn(ssh_cmd, merge_stderr=True, **popen_args)
+        collected = []
+        try:
+            if process.stdout:
+                for line in process.stdout:
+                    collected.append(line)
+                    on_line(line)
+        finally:
+            process.wait()
+            self._finish(process)
+        self._record("ssh", host, started, process.returncode)
+        return subprocess.CompletedProcess(args=ssh_cmd, returncode=process.returncode,
+                                           stdout="".join(collected), stderr="")
+
+    def open_pipe(self, host, cmd, compress=False):
+        """Start `cmd` on `host` with binary stdin/stdout/stderr pipes; finish with close_pipe()."""
+        ssh_cmd, popen_args = self._shell(host, cmd, compress)
+        process = subprocess.Popen(ssh_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   **popen_args)
+        self._register(process)
+        with self.lock:
+            self.pipes[process] = (host, time.perf_counter())
+        return process
+
+    def close_pipe(self, process):
+        returncode = process.wait()
+        with self.lock:
+            self.processes.pop(process, None)
+            host, started = self.pipes.pop(process)
+        self._record("pipe", host, started, returncode)
+        return returncode
+
+    def run_batch(self, host, commands, stop_on_error=True, on_line=None):
+        """Run several small commands in one remote session; returns one result per command run."""
+        marker = f"__BATCH_{uuid.uuid4().hex}__"
+        script = []
+        for idx, cmd in enumerate(commands):
+            script.append(f"( {cmd} ) 2>&1; rc=$?; echo {marker}{idx}:$rc")
+            if stop_on_error:
+                script.append(f"[ $rc -eq 0 ] || exit $rc")
+        result = self.run(host, "\n".join(script), stream=on_line is not None,
+                          on_line=lambda line: None if line.startswith(marker) else on_line(line))
+
+        results = []
+        output = []
+        for line in result.stdout.splitlines(keepends=True):
+            if not line.startswith(marker):
+                output.append(line)
+                continue
+            idx, returncode = line[len(marker):].strip().split(":")
+            results.append(subprocess.CompletedProcess(
+                args=commands[int(idx)], returncode=int(returncode), stdout="".join(output), stderr="",
+            ))
+            output = []
+        if not results and result.returncode != 0:
+            # The session itself failed before the first command reported back
+            results.append(subprocess.CompletedProcess(
+                args=commands[0], returncode=result.returncode, stdout="".join(output), stderr=result.stderr,
+            ))
+        return results
+
+    def upload(self, host, local_paths, remote_path):
+        """scp one file, or several files into a remote directory, over the host's master connection."""
+        if isinstance(local_paths, str):
+            local_paths = [local_paths]
+        cmd = ["scp"] + self.options() + list(local_paths) + [f"{self.target(host)}:{remote_path}"]
+        return self._communicate("upload", host, cmd)
+
+    def download(self, host, remote_path, local_path):
+        cmd = ["scp"] + self.options() + [f"{self.target(host)}:{remote_path}", local_path]
+        return self._communicate("download", host, cmd)
+
+    @contextlib.contextmanager
+    def group(self, name):
+        """Tag every process this thread starts inside the block with `name`."""
+        self.local.group = name
+        try:
+            yield
+        finally:
+            self.local.group = None
+
+    def terminate_group(self, name):
+        with self.lock:
+            for process, group in self.processes.items():
+                if group == name:
+                    process.terminate()
+
+    def terminate_all(self):
+        with self.lock:
+            for process in self.processes:
+                process.terminate()
+
+    def close(self, hosts):
+        if not self.multiplex:
+            return
+        for host in hosts:
+            subprocess.run(["ssh"] + self.options() + ["-O", "exit", self.target(host)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def latency_summary(self):
+        summary = {}
+        for kind in ("connect", "ssh", "pipe", "upload", "download"):
+            seconds = [elapsed for call_kind, _, elapsed, _ in self.calls if call_kind == kind]
+            if not seconds:
+                continue
+            summary[kind] = {
+                "calls": len(seconds),
+                "total_seconds": sum(seconds),
+                "mean_ms": 1000 * sum(seconds) / len(seconds),
+                "p50_ms": 1000 * percentile(seconds, 0.5),
+                "p95_ms": 1000 * percentile(seconds, 0.95),
+                "max_ms": 1000 * max(seconds),
+            }
+        return summary
+
+    def report(self):
+        summary = self.latency_summary()
+        if not summary:
+            return summary
+        print("\nRemote call latency:")
+        print(f"  {'Kind':<10} {'Calls':>6} {'Total s':>9} {'Mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'Max ms':>9}")
+        for kind, stats in summary.items():
+            print(f"  {kind:<10} {stats['calls']:>6} {stats['total_seconds']:>9.2f} {stats['mean_ms']:>9.1f} "
+                  f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+        return summary
+
+
+class LocalHosts(Remote):
+    """Remote look-alike where every host is a directory under `root` on this machine.
+
+    Commands run as local subprocesses with HOME (and so `~/`) set to the host directory,
+    optionally pinned to that host's CPUs; uploads and downloads are plain file copies.
+    """
+
+    def __init__(self, root, cpus=None):
+        super().__init__(key_path=None, multiplex=False)
+        self.root = root
+        self.cpus = cpus or {}
+
+    def home(self, host):
+        return os.path.join(self.root, host)
+
+    def path(self, host, remote_path):
+        if remote_path == "~" or remote_path.startswith("~/"):
+            return os.path.join(self.home(host), remote_path[2:])
+        return remote_path
+
+    def _shell(self, host, cmd, compress=False):
+        popen_args = {"cwd": self.home(host), "env": dict(os.environ, HOME=self.home(host))}
+        cpus = self.cpus.get(host)
+        if cpus:
+            popen_args["preexec_fn"] = lambda: os.sched_setaffinity(0, cpus)
+        return ["bash", "-c", cmd], popen_args
+
+    def connect(self, host, timeout=None):
+        started = time.perf_counter()
+        os.makedirs(self.home(host), exist_ok=True)
+        self._record("connect", host, started, 0)
+        return subprocess.CompletedProcess(args=["mkdir", self.home(host)], returncode=0, stdout="", stderr="")
+
+    def _copy(self, kind, host, sources, destination):
+        started = time.perf_counter()
+        try:
+            for source in sources:
+                shutil.copy(source, destination)
+            returncode, stderr = 0, ""
+        except OSError as exc:
+            returncode, stderr = 1, str(exc)
+        self._record(kind, host, started, returncode)
+        return subprocess.CompletedProcess(args=["cp"] + sources + [destination], returncode=returncode,
+                                           stdout="", stderr=stderr)
+
+    def upload(self, host, local_paths, remote_path):
+        if isinstance(local_paths, str):
+            local_paths = [local_paths]
+        return self._copy("upload", host, list(local_paths), self.path(host, remote_path))
+
+    def download(self, host, remote_path, local_path):
+        return self._copy("download", host, [self.path(host, remote_path)], local_path)
+
+
+def open_backend(instances, key_path=None):
+    """LocalHosts for an instances file written by provision_local.py, ssh/scp otherwise."""
+    local = instances.get("local")
+    if local:
+        hosts = instances["mappers"] + instances["reducers"]
+        return LocalHosts(local["root"], {host["public_ip"]: host["cpus"] for host in hosts if host.get("cpus")})
+    return Remote(key_path)
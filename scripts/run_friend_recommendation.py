@@ -1,17 +1,38 @@
 #!/usr/bin/env python3
-import hashlib
+import heapq
 import json
+import math
 import os
 import shutil
+import statistics
 import subprocess
 import sys
+import threading
+import time
 from collections import defaultdict
-
-KEY_PATH = os.getenv("AWS_KEY_PATH")
-if not KEY_PATH:
-    sys.exit("Missing AWS_KEY_PATH. Run: set -a; source .env; set +a")
-
-DATA_FILE = "data/soc-LiveJournal1Adj.txt"
+from itertools import groupby
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from remote import open_backend
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from graph_cache import load_graph  # noqa: E402
+from lookup import IndexWriter, index_path  # noqa: E402
+from metrics import COUNTERS, Meter, parse_task_metrics  # noqa: E402
+from partition import (  # noqa: E402
+    BUCKETS_PER_SHARD, DEFAULT_SAMPLE_RATE, LoadEstimator, PartitionTable, assign_buckets, imbalance, partition_path,
+    read_frames,
+)
+from records import (  # noqa: E402
+    BINARY, COMPRESSION_EXT, COMPRESSIONS, FORMATS, NONE, RECORD_SIZE, ZSTD, RecordWriter, open_stream, read_records,
+    zstandard,
+)
+from splitter import (  # noqa: E402
+    chunk_bytes, join_users, line_aligned_ranges, plan_chunks, scan_graph, scan_input, user_order_key, write_chunk,
+)
+
+# MAPREDUCE_INPUT runs another adjacency file (e.g. one from scripts/generate_graph.py)
+DATA_FILE = os.getenv("MAPREDUCE_INPUT", "data/soc-LiveJournal1Adj.txt")
 if not os.path.exists(DATA_FILE):
     print(f"ERROR: Data file not found: {DATA_FILE}")
     print("Please download the file from Moodle and place it in data/")
@@ -19,357 +40,1113 @@ if not os.path.exists(DATA_FILE):
 
 ARTIFACTS_DIR = "artifacts"
 os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+# Recommendations and run statistics; benchmarks point this elsewhere to keep artifacts/ intact
+OUTPUT_DIR = os.getenv("MAPREDUCE_OUTPUT_DIR", ARTIFACTS_DIR)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 with open(os.path.join(ARTIFACTS_DIR, "mapreduce_instances.json")) as f:
     instances = json.load(f)
 
-SSH_USER = "ubuntu"
-SSH_BASE = [
-    "ssh",
-    "-o",
-    "StrictHostKeyChecking=no",
-    "-o",
-    "BatchMode=yes",
-    "-o",
-    "ServerAliveInterval=15",
-    "-o",
-    "ServerAliveCountMax=60",
-    "-o",
-    "ConnectionAttempts=10",
-    "-o",
-    "ConnectTimeout=20",
-]
+# Local hosts (scripts/provision_local.py) need no key
+KEY_PATH = os.getenv("AWS_KEY_PATH")
+if not KEY_PATH and "local" not in instances:
+    sys.exit("Missing AWS_KEY_PATH. Run: set -a; source .env; set +a")
 
-SCP_BASE = [
-    "scp",
-    "-o",
-    "StrictHostKeyChecking=no",
-    "-o",
-    "ServerAliveInterval=15",
-    "-o",
-    "ServerAliveCountMax=60",
-    "-o",
-    "ConnectTimeout=20",
-]
+
+def parse_positive_int(env_key, default):
+    value = os.getenv(env_key)
+    if not value:
+        return default
+    try:
+        parsed = int(value)
+        if parsed <= 0:
+            raise ValueError
+        return parsed
+    except ValueError:
+        sys.exit(f"Invalid value for {env_key}: {value}. Must be a positive integer.")
+
+
+def parse_flag(env_key, default):
+    value = os.getenv(env_key)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# The mapper combiner emits one "a,b<TAB>count" record per pair instead of one
+# line per mutual friend; "-1" still marks an existing friendship.
+MAPPER_COMBINE = parse_flag("MAPREDUCE_MAPPER_COMBINE", True)
+MAPPER_MEMORY_MB = parse_positive_int("MAPREDUCE_MAPPER_MEMORY_MB", 256)
+# Processes per mapper host; "auto" uses every vCPU of the host
+MAPPER_WORKERS = os.getenv("MAPREDUCE_MAPPER_WORKERS", "auto")
+
+# Intermediate records are fixed-width binary by default; "text" keeps them readable for debugging.
+INTERMEDIATE_FORMAT = os.getenv("MAPREDUCE_INTERMEDIATE_FORMAT", BINARY)
+if INTERMEDIATE_FORMAT not in FORMATS:
+    sys.exit(f"Invalid value for MAPREDUCE_INTERMEDIATE_FORMAT: {INTERMEDIATE_FORMAT}. "
+             f"Must be one of: {', '.join(FORMATS)}.")
+
+# Intermediate files (mapper outputs, reducer partitions and outputs) are stream-compressed
+# on the hosts and moved compressed; "none" keeps them raw.
+COMPRESSION = os.getenv("MAPREDUCE_COMPRESSION", NONE)
+if COMPRESSION not in COMPRESSIONS:
+    sys.exit(f"Invalid value for MAPREDUCE_COMPRESSION: {COMPRESSION}. "
+             f"Must be one of: {', '.join(COMPRESSIONS)}.")
+if COMPRESSION == ZSTD and zstandard is None:
+    print("ERROR: zstandard not installed")
+    print("Run: pip install zstandard (on the driver and on every host)")
+    sys.exit(1)
+COMPRESSION_LEVEL = os.getenv("MAPREDUCE_COMPRESSION_LEVEL")
+try:
+    COMPRESSION_LEVEL = int(COMPRESSION_LEVEL) if COMPRESSION_LEVEL else None
+except ValueError:
+    sys.exit(f"Invalid value for MAPREDUCE_COMPRESSION_LEVEL: {COMPRESSION_LEVEL}. Must be an integer.")
+
+# "files": chunks and intermediate files are staged on the hosts with scp.
+# "stream": chunks pipe into the mappers over ssh and the driver forwards mapper stdout straight
+# into the reducers' stdin; nothing intermediate touches a disk. Compression then happens on the
+# wire (ssh -C) instead of in the files.
+TRANSPORT = os.getenv("MAPREDUCE_TRANSPORT", "files")
+if TRANSPORT not in ("files", "stream"):
+    sys.exit(f"Invalid value for MAPREDUCE_TRANSPORT: {TRANSPORT}. Must be 'files' or 'stream'.")
+STREAM_COMPRESS = TRANSPORT == "stream" and COMPRESSION != NONE
+if STREAM_COMPRESS:
+    print(f"Note: MAPREDUCE_TRANSPORT=stream compresses the ssh pipes instead of files ({COMPRESSION} ignored)")
+    COMPRESSION = NONE
+    COMPRESSION_LEVEL = None
+COMPRESSION_FLAGS = f"--compression {COMPRESSION} "
+if COMPRESSION_LEVEL is not None:
+    COMPRESSION_FLAGS += f"--compression-level {COMPRESSION_LEVEL} "
+
+INTERMEDIATE_EXT = (".bin" if INTERMEDIATE_FORMAT == BINARY else ".txt") + COMPRESSION_EXT[COMPRESSION]
+
+# "mapper": mappers write one file per reducer shard and the driver only routes files.
+# "direct": mappers push those shard files to the reducers' private IPs (app/shuffle.py);
+#           the driver never sees the intermediate data.
+# "driver": the driver re-reads every mapper tuple and builds the reducer partitions itself.
+SHUFFLE_MODE = os.getenv("MAPREDUCE_SHUFFLE", "mapper")
+if SHUFFLE_MODE not in ("mapper", "direct", "driver"):
+    sys.exit(f"Invalid value for MAPREDUCE_SHUFFLE: {SHUFFLE_MODE}. Must be 'mapper', 'direct' or 'driver'.")
+if TRANSPORT == "stream" and SHUFFLE_MODE != "mapper":
+    sys.exit("MAPREDUCE_TRANSPORT=stream needs MAPREDUCE_SHUFFLE=mapper (the driver forwards the mapper streams).")
+# Reducer r listens on SHUFFLE_PORT + r in direct mode (distinct ports also let one box play every host)
+SHUFFLE_PORT = parse_positive_int("MAPREDUCE_SHUFFLE_PORT", 7070)
+if SHUFFLE_MODE == "direct" and not all(reducer.get("private_ip") for reducer in instances["reducers"]):
+    sys.exit("MAPREDUCE_SHUFFLE=direct needs a private_ip for every reducer in mapreduce_instances.json.")
+
+# "balanced": bucket -> reducer table built from a sampled load estimate.
+# "hash": plain pair hash modulo the number of reducers.
+PARTITIONER = os.getenv("MAPREDUCE_PARTITIONER", "balanced")
+if PARTITIONER not in ("balanced", "hash"):
+    sys.exit(f"Invalid value for MAPREDUCE_PARTITIONER: {PARTITIONER}. Must be 'balanced' or 'hash'.")
+try:
+    PARTITION_SAMPLE_RATE = float(os.getenv("MAPREDUCE_PARTITION_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
+    if not 0 < PARTITION_SAMPLE_RATE <= 1:
+        raise ValueError
+except ValueError:
+    sys.exit("Invalid value for MAPREDUCE_PARTITION_SAMPLE_RATE. Must be in (0, 1].")
+
+# Chunks are cut by mapper work (emitted records) instead of line count, and adjacency
+# lines whose friend-pair triangle alone would exceed HUB_TOLERANCE of one mapper's share
+# are split into row bands spread over consecutive chunks.
+HUB_SPLIT = parse_flag("MAPREDUCE_HUB_SPLIT", True)
+# Step 1 reads the memory-mapped CSR cache of the input (app/graph_cache.py), rebuilt when stale
+GRAPH_CACHE = parse_flag("MAPREDUCE_GRAPH_CACHE", True)
+try:
+    HUB_TOLERANCE = float(os.getenv("MAPREDUCE_HUB_TOLERANCE", "0.05"))
+    if not 0 < HUB_TOLERANCE <= 1:
+        raise ValueError
+except ValueError:
+    sys.exit("Invalid value for MAPREDUCE_HUB_TOLERANCE. Must be in (0, 1].")
+
+# Recommendations per user; reducers only ship this many candidates back to the driver
+TOP_K = parse_positive_int("MAPREDUCE_TOP_K", 10)
+
+# Streaming reducers external-sort their partition so peak memory stays at the budget
+REDUCER_STREAMING = parse_flag("MAPREDUCE_REDUCER_STREAMING", False)
+REDUCER_MEMORY_MB = parse_positive_int("MAPREDUCE_REDUCER_MEMORY_MB", 256)
+# Processes per reducer host, each reducing one user-ID range; "auto" uses every vCPU of the host
+REDUCER_WORKERS = os.getenv("MAPREDUCE_REDUCER_WORKERS", "auto")
+
+# Upper bound on hosts driven at the same time (each task is upload -> run -> download)
+MAX_PARALLEL = parse_positive_int("MAPREDUCE_MAX_PARALLEL", 16)
+
+# A failed mapper / reducer task is retried on another host of the same role, up to TASK_RETRIES times
+try:
+    TASK_RETRIES = int(os.getenv("MAPREDUCE_TASK_RETRIES", "2"))
+    if TASK_RETRIES < 0:
+        raise ValueError
+except ValueError:
+    sys.exit("Invalid value for MAPREDUCE_TASK_RETRIES. Must be a non-negative integer.")
+# Once SPECULATION_QUORUM of a phase's tasks are done, a task running longer than SPECULATION_FACTOR
+# times their median gets one duplicate on an idle host; whichever copy finishes first is kept.
+SPECULATION = parse_flag("MAPREDUCE_SPECULATION", True)
+try:
+    SPECULATION_FACTOR = float(os.getenv("MAPREDUCE_SPECULATION_FACTOR", "1.5"))
+    if SPECULATION_FACTOR < 1:
+        raise ValueError
+except ValueError:
+    sys.exit("Invalid value for MAPREDUCE_SPECULATION_FACTOR. Must be a number >= 1.")
+try:
+    SPECULATION_QUORUM = float(os.getenv("MAPREDUCE_SPECULATION_QUORUM", "0.5"))
+    if not 0 < SPECULATION_QUORUM <= 1:
+        raise ValueError
+except ValueError:
+    sys.exit("Invalid value for MAPREDUCE_SPECULATION_QUORUM. Must be in (0, 1].")
+
+# Also run the local NumPy engine (app/matrix_engine.py) and report both throughputs
+COMPARE_ENGINE = parse_flag("MAPREDUCE_COMPARE_ENGINE", False)
+
+remote = open_backend(instances, KEY_PATH)
+
+print_lock = threading.Lock()
+stats_lock = threading.Lock()
+cancel_event = threading.Event()
+# Name and cancel event of the task attempt running on the current thread
+attempt_state = threading.local()
+
+
+class TaskFailed(Exception):
+    pass
+
+
+def log(message, label=None):
+    prefix = f"[{label}] " if label else "  "
+    with print_lock:
+        print(f"{prefix}{message}")
 
 
 def ssh(host, cmd, stream_output=False, label=None):
-    remote = f'bash -lc "{cmd}"'
     if stream_output:
-        process = subprocess.Popen(
-            SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{host}", remote],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-        )
-        collected = []
-        prefix = f"[{label}] " if label else ""
-        try:
-            if process.stdout:
-                for line in process.stdout:
-                    collected.append(line)
-                    print(f"{prefix}{line}", end="")
-        finally:
-            process.wait()
-        return subprocess.CompletedProcess(
-            args=process.args,
-            returncode=process.returncode,
-            stdout="".join(collected),
-            stderr="",
-        )
-    result = subprocess.run(
-        SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{host}", remote],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    return result
+        return remote.run(host, cmd, stream=True, on_line=lambda line: log(line.rstrip("\n"), label))
+    return remote.run(host, cmd)
 
 
 def scp_upload(host, local_path, remote_path):
-    result = subprocess.run(
-        SCP_BASE + ["-i", KEY_PATH, local_path, f"{SSH_USER}@{host}:{remote_path}"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    return result
+    return remote.upload(host, local_path, remote_path)
 
 
 def scp_download(host, remote_path, local_path):
-    result = subprocess.run(
-        SCP_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{host}:{remote_path}", local_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    return result
+    return remote.download(host, remote_path, local_path)
 
 
-def sort_user_key(user_id):
-    return int(user_id) if user_id.isdigit() else user_id
+def check_cancelled(label):
+    cancelled = getattr(attempt_state, "cancelled", None)
+    if cancel_event.is_set() or (cancelled is not None and cancelled.is_set()):
+        raise TaskFailed(f"{label}: cancelled")
 
 
-def shard_for_pair(pair_key, num_reducers):
-    digest = hashlib.md5(pair_key.encode("utf-8")).hexdigest()
-    return int(digest[:8], 16) % num_reducers
+def download_output(stage, host, remote_path, local_path):
+    """Download under a per-attempt name first, so duplicate attempts of a task never share a file."""
+    partial = f"{local_path}.{getattr(attempt_state, 'name', 'attempt')}"
+    result = timed_transfer(stage, scp_download, host, remote_path, partial, partial)
+    if result.returncode == 0:
+        os.replace(partial, local_path)
+    return result
 
 
-print("=== Friend Recommendation MapReduce ===\n")
+def rotated(hosts, i):
+    """Task i's own host first, then the others of the same role as retry / speculation targets."""
+    return hosts[i:] + hosts[:i]
+
+
+def run_tasks(phase, tasks):
+    """Run (label, hosts, fn) tasks, fn(host), with at most MAX_PARALLEL attempts at a time.
+
+    A task starts on hosts[0]. A failed attempt is retried on another of its hosts (up to
+    TASK_RETRIES times) and a straggler gets one speculative copy on an idle host; the first
+    attempt to finish wins and the others are terminated. Only a task out of retries stops the run.
+    """
+    phase_start = time.perf_counter()
+    timings_from = len(task_timings)
+    state = {
+        label: {"hosts": hosts, "fn": fn, "failures": 0, "failed_hosts": set(), "running": {},
+                "speculated": False, "done": False}
+        for label, hosts, fn in tasks
+    }
+    queue = [(label, hosts[0], False) for label, hosts, _ in tasks]
+    running = {}
+    results = {}
+    durations = []
+    summary = {"phase": phase, "tasks": len(tasks), "attempts": 0, "retries": 0,
+               "speculative": 0, "speculative_wins": 0}
+
+    def attempt(fn, host, info):
+        attempt_state.name = info["name"]
+        attempt_state.cancelled = info["cancelled"]
+        with remote.group(info["name"]):
+            return fn(host)
+
+    def launch(label, host, speculative):
+        summary["attempts"] += 1
+        info = {"label": label, "host": host, "name": f"attempt{summary['attempts']}", "speculative": speculative,
+                "cancelled": threading.Event(), "start": time.perf_counter()}
+        running[pool.submit(attempt, state[label]["fn"], host, info)] = info
+        state[label]["running"][info["name"]] = info
+
+    def host_load(host):
+        return sum(1 for info in running.values() if info["host"] == host)
+
+    def settle(future):
+        info = running.pop(future)
+        label = info["label"]
+        task = state[label]
+        task["running"].pop(info["name"])
+        elapsed = time.perf_counter() - info["start"]
+        try:
+            result = future.result()
+        except Exception as exc:
+            if task["done"]:
+                outcome = "cancelled"
+            else:
+                outcome = "failed"
+                task["failures"] += 1
+                task["failed_hosts"].add(info["host"])
+                if task["failures"] > TASK_RETRIES:
+                    raise TaskFailed(f"{exc} (failed {task['failures']} times)")
+                log(f"Attempt on {info['host']} failed after {elapsed:.2f}s: {exc}", label)
+                if not task["running"]:
+                    candidates = [host for host in task["hosts"] if host not in task["failed_hosts"]]
+                    host = min(candidates or task["hosts"], key=host_load)
+                    summary["retries"] += 1
+                    log(f"Retrying on {host} ({task['failures']}/{TASK_RETRIES})", label)
+                    queue.insert(0, (label, host, False))
+        else:
+            if task["done"]:
+                outcome = "lost"
+            else:
+                outcome = "won"
+                task["done"] = True
+                results[label] = result
+                durations.append(elapsed)
+                for other in task["running"].values():
+                    other["cancelled"].set()
+                    remote.terminate_group(other["name"])
+                if info["speculative"]:
+                    summary["speculative_wins"] += 1
+                log(f"OK {label} finished in {elapsed:.2f}s"
+                    + (f" (speculative copy on {info['host']})" if info["speculative"] else ""))
+        with stats_lock:
+            metrics = attempt_metrics.pop(info["name"], None)
+        task_timings.append({
+            "task": label, "phase": phase, "host": info["host"], "attempt": info["name"],
+            "speculative": info["speculative"], "outcome": outcome, "start": info["start"] - pipeline_start,
+            "end": time.perf_counter() - pipeline_start, "metrics": metrics,
+        })
+
+    def speculate():
+        if len(durations) < max(1, SPECULATION_QUORUM * len(tasks)):
+            return
+        median = statistics.median(durations)
+        now = time.perf_counter()
+        for info in list(running.values()):
+            if len(running) >= MAX_PARALLEL:
+                return
+            task = state[info["label"]]
+            if task["done"] or task["speculated"] or now - info["start"] <= SPECULATION_FACTOR * median:
+                continue
+            idle = [host for host in task["hosts"] if host_load(host) == 0]
+            if not idle:
+                continue
+            task["speculated"] = True
+            summary["speculative"] += 1
+            log(f"Running for {now - info['start']:.1f}s (median {median:.1f}s): "
+                f"speculative copy on {idle[0]}", info["label"])
+            launch(info["label"], idle[0], True)
+
+    pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL)
+    try:
+        while len(results) < len(tasks):
+            while queue and len(running) < MAX_PARALLEL:
+                launch(*queue.pop(0))
+            done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                settle(future)
+            if SPECULATION:
+                speculate()
+        # Losers were terminated; record how they ended
+        for future in list(running):
+            future.exception()
+            settle(future)
+    except Exception as exc:
+        cancel_event.set()
+        for future in running:
+            future.cancel()
+        remote.terminate_all()
+        pool.shutdown(wait=True)
+        print(f"\nERROR: {exc}")
+        print("Cancelled the remaining tasks")
+        sys.exit(1)
+    pool.shutdown(wait=True)
+    # A task lasts from its first attempt to the attempt that won
+    durations = []
+    for label in state:
+        attempts = [t for t in task_timings[timings_from:] if t["task"] == label]
+        durations.append(max(t["end"] for t in attempts if t["outcome"] == "won") - min(t["start"] for t in attempts))
+    print(f"  Phase wall time: {time.perf_counter() - phase_start:.2f}s "
+          f"(slowest task {max(durations):.2f}s, sum of tasks {sum(durations):.2f}s)")
+    if summary["retries"] or summary["speculative"]:
+        print(f"  Retries: {summary['retries']}, speculative copies: {summary['speculative']} "
+              f"({summary['speculative_wins']} won)")
+    task_summaries.append(summary)
+    return [results[label] for label, _, _ in tasks]
+
+
+# One entry per task attempt: task, phase, host, attempt, speculative, outcome (won / failed / lost /
+# cancelled), start and end in seconds since the pipeline started, and the TASK_METRICS of the process
+task_timings = []
+# Per phase: tasks, attempts, retries, speculative copies and how many of them won
+task_summaries = []
+# TASK_METRICS of finished attempts by attempt name, until run_tasks files them with the attempt
+attempt_metrics = {}
+# Per pipeline stage: wall / CPU time, peak RSS, records and bytes in and out, bytes moved between hosts
+STAGES = ("split", "map", "transfer", "partition", "reduce", "merge")
+stage_metrics = []
+
+
+def record_task_metrics(output):
+    metrics = parse_task_metrics(output)
+    if metrics is not None:
+        with stats_lock:
+            attempt_metrics[getattr(attempt_state, "name", "attempt")] = metrics
+
+
+def finish_stage(meter, phase=None, bytes_transferred=0, **counts):
+    """Close a stage Meter into stage_metrics.
+
+    Driver stages report the driver's own CPU and RSS. For the map and reduce stages (`phase`) the
+    counters are those of the winning attempts, CPU is summed over every attempt (losers burned it
+    too) and RSS is the largest of any attempt; the driver's share is kept as driver_cpu_seconds.
+    """
+    meter.add(**counts)
+    metrics = meter.result(start=meter.started - pipeline_start, end=time.perf_counter() - pipeline_start,
+                           bytes_transferred=bytes_transferred)
+    metrics["stage"] = metrics.pop("name")
+    if phase is not None:
+        attempts = [t["metrics"] for t in task_timings if t.get("phase") == phase and t.get("metrics")]
+        won = [t["metrics"] for t in task_timings
+               if t.get("phase") == phase and t.get("metrics") and t["outcome"] == "won"]
+        for key in COUNTERS:
+            metrics[key] = sum(task.get(key, 0) for task in won)
+        metrics["driver_cpu_seconds"] = metrics["cpu_seconds"]
+        metrics["cpu_seconds"] = sum(task["cpu_seconds"] for task in attempts)
+        metrics["peak_rss_mb"] = max((task["peak_rss_mb"] for task in attempts), default=0.0)
+        metrics["tasks"] = len(won)
+    stage_metrics.append(metrics)
+    return metrics
+
+
+# Per intermediate stage: raw vs compressed bytes, time spent compressing and moving the files
+transfer_stats = defaultdict(lambda: {
+    "files": 0, "raw_bytes": 0, "compressed_bytes": 0, "compress_seconds": 0.0, "transfer_seconds": 0.0,
+})
+
+
+def timed_transfer(stage, transfer, host, source, destination, local_path):
+    started = time.perf_counter()
+    result = transfer(host, source, destination)
+    if result.returncode == 0:
+        with stats_lock:
+            stats = transfer_stats[stage]
+            stats["files"] += 1
+            stats["transfer_seconds"] += time.perf_counter() - started
+            stats["compressed_bytes"] += os.path.getsize(local_path)
+    return result
 
-print("Step 1: Splitting input data into chunks for mappers...")
-num_mappers = len(instances["mappers"])
-print(f"  Number of mappers: {num_mappers}")
 
-with open(DATA_FILE, "r") as f:
-    total_lines = sum(1 for _ in f)
-print(f"  Total lines in input: {total_lines}")
+def parse_compression_stats(output):
+    for line in output.splitlines():
+        if line.startswith("COMPRESSION_STATS:"):
+            try:
+                return json.loads(line.split("COMPRESSION_STATS:", 1)[1])
+            except ValueError:
+                return None
+    return None
 
-lines_per_chunk = total_lines // num_mappers + 1
-print(f"  Lines per chunk: ~{lines_per_chunk}")
 
-all_users = set()
+def sort_user_key(user_id):
+    return int(user_id) if user_id.isdigit() else user_id
 
-shutil.rmtree("data/chunks", ignore_errors=True)
-os.makedirs("data/chunks", exist_ok=True)
-chunk_files = []
 
-with open(DATA_FILE, "r") as infile:
-    for i in range(num_mappers):
-        chunk_file = f"data/chunks/chunk_{i}.txt"
-        chunk_files.append(chunk_file)
-
-        with open(chunk_file, "w") as outfile:
-            for _ in range(lines_per_chunk):
-                line = infile.readline()
-                if not line:
-                    break
-                outfile.write(line)
-
-                stripped = line.strip()
-                if not stripped:
+def reducer_output_lines(path, meter=None):
+    """(order key, user, recommendations field) of every line of one reducer output, in file order."""
+    lines = 0
+    chars = 0
+    with open_stream(path, "r", COMPRESSION) as f:
+        for line in f:
+            lines += 1
+            chars += len(line)
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) == 2:
+                yield user_order_key(parts[0]), parts[0], parts[1]
+    transfer_stats["reducer_outputs"]["raw_bytes"] += chars
+    if meter is not None:
+        meter.add(records_in=lines, bytes_read=chars)
+
+
+def merged_candidate_counts(paths, meter=None):
+    """k-way merge of the reducer outputs: (user, candidate counts summed over reducers), one user at a time."""
+    merged = heapq.merge(*(reducer_output_lines(path, meter) for path in paths))
+    for _, group in groupby(merged, key=lambda entry: entry[0]):
+        # One order key can hold several IDs ("7", "007"): sum per exact ID
+        users = {}
+        for _, user_id, recs in group:
+            candidate_counts = users.setdefault(user_id, {})
+            for item in recs.split(","):
+                candidate, _, count_str = item.partition(":")
+                candidate = candidate.strip()
+                count_str = count_str.strip()
+                if not candidate or not count_str:
                     continue
-
-                parts = stripped.split("\t")
-                if not parts:
+                try:
+                    count_val = int(count_str)
+                except ValueError:
                     continue
+                candidate_counts[candidate] = candidate_counts.get(candidate, 0) + count_val
+        yield from users.items()
+
+
+def count_records(path):
+    if INTERMEDIATE_FORMAT == BINARY and COMPRESSION == NONE:
+        return os.path.getsize(path) // RECORD_SIZE
+    total = 0
+    with open_stream(path, "rb", COMPRESSION) as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            total += len(block) if INTERMEDIATE_FORMAT == BINARY else block.count(b"\n")
+    return total // RECORD_SIZE if INTERMEDIATE_FORMAT == BINARY else total
+
+
+def print_partition_load(table, actual_records, actual_bytes):
+    predicted_records = table.predicted.get("records") or [0.0] * table.num_shards
+    predicted_bytes = table.predicted.get("bytes") or [0.0] * table.num_shards
+    total_pr = sum(predicted_records) or 1.0
+    total_pb = sum(predicted_bytes) or 1.0
+    total_ar = sum(actual_records) or 1
+    total_ab = sum(actual_bytes) or 1
+    print(f"  {'Reducer':<8} {'Pred rec %':>10} {'Actual rec %':>13} {'Pred MB %':>10} {'Actual MB %':>12}")
+    for idx in range(table.num_shards):
+        print(
+            f"  {idx + 1:<8} {100 * predicted_records[idx] / total_pr:>10.1f} "
+            f"{100 * actual_records[idx] / total_ar:>13.1f} "
+            f"{100 * predicted_bytes[idx] / total_pb:>10.1f} "
+            f"{100 * actual_bytes[idx] / total_ab:>12.1f}"
+        )
+    if table.predicted:
+        print(f"  Predicted imbalance (max/mean): records {imbalance(predicted_records):.3f}, "
+              f"bytes {imbalance(predicted_bytes):.3f}")
+    print(f"  Actual imbalance (max/mean):    records {imbalance(actual_records):.3f}, "
+          f"bytes {imbalance(actual_bytes):.3f}")
 
-                user_id = parts[0].strip()
-                if user_id:
-                    all_users.add(user_id)
-
-                if len(parts) == 2 and parts[1].strip():
-                    for friend in parts[1].split(","):
-                        friend_id = friend.strip()
-                        if friend_id:
-                            all_users.add(friend_id)
-
-        print(f"  Created {chunk_file}")
-
-print(f"OK Split into {len(chunk_files)} chunks\n")
 
-# Step 2: Upload chunks to mapper instances and run mappers
-print("Step 2: Distributing chunks to mappers and executing...")
-mapper_outputs = []
+print("=== Friend Recommendation MapReduce ===\n")
+pipeline_start = time.perf_counter()
 
-for i, mapper in enumerate(instances["mappers"]):
-    host = mapper["public_ip"]
-    chunk_file = chunk_files[i]
-    remote_chunk = f"~/data/chunk_{i}.txt"
-    remote_output = f"~/data/mapper_output_{i}.txt"
+print("Step 1: Splitting input data into chunks for mappers...")
+split_meter = Meter("split", children=False)
+num_mappers = len(instances["mappers"])
+num_reducers = len(instances["reducers"])
+print(f"  Number of mappers: {num_mappers}")
 
-    print(f"\n  Mapper {i + 1}/{num_mappers} ({host}):")
-    print(f"    Uploading {chunk_file}...")
-    result = scp_upload(host, chunk_file, remote_chunk)
+estimator = None
+if PARTITIONER == "balanced":
+    estimator = LoadEstimator(num_reducers * BUCKETS_PER_SHARD, INTERMEDIATE_FORMAT, PARTITION_SAMPLE_RATE)
+
+# One pass over the memory-mapped input (or its CSR cache); chunks are (offset, length) ranges of it
+# plus hub bands, written straight from the mapping when they are shipped to the mappers
+scan_start = time.perf_counter()
+keep_heaviest = math.ceil(num_mappers / HUB_TOLERANCE) + 1
+graph = None
+if GRAPH_CACHE:
+    try:
+        graph = load_graph(DATA_FILE, log=lambda message: print(f"  {message}"))
+    except ValueError as exc:
+        print(f"  WARN: graph cache unavailable ({exc}); scanning the text input")
+if graph is not None:
+    with graph:
+        scan = scan_graph(graph, keep_heaviest, observe=estimator.observe_row if estimator is not None else None)
+    print(f"  Scanned the graph cache {graph.path}")
+else:
+    scan = scan_input(DATA_FILE, keep_heaviest, observe=estimator.observe_line if estimator is not None else None)
+all_users = scan.users
+num_users = len(all_users)
+print(f"  Total lines in input: {scan.lines} ({scan.size / (1024 * 1024):.2f} MB, {num_users} users)")
+
+if HUB_SPLIT:
+    work_per_chunk = scan.total_work / num_mappers
+    max_piece = max(1, int(HUB_TOLERANCE * work_per_chunk))
+    print(f"  Mapper records per chunk: ~{work_per_chunk:.0f} (hub bands <= {max_piece} records)")
+    chunks, chunk_work, hub_lines, hub_bands = plan_chunks(scan, num_mappers, max_piece)
+else:
+    chunks = [[(start, end - start)] for start, end in line_aligned_ranges(DATA_FILE, num_mappers)]
+    chunks += [[] for _ in range(num_mappers - len(chunks))]
+chunk_names = [f"chunk_{i}.txt" for i in range(num_mappers)]
+
+for i, pieces in enumerate(chunks):
+    size_mb = chunk_bytes(pieces) / (1024 * 1024)
+    ranges = sum(1 for piece in pieces if not isinstance(piece, str))
+    if HUB_SPLIT:
+        print(f"  {chunk_names[i]}: {size_mb:.2f} MB in {ranges} range(s) + {len(pieces) - ranges} band(s), "
+              f"{chunk_work[i]} mapper records")
+    else:
+        print(f"  {chunk_names[i]}: {size_mb:.2f} MB in {ranges} range(s)")
+if HUB_SPLIT:
+    print(f"  Split {hub_lines} hub lines into {hub_bands} row bands; "
+          f"mapper work imbalance (max/mean): {imbalance(chunk_work):.3f}")
+print(f"  Scan and split time: {time.perf_counter() - scan_start:.2f}s")
+
+print(f"OK Split into {len(chunks)} chunks\n")
+
+print("Step 1b: Building the reducer partition table...")
+partition_table_file = "data/partition_table.json"
+if estimator is not None:
+    partition_table = assign_buckets(estimator.records, estimator.bytes, num_reducers)
+    print(f"  Sampled {estimator.sampled_users} users ({PARTITION_SAMPLE_RATE:.1%}) "
+          f"into {partition_table.num_buckets} buckets")
+    for idx in range(num_reducers):
+        print(f"  Reducer {idx + 1} predicted: "
+              f"{partition_table.predicted['records'][idx]:.0f} records, "
+              f"{partition_table.predicted['bytes'][idx] / (1024 * 1024):.2f} MB")
+    print(f"  Predicted imbalance (max/mean): "
+          f"records {imbalance(partition_table.predicted['records']):.3f}, "
+          f"bytes {imbalance(partition_table.predicted['bytes']):.3f}")
+else:
+    partition_table = PartitionTable.uniform(num_reducers)
+    print(f"  Uniform hash partitioning over {num_reducers} reducers")
+partition_table.save(partition_table_file)
+print(f"OK Saved {partition_table_file}\n")
+# Chunk lines are the input lines with every hub line replaced by its bands
+split_stage = finish_stage(split_meter, records_in=scan.lines, bytes_read=scan.size,
+             records_out=scan.lines + (hub_bands - hub_lines if HUB_SPLIT else 0),
+             bytes_written=sum(chunk_bytes(pieces) for pieces in chunks))
+
+
+def upload_chunk(host, i, remote_path):
+    """Pipe chunk i straight from the memory-mapped input into a file on the host."""
+    process = remote.open_pipe(host, f"cat > {remote_path}")
+    try:
+        write_chunk(process.stdin, DATA_FILE, chunks[i])
+        process.stdin.close()
+    except OSError:
+        pass
+    stderr = process.stderr.read().decode("utf-8", "replace")
+    process.stdout.close()
+    process.stderr.close()
+    return subprocess.CompletedProcess(args=process.args, returncode=remote.close_pipe(process), stdout="",
+                                       stderr=stderr)
+
+
+def mapper_task(i, host):
+    label = f"mapper-{i+1}"
+    remote_chunk = f"~/data/{chunk_names[i]}"
+    remote_output = f"~/data/mapper_output_{i}{INTERMEDIATE_EXT}"
+
+    log(f"Uploading {chunk_names[i]} ({chunk_bytes(chunks[i]) / (1024 * 1024):.2f} MB) to {host}...", label)
+    result = upload_chunk(host, i, remote_chunk)
     if result.returncode != 0:
-        print(f"    ERROR uploading: {result.stderr}")
-        sys.exit(1)
-
-    print("    Running mapper...")
+        raise TaskFailed(f"{label}: uploading {chunk_names[i]}: {result.stderr}")
+
+    mapper_flags = f"--format {INTERMEDIATE_FORMAT} --workers {MAPPER_WORKERS} {COMPRESSION_FLAGS}"
+    if MAPPER_COMBINE:
+        mapper_flags += f"--combine --memory-mb {MAPPER_MEMORY_MB} "
+    if SHUFFLE_MODE in ("mapper", "direct"):
+        result = scp_upload(host, partition_table_file, "~/data/partition_table.json")
+        if result.returncode != 0:
+            raise TaskFailed(f"{label}: uploading partition table: {result.stderr}")
+        mapper_flags += "--partition-table ~/data/partition_table.json "
+    check_cancelled(label)
+    log("Running mapper...", label)
     result = ssh(
         host,
-        f"python3 ~/mapreduce/mapper.py {remote_chunk} {remote_output}",
+        f"python3 ~/mapreduce/mapper.py {mapper_flags}{remote_chunk} {remote_output}",
         stream_output=True,
-        label=f"mapper-{i+1}",
+        label=label,
     )
     if result.returncode != 0:
-        print(f"    ERROR running mapper: {result.stderr}")
-        sys.exit(1)
-
-    print("    OK Mapper completed")
-    mapper_outputs.append((host, remote_output, f"mapper_output_{i}.txt"))
-
-print(f"\nOK All {num_mappers} mappers completed\n")
-
-print("Step 3: Collecting mapper outputs...")
-shutil.rmtree("data/mapper_outputs", ignore_errors=True)
-os.makedirs("data/mapper_outputs", exist_ok=True)
-local_mapper_outputs = []
-
-for host, remote_path, filename in mapper_outputs:
-    local_path = f"data/mapper_outputs/{filename}"
-    print(f"  Downloading from {host}...")
-    result = scp_download(host, remote_path, local_path)
+        raise TaskFailed(f"{label}: mapper exited with code {result.returncode}")
+    record_task_metrics(result.stdout)
+
+    mapper_stats = parse_compression_stats(result.stdout)
+    if mapper_stats:
+        with stats_lock:
+            transfer_stats["mapper_outputs"]["raw_bytes"] += mapper_stats["raw_bytes"]
+            transfer_stats["mapper_outputs"]["compress_seconds"] += mapper_stats["write_seconds"]
+
+    if SHUFFLE_MODE == "direct":
+        return push_partitions(i, host, remote_output)
+
+    filename = f"mapper_output_{i}{INTERMEDIATE_EXT}"
+    if SHUFFLE_MODE == "mapper":
+        outputs = [(partition_path(remote_output, r), partition_path(filename, r)) for r in range(num_reducers)]
+    else:
+        outputs = [(remote_output, filename)]
+    local_paths = []
+    for remote_path, name in outputs:
+        check_cancelled(label)
+        local_path = f"data/mapper_outputs/{name}"
+        log(f"Downloading {remote_path}...", label)
+        result = download_output("mapper_outputs", host, remote_path, local_path)
+        if result.returncode != 0:
+            raise TaskFailed(f"{label}: downloading {remote_path}: {result.stderr}")
+        local_paths.append(local_path)
+    return local_paths
+
+
+def push_partitions(i, host, remote_output):
+    """Mapper host sends partition r of its output straight to reducer r over the private network."""
+    label = f"mapper-{i+1}"
+    sends = [
+        f"python3 ~/mapreduce/shuffle.py send {reducer['private_ip']} {SHUFFLE_PORT + r} "
+        f"{partition_path(remote_output, r)}"
+        for r, reducer in enumerate(instances["reducers"])
+    ]
+    check_cancelled(label)
+    log(f"Pushing {num_reducers} partitions to the reducers...", label)
+    started = time.perf_counter()
+    result = ssh(host, " && ".join(sends), stream_output=True, label=label)
     if result.returncode != 0:
-        print(f"    ERROR downloading: {result.stderr}")
-        sys.exit(1)
-    local_mapper_outputs.append(local_path)
-
-print(f"OK Downloaded {len(local_mapper_outputs)} mapper outputs\n")
-
-print("Step 4: Preparing reducer partitions...")
-num_reducers = len(instances["reducers"])
-partition_dir = "data/reducer_partitions"
-shutil.rmtree(partition_dir, ignore_errors=True)
-os.makedirs(partition_dir, exist_ok=True)
-
-partition_counts = [defaultdict(lambda: [0, False]) for _ in range(num_reducers)]
-total_partition_lines = 0
-
-for local_output in local_mapper_outputs:
-    print(f"  Aggregating {local_output}...")
-    with open(local_output, "r") as src:
-        for line in src:
+        raise TaskFailed(f"{label}: shuffle send exited with code {result.returncode}")
+    with stats_lock:
+        transfer_stats["mapper_outputs"]["transfer_seconds"] += time.perf_counter() - started
+    return []
+
+
+def start_shuffle_receivers():
+    receivers = []
+    for idx, reducer in enumerate(instances["reducers"]):
+        label = f"reducer-{idx+1}"
+        process = remote.open_pipe(
+            reducer["public_ip"],
+            f"rm -rf ~/data/shuffle && python3 ~/mapreduce/shuffle.py serve --port {SHUFFLE_PORT + idx} "
+            f"--dir ~/data/shuffle --expect {num_mappers}",
+        )
+        process.stdin.close()
+        ready = process.stdout.readline().decode("utf-8")
+        if not ready.startswith("LISTENING:"):
+            remote.terminate_all()
+            sys.exit(f"ERROR: {label}: shuffle receiver did not start: "
+                     f"{process.stderr.read().decode('utf-8', 'replace').strip()}")
+        output = []
+        threads = [
+            threading.Thread(target=lambda p=process, out=output: out.extend(p.stdout), daemon=True),
+            threading.Thread(target=lambda p=process, label=label: [
+                log(line.decode("utf-8", "replace").rstrip("\n"), label) for line in p.stderr
+            ], daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        receivers.append((process, threads, output))
+        log(f"Shuffle receiver listening on {reducer['private_ip']}:{SHUFFLE_PORT + idx}", label)
+    return receivers
+
+
+def finish_shuffle_receivers(receivers):
+    received_bytes = []
+    for idx, (process, threads, output) in enumerate(receivers):
+        returncode = remote.close_pipe(process)
+        for thread in threads:
+            thread.join()
+        if returncode != 0:
+            sys.exit(f"ERROR: reducer-{idx+1}: shuffle receiver exited with code {returncode}")
+        stats = parse_shuffle_stats(b"".join(output).decode("utf-8"))
+        received_bytes.append(stats["bytes"] if stats else 0)
+        transfer_stats["mapper_outputs"]["files"] += stats["files"] if stats else 0
+    transfer_stats["mapper_outputs"]["compressed_bytes"] += sum(received_bytes)
+    return received_bytes
+
+
+def parse_shuffle_stats(output):
+    for line in output.splitlines():
+        if line.startswith("SHUFFLE_STATS:"):
+            return json.loads(line.split("SHUFFLE_STATS:", 1)[1])
+    return None
+
+
+def direct_partitions(received_bytes):
+    # Reducer r already holds every mapper's .p<r> file under ~/data/shuffle
+    routed = []
+    for idx, size in enumerate(received_bytes):
+        routed.append([
+            partition_path(f"~/data/shuffle/mapper_output_{i}{INTERMEDIATE_EXT}", idx) for i in range(num_mappers)
+        ])
+        print(f"  Reducer {idx + 1} partition: {num_mappers} mapper file(s) received, "
+              f"{size / (1024 * 1024):.2f} MB")
+    print(f"  Actual imbalance (max/mean):    bytes {imbalance(received_bytes):.3f}")
+    return routed
+
+
+def route_mapper_partitions():
+    # Mappers already sharded their output: reducer r gets every mapper's .p<r> file as-is
+    routed = [[] for _ in range(num_reducers)]
+    for i in range(num_mappers):
+        for r in range(num_reducers):
+            routed[r].append(partition_path(f"data/mapper_outputs/mapper_output_{i}{INTERMEDIATE_EXT}", r))
+    actual_records = []
+    actual_bytes = []
+    for idx, paths in enumerate(routed):
+        actual_records.append(sum(count_records(path) for path in paths))
+        actual_bytes.append(sum(os.path.getsize(path) for path in paths))
+        print(f"  Reducer {idx + 1} partition: {len(paths)} mapper file(s), "
+              f"{actual_records[-1]} records, {actual_bytes[-1] / (1024 * 1024):.2f} MB")
+    print_partition_load(partition_table, actual_records, actual_bytes)
+    return routed, actual_records
+
+
+def build_driver_partitions():
+    partition_counts = [defaultdict(lambda: [0, False]) for _ in range(num_reducers)]
+    total_partition_lines = 0
+
+    for local_output in local_mapper_outputs:
+        print(f"  Aggregating {local_output}...")
+        for user_a, user_b, marker in read_records(local_output, INTERMEDIATE_FORMAT, COMPRESSION):
             total_partition_lines += 1
-            parts = line.rstrip("\n").split("\t")
-            if len(parts) != 2:
-                continue
-            pair_key, marker = parts
-            shard = shard_for_pair(pair_key, num_reducers)
+            pair_key = (user_a, user_b)
+            shard = partition_table.shard(user_a, user_b)
             state = partition_counts[shard].get(pair_key)
             if state is None:
                 state = [0, False]
                 partition_counts[shard][pair_key] = state
 
-            if marker == "-1":
+            if marker == -1:
                 state[1] = True
                 state[0] = 0
             else:
                 if not state[1]:
-                    state[0] += 1
-
-print(f"  Total mapper tuples processed for partitioning: {total_partition_lines}")
-
-partition_paths = []
-for idx, counts in enumerate(partition_counts):
-    path = os.path.join(partition_dir, f"reducer_{idx}.txt")
-    partition_paths.append(path)
-    pair_total = 0
-    with open(path, "w") as outfile:
-        for pair_key, (count, blocked) in counts.items():
-            if blocked or count == 0:
-                continue
-            outfile.write(f"{pair_key}\t{count}\n")
-            pair_total += 1
-    size_mb = os.path.getsize(path) / (1024 * 1024)
-    print(f"  Reducer {idx + 1} partition: {pair_total} pairs, {size_mb:.2f} MB")
-    counts.clear()
-
-print("OK Reducer partitions prepared\n")
-
-print("Step 5: Running reducers...")
-reducer_results = []
-
-for idx, reducer in enumerate(instances["reducers"]):
-    host = reducer["public_ip"]
-    print(f"\n  Reducer {idx + 1}/{num_reducers} ({host}):")
-
-    partition_path = partition_paths[idx]
-    remote_input = f"~/data/reducer_input_{idx}.txt"
-    print(f"    Uploading partition file ({partition_path})...")
-    result = scp_upload(host, partition_path, remote_input)
-    if result.returncode != 0:
-        print(f"    ERROR uploading: {result.stderr}")
-        sys.exit(1)
-
-    remote_output = f"~/data/reducer_output_{idx}.txt"
+                    state[0] += marker if MAPPER_COMBINE else 1
+
+    print(f"  Total mapper tuples processed for partitioning: {total_partition_lines}")
+
+    partition_paths = []
+    actual_records = []
+    for idx, counts in enumerate(partition_counts):
+        path = os.path.join(partition_dir, f"reducer_{idx}{INTERMEDIATE_EXT}")
+        partition_paths.append(path)
+        pair_total = 0
+        with RecordWriter(path, INTERMEDIATE_FORMAT, COMPRESSION, COMPRESSION_LEVEL) as writer:
+            for (user_a, user_b), (count, blocked) in counts.items():
+                if blocked or count == 0:
+                    continue
+                writer.write(user_a, user_b, count)
+                pair_total += 1
+        transfer_stats["reducer_inputs"]["raw_bytes"] += writer.raw_bytes
+        transfer_stats["reducer_inputs"]["compress_seconds"] += writer.write_seconds
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"  Reducer {idx + 1} partition: {pair_total} pairs, {size_mb:.2f} MB")
+        actual_records.append(pair_total)
+        counts.clear()
+    print_partition_load(partition_table, actual_records,
+                         [os.path.getsize(path) for path in partition_paths])
+    return [[path] for path in partition_paths], actual_records
+
+
+def reducer_task(idx, host):
+    label = f"reducer-{idx+1}"
+    remote_inputs = []
+    if SHUFFLE_MODE == "direct":
+        # The mappers already pushed these files onto this host
+        remote_inputs = partition_inputs[idx]
+    else:
+        for k, local_input in enumerate(partition_inputs[idx]):
+            check_cancelled(label)
+            remote_input = f"~/data/reducer_input_{idx}_{k}{INTERMEDIATE_EXT}"
+            log(f"Uploading partition file ({local_input})...", label)
+            result = timed_transfer("reducer_inputs", scp_upload, host, local_input, remote_input, local_input)
+            if result.returncode != 0:
+                raise TaskFailed(f"{label}: uploading {local_input}: {result.stderr}")
+            remote_inputs.append(remote_input)
+
+    output_name = f"reducer_output_{idx}.txt{COMPRESSION_EXT[COMPRESSION]}"
+    remote_output = f"~/data/{output_name}"
     env_prefix = f"PARTITION_INDEX={idx} PARTITION_TOTAL={num_reducers} "
+    reducer_flags = f"--format {INTERMEDIATE_FORMAT} --top-k {TOP_K} --workers {REDUCER_WORKERS} {COMPRESSION_FLAGS}"
+    if REDUCER_STREAMING:
+        reducer_flags += f"--streaming --memory-mb {REDUCER_MEMORY_MB} "
+    if SHUFFLE_MODE in ("mapper", "direct"):
+        reducer_flags += f"--aggregate {'counts' if MAPPER_COMBINE else 'mutual'} "
     reducer_cmd = (
-        f"{env_prefix}python3 ~/mapreduce/reducer.py {remote_input} {remote_output}"
+        f"{env_prefix}python3 ~/mapreduce/reducer.py {reducer_flags}"
+        f"{' '.join(remote_inputs)} {remote_output}"
     )
-    print("    Running reducer...")
-    result = ssh(host, reducer_cmd, stream_output=True, label=f"reducer-{idx+1}")
+    check_cancelled(label)
+    log("Running reducer...", label)
+    result = ssh(host, reducer_cmd, stream_output=True, label=label)
     if result.returncode != 0:
-        print(f"    ERROR running reducer: {result.stderr}")
-        sys.exit(1)
-
-    print("    OK Reducer completed")
-    reducer_results.append((host, remote_output, f"reducer_output_{idx}.txt"))
+        raise TaskFailed(f"{label}: reducer exited with code {result.returncode}")
+    record_task_metrics(result.stdout)
 
-print(f"\nOK All {num_reducers} reducers completed\n")
-
-print("Step 6: Collecting reducer outputs...")
-shutil.rmtree("data/reducer_outputs", ignore_errors=True)
-os.makedirs("data/reducer_outputs", exist_ok=True)
-
-reducer_local_files = []
-for host, remote_path, filename in reducer_results:
-    local_path = f"data/reducer_outputs/{filename}"
-    print(f"  Downloading from {host}...")
-    result = scp_download(host, remote_path, local_path)
+    check_cancelled(label)
+    local_path = f"data/reducer_outputs/{output_name}"
+    log(f"Downloading {remote_output}...", label)
+    result = download_output("reducer_outputs", host, remote_output, local_path)
     if result.returncode != 0:
-        print(f"    ERROR downloading: {result.stderr}")
-        sys.exit(1)
+        raise TaskFailed(f"{label}: downloading {remote_output}: {result.stderr}")
+    return local_path
+
+
+def stream_pipeline():
+    """Chunks go to `mapper.py - -` over ssh pipes; every framed block the mappers write is forwarded
+    straight into the stdin of its reducer, and each reducer's stdout streams back to disk."""
+    for i, mapper in enumerate(instances["mappers"]):
+        result = scp_upload(mapper["public_ip"], partition_table_file, "~/data/partition_table.json")
+        if result.returncode != 0:
+            sys.exit(f"ERROR: mapper-{i+1}: uploading partition table: {result.stderr}")
+
+    shutil.rmtree("data/reducer_outputs", ignore_errors=True)
+    os.makedirs("data/reducer_outputs", exist_ok=True)
+
+    errors = []
+    threads = []
+    phase_start = time.perf_counter()
+
+    def fail(message):
+        with stats_lock:
+            errors.append(message)
+        cancel_event.set()
+        remote.terminate_all()
+
+    def start_thread(target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        threads.append(thread)
+        return thread
+
+    def log_stderr(process, label, lines):
+        for raw in process.stderr:
+            line = raw.decode("utf-8", "replace").rstrip("\n")
+            lines.append(line)
+            log(line, label)
+
+    def save_output(process, local_path, label):
+        try:
+            with open(local_path, "wb") as f:
+                shutil.copyfileobj(process.stdout, f, 1 << 20)
+        except OSError as exc:
+            fail(f"{label}: writing {local_path}: {exc}")
 
-    reducer_local_files.append(local_path)
+    def feed_chunk(process, i, label):
+        try:
+            write_chunk(process.stdin, DATA_FILE, chunks[i])
+            process.stdin.close()
+        except OSError as exc:
+            if not cancel_event.is_set():
+                fail(f"{label}: streaming {chunk_names[i]}: {exc}")
 
-if not reducer_local_files:
-    sys.exit("ERROR: No reducer outputs were downloaded.")
+    forwarded_records = [0] * num_reducers
+    forwarded_bytes = [0] * num_reducers
+    reducer_locks = [threading.Lock() for _ in range(num_reducers)]
 
-print(f"\nOK Reducer outputs downloaded: {len(reducer_local_files)} file(s)\n")
+    def forward_frames(process, label):
+        try:
+            for partition, payload in read_frames(process.stdout):
+                with reducer_locks[partition]:
+                    reducers[partition].stdin.write(payload)
+                    forwarded_bytes[partition] += len(payload)
+                    if INTERMEDIATE_FORMAT == BINARY:
+                        forwarded_records[partition] += len(payload) // RECORD_SIZE
+                    else:
+                        forwarded_records[partition] += payload.count(b"\n")
+        except (OSError, EOFError) as exc:
+            if not cancel_event.is_set():
+                fail(f"{label}: forwarding mapper output: {exc}")
+
+    print(f"Step 2: Starting {num_reducers} streaming reducers...")
+    reduce_meter = Meter("reduce", children=False)
+    reducer_flags = f"--format {INTERMEDIATE_FORMAT} --top-k {TOP_K} --workers {REDUCER_WORKERS} "
+    if REDUCER_STREAMING:
+        reducer_flags += f"--streaming --memory-mb {REDUCER_MEMORY_MB} "
+    reducer_flags += f"--aggregate {'counts' if MAPPER_COMBINE else 'mutual'} "
+    reducers = []
+    reducer_started = []
+    reducer_threads = []
+    reducer_files = []
+    reducer_stderr = []
+    for idx, reducer in enumerate(instances["reducers"]):
+        label = f"reducer-{idx+1}"
+        env_prefix = f"PARTITION_INDEX={idx} PARTITION_TOTAL={num_reducers} "
+        process = remote.open_pipe(reducer["public_ip"],
+                                   f"{env_prefix}python3 ~/mapreduce/reducer.py {reducer_flags}- -",
+                                   compress=STREAM_COMPRESS)
+        local_path = f"data/reducer_outputs/reducer_output_{idx}.txt"
+        reducers.append(process)
+        reducer_started.append(time.perf_counter())
+        reducer_files.append(local_path)
+        reducer_threads.append(start_thread(save_output, process, local_path, label))
+        reducer_stderr.append([])
+        reducer_threads.append(start_thread(log_stderr, process, label, reducer_stderr[-1]))
+    print(f"OK {num_reducers} reducers waiting on stdin\n")
+
+    print(f"Step 3: Streaming chunks through {num_mappers} mappers into the reducers...")
+    map_meter = Meter("map", children=False)
+    mapper_flags = f"--format {INTERMEDIATE_FORMAT} --workers 1 "
+    if MAPPER_COMBINE:
+        mapper_flags += f"--combine --memory-mb {MAPPER_MEMORY_MB} "
+    mapper_flags += "--partition-table ~/data/partition_table.json "
+    mappers = []
+    mapper_threads = []
+    mapper_stderr = []
+    for i, mapper in enumerate(instances["mappers"]):
+        label = f"mapper-{i+1}"
+        log(f"Streaming {chunk_names[i]} to {mapper['public_ip']}...", label)
+        process = remote.open_pipe(mapper["public_ip"], f"python3 ~/mapreduce/mapper.py {mapper_flags}- -",
+                                   compress=STREAM_COMPRESS)
+        mappers.append((time.perf_counter(), process))
+        mapper_stderr.append([])
+        mapper_threads.append(start_thread(feed_chunk, process, i, label))
+        mapper_threads.append(start_thread(forward_frames, process, label))
+        mapper_threads.append(start_thread(log_stderr, process, label, mapper_stderr[-1]))
+
+    for thread in mapper_threads:
+        thread.join()
+    for i, (started, process) in enumerate(mappers):
+        label = f"mapper-{i+1}"
+        returncode = remote.close_pipe(process)
+        if returncode != 0 and not errors:
+            fail(f"{label}: mapper exited with code {returncode}")
+        task_timings.append({
+            "task": label, "phase": "mappers", "host": instances["mappers"][i]["public_ip"], "attempt": "stream",
+            "speculative": False, "outcome": "won" if returncode == 0 else "failed",
+            "start": started - pipeline_start, "end": time.perf_counter() - pipeline_start,
+            "metrics": parse_task_metrics("\n".join(mapper_stderr[i])),
+        })
+        mapper_stats = parse_compression_stats("\n".join(mapper_stderr[i]))
+        if mapper_stats:
+            transfer_stats["mapper_outputs"]["compress_seconds"] += mapper_stats["write_seconds"]
+    if errors:
+        print(f"\nERROR: {errors[0]}")
+        print("Cancelled the remaining tasks")
+        sys.exit(1)
+    print(f"\nOK All {num_mappers} mappers completed\n")
+    map_stage = finish_stage(map_meter, phase="mappers",
+                             bytes_transferred=split_stage["bytes_written"] + sum(forwarded_bytes))
+
+    print("Step 4: Reducer partitions as streamed...")
+    for idx in range(num_reducers):
+        print(f"  Reducer {idx + 1} partition: {forwarded_records[idx]} records, "
+              f"{forwarded_bytes[idx] / (1024 * 1024):.2f} MB")
+    print_partition_load(partition_table, forwarded_records, forwarded_bytes)
+    # The frames were routed while they streamed (inside the map stage); this only totals them
+    finish_stage(Meter("partition", children=False), records_in=map_stage["records_out"],
+                 records_out=sum(forwarded_records), bytes_read=sum(forwarded_bytes),
+                 bytes_written=sum(forwarded_bytes))
+    print("OK Reducer partitions streamed\n")
+
+    print("Step 5: Closing reducer inputs and waiting for the reducers...")
+    for process in reducers:
+        process.stdin.close()
+    for thread in reducer_threads:
+        thread.join()
+    for idx, process in enumerate(reducers):
+        returncode = remote.close_pipe(process)
+        task_timings.append({
+            "task": f"reducer-{idx+1}", "phase": "reducers", "host": instances["reducers"][idx]["public_ip"],
+            "attempt": "stream", "speculative": False, "outcome": "won" if returncode == 0 else "failed",
+            "start": reducer_started[idx] - pipeline_start, "end": time.perf_counter() - pipeline_start,
+            "metrics": parse_task_metrics("\n".join(reducer_stderr[idx])),
+        })
+        if returncode != 0 and not errors:
+            errors.append(f"reducer-{idx+1}: reducer exited with code {returncode}")
+    if errors:
+        print(f"\nERROR: {errors[0]}")
+        sys.exit(1)
+    print(f"OK All {num_reducers} reducers completed\n")
+    finish_stage(reduce_meter, phase="reducers",
+                 bytes_transferred=sum(os.path.getsize(path) for path in reducer_files))
+
+    # Nothing is staged: the streamed bytes are the raw records, moved once per hop
+    stream_seconds = time.perf_counter() - phase_start
+    for stage, moved in (("mapper_outputs", sum(forwarded_bytes)),
+                         ("reducer_outputs", sum(os.path.getsize(path) for path in reducer_files))):
+        transfer_stats[stage]["raw_bytes"] += moved
+        transfer_stats[stage]["compressed_bytes"] += moved
+        transfer_stats[stage]["transfer_seconds"] += stream_seconds
+    print(f"  Stream phase wall time: {stream_seconds:.2f}s\n")
+
+    print("Step 6: Collecting reducer outputs...")
+    print(f"OK Reducer outputs streamed: {len(reducer_files)} file(s)\n")
+    return reducer_files
+
+
+if TRANSPORT == "stream":
+    reducer_local_files = stream_pipeline()
+else:
+    # Step 2: Upload chunks, run mappers and download their outputs, one pipelined task per host
+    print(f"Step 2: Distributing chunks to mappers and executing ({min(MAX_PARALLEL, num_mappers)} at a time)...")
+    shutil.rmtree("data/mapper_outputs", ignore_errors=True)
+    os.makedirs("data/mapper_outputs", exist_ok=True)
+
+    if SHUFFLE_MODE == "direct":
+        shuffle_receivers = start_shuffle_receivers()
+
+    map_meter = Meter("map", children=False)
+    mapper_hosts = [mapper["public_ip"] for mapper in instances["mappers"]]
+    mapper_results = run_tasks("mappers", [
+        (f"mapper-{i+1}", rotated(mapper_hosts, i), lambda host, i=i: mapper_task(i, host))
+        for i in range(num_mappers)
+    ])
+    print(f"\nOK All {num_mappers} mappers completed\n")
+
+    print("Step 3: Collecting mapper outputs...")
+    if SHUFFLE_MODE == "direct":
+        received_bytes = finish_shuffle_receivers(shuffle_receivers)
+        print(f"OK Reducers received {num_mappers * num_reducers} partition files directly from the mappers\n")
+    else:
+        local_mapper_outputs = [path for paths in mapper_results for path in paths]
+        print(f"OK Downloaded {len(local_mapper_outputs)} mapper outputs\n")
+    # Moved by the map stage: the chunks going up, then the mapper outputs
+    map_stage = finish_stage(map_meter, phase="mappers", bytes_transferred=split_stage["bytes_written"]
+                             + transfer_stats["mapper_outputs"]["compressed_bytes"])
+
+    print("Step 4: Preparing reducer partitions...")
+    partition_meter = Meter("partition", children=False)
+    partition_dir = "data/reducer_partitions"
+    shutil.rmtree(partition_dir, ignore_errors=True)
+    os.makedirs(partition_dir, exist_ok=True)
+
+    # Routing (mapper / direct) only hands files on; the driver shuffle re-reads and rewrites every record
+    partition_read = partition_written = 0
+    if SHUFFLE_MODE == "direct":
+        partition_inputs = direct_partitions(received_bytes)
+        partition_records = [map_stage["records_out"]]
+    elif SHUFFLE_MODE == "mapper":
+        partition_inputs, partition_records = route_mapper_partitions()
+        # The mapper files are forwarded as-is: same payload, nothing re-compressed
+        transfer_stats["reducer_inputs"]["raw_bytes"] = transfer_stats["mapper_outputs"]["raw_bytes"]
+    else:
+        partition_inputs, partition_records = build_driver_partitions()
+        partition_read = sum(os.path.getsize(path) for path in local_mapper_outputs)
+        partition_written = sum(os.path.getsize(path) for paths in partition_inputs for path in paths)
+    finish_stage(partition_meter, records_in=map_stage["records_out"], records_out=sum(partition_records),
+                 bytes_read=partition_read, bytes_written=partition_written)
+
+    print("OK Reducer partitions prepared\n")
+
+    print(f"Step 5: Running reducers ({min(MAX_PARALLEL, num_reducers)} at a time)...")
+    shutil.rmtree("data/reducer_outputs", ignore_errors=True)
+    os.makedirs("data/reducer_outputs", exist_ok=True)
+
+    reduce_meter = Meter("reduce", children=False)
+    reducer_hosts = [reducer["public_ip"] for reducer in instances["reducers"]]
+    reducer_local_files = run_tasks("reducers", [
+        # Directly shuffled partitions only exist on their own reducer host
+        (f"reducer-{idx+1}", [host] if SHUFFLE_MODE == "direct" else rotated(reducer_hosts, idx),
+         lambda host, idx=idx: reducer_task(idx, host))
+        for idx, host in enumerate(reducer_hosts)
+    ])
+    print(f"\nOK All {num_reducers} reducers completed\n")
+
+    print("Step 6: Collecting reducer outputs...")
+    if not reducer_local_files:
+        sys.exit("ERROR: No reducer outputs were downloaded.")
+    finish_stage(reduce_meter, phase="reducers",
+                 bytes_transferred=sum(transfer_stats[stage]["compressed_bytes"]
+                                       for stage in ("reducer_inputs", "reducer_outputs")))
+
+    print(f"OK Reducer outputs downloaded: {len(reducer_local_files)} file(s)\n")
 
 print("Step 7: Combining reducer outputs and generating final recommendations...")
-user_candidate_counts = {}
-
-for local_file in reducer_local_files:
-    print(f"  Merging results from {local_file}...")
-    with open(local_file, "r") as f:
-        for line in f:
-            parts = line.rstrip("\n").split("\t")
-            if len(parts) != 2:
-                continue
-            user_id, recs = parts
-            if user_id not in user_candidate_counts:
-                user_candidate_counts[user_id] = {}
-            rec_items = [r for r in recs.split(",") if r]
-            for item in rec_items:
-                if ":" not in item:
-                    continue
-                candidate, count_str = item.split(":", 1)
-                candidate = candidate.strip()
-                count_str = count_str.strip()
-                if not candidate or not count_str:
-                    continue
-                try:
-                    count_val = int(count_str)
-                except ValueError:
-                    continue
-                current = user_candidate_counts[user_id].get(candidate, 0)
-                user_candidate_counts[user_id][candidate] = current + count_val
-
-final_output = os.path.join(ARTIFACTS_DIR, "friend_recommendations.txt")
-combined_recommendations = {}
-
-with open(final_output, "w") as f:
-    for user_id in sorted(all_users, key=sort_user_key):
-        candidate_counts = user_candidate_counts.get(user_id, {})
-        if candidate_counts:
-            sorted_candidates = sorted(
-                candidate_counts.items(),
-                key=lambda x: (-x[1], sort_user_key(x[0])),
-            )
-            top_candidates = [candidate for candidate, _ in sorted_candidates[:10]]
-            recs_str = ",".join(top_candidates)
-        else:
-            recs_str = ""
-
-        combined_recommendations[user_id] = recs_str
-        f.write(f"{user_id}\t{recs_str}\n")
-
-print(f"  Wrote final recommendations to {final_output}")
-
-print("Step 8: Extracting report users...")
+merge_meter = Meter("merge", children=False)
+# Every reducer output is sorted by user, so one merge pass meets each user's candidates
+# together; only the current user's counts and the report users are kept in memory
+print(f"  Merging {len(reducer_local_files)} reducer output(s)...")
 REPORT_USERS = [
     "924",
     "8941",
@@ -383,13 +1160,45 @@ REPORT_USERS = [
     "9993",
 ]
 
-print(f"  Final output covers {len(all_users)} users")
+final_output = os.path.join(OUTPUT_DIR, "friend_recommendations.txt")
+report_recommendations = {}
+merge_counters = {}
+# Sidecar user -> byte offset index for app/lookup.py, written along with the lines
+index_writer = IndexWriter(index_path(final_output))
+offset = 0
+
+with open(final_output, "w") as f:
+    # UserSet and the merged reducer outputs both come in user_order_key order (zero-padded IDs by value)
+    merged_users = merged_candidate_counts(reducer_local_files, merge_meter)
+    for user_id, candidate_counts in join_users(all_users, merged_users, merge_counters):
+        candidate_counts = candidate_counts or {}
+        # Bounded heap: count desc, then user ID asc
+        top_candidates = heapq.nsmallest(
+            TOP_K, ((-count, sort_user_key(candidate), candidate) for candidate, count in candidate_counts.items())
+        )
+        recs_str = ",".join(candidate for _, _, candidate in top_candidates)
+        if user_id in REPORT_USERS:
+            report_recommendations[user_id] = recs_str
+        line = f"{user_id}\t{recs_str}\n"
+        f.write(line)
+        index_writer.add(user_id, offset)
+        offset += len(line.encode("utf-8"))
+index_writer.finish(final_output)
+
+unknown_users = merge_counters["unknown_users"]
+if unknown_users:
+    print(f"  WARN: {unknown_users} reducer output user(s) are not in the input and were skipped")
+print(f"  Wrote final recommendations to {final_output} (index: {index_path(final_output)})")
+finish_stage(merge_meter, records_out=num_users, bytes_written=offset)
+
+print("Step 8: Extracting report users...")
+print(f"  Final output covers {num_users} users")
 
 print("\n=== Friend Recommendations for Report Users ===\n")
-report_output = os.path.join(ARTIFACTS_DIR, "report_recommendations.txt")
+report_output = os.path.join(OUTPUT_DIR, "report_recommendations.txt")
 with open(report_output, "w") as report_file:
     for user_id in REPORT_USERS:
-        recs = combined_recommendations.get(user_id, "")
+        recs = report_recommendations.get(user_id, "")
         if recs:
             print(f"User {user_id}: {recs}")
             report_file.write(f"User {user_id}: {recs}\n")
@@ -399,6 +1208,113 @@ with open(report_output, "w") as report_file:
 
 print(f"\nOK Saved report recommendations to {report_output}")
 
+pipeline_seconds = time.perf_counter() - pipeline_start
+print(f"\nMapReduce pipeline: {pipeline_seconds:.2f}s "
+      f"({num_users / pipeline_seconds:.0f} users/s)")
+
+print(f"\nIntermediate transfers (compression: {COMPRESSION}"
+      f"{'' if COMPRESSION_LEVEL is None else f', level {COMPRESSION_LEVEL}'}):")
+print(f"  {'Stage':<16} {'Files':>6} {'Raw MB':>10} {'Sent MB':>10} {'Ratio':>7} {'Compress s':>11} {'Transfer s':>11}")
+for stage in ("mapper_outputs", "reducer_inputs", "reducer_outputs"):
+    stats = transfer_stats[stage]
+    ratio = stats["raw_bytes"] / stats["compressed_bytes"] if stats["compressed_bytes"] else 0.0
+    stats["ratio"] = ratio
+    print(f"  {stage:<16} {stats['files']:>6} {stats['raw_bytes'] / (1024 * 1024):>10.2f} "
+          f"{stats['compressed_bytes'] / (1024 * 1024):>10.2f} {ratio:>7.2f} "
+          f"{stats['compress_seconds']:>11.2f} {stats['transfer_seconds']:>11.2f}")
+transfer_output = os.path.join(OUTPUT_DIR, "friend_rec_transfer.json")
+with open(transfer_output, "w") as f:
+    json.dump({
+        "compression": COMPRESSION,
+        "compression_level": COMPRESSION_LEVEL,
+        "intermediate_format": INTERMEDIATE_FORMAT,
+        "pipeline_seconds": pipeline_seconds,
+        "stages": dict(transfer_stats),
+        "remote_calls": remote.report(),
+    }, f, indent=2)
+print(f"  Saved transfer statistics to {transfer_output}")
+
+if task_summaries:
+    print("\nTask attempts:")
+    print(f"  {'Phase':<10} {'Tasks':>6} {'Attempts':>9} {'Retries':>8} {'Speculative':>12} {'Spec. wins':>11}")
+    for summary in task_summaries:
+        print(f"  {summary['phase']:<10} {summary['tasks']:>6} {summary['attempts']:>9} {summary['retries']:>8} "
+              f"{summary['speculative']:>12} {summary['speculative_wins']:>11}")
+tasks_output = os.path.join(OUTPUT_DIR, "friend_rec_tasks.json")
+with open(tasks_output, "w") as f:
+    json.dump({
+        "task_retries": TASK_RETRIES,
+        "speculation": SPECULATION,
+        "speculation_factor": SPECULATION_FACTOR,
+        "speculation_quorum": SPECULATION_QUORUM,
+        "phases": task_summaries,
+        "attempts": task_timings,
+    }, f, indent=2)
+print(f"  Saved task attempts to {tasks_output}")
+
+# Moving intermediate files overlaps the map and reduce stages, so it has totals but no span of its own;
+# its wall time is summed over the transfers, which run in parallel
+moved = [transfer_stats[stage] for stage in ("mapper_outputs", "reducer_inputs", "reducer_outputs")]
+stage_metrics.append({
+    "stage": "transfer", "wall_seconds": sum(stats["transfer_seconds"] for stats in moved), "cpu_seconds": None,
+    "peak_rss_mb": None, "records_in": 0, "records_out": 0,
+    "bytes_read": sum(stats["raw_bytes"] for stats in moved),
+    "bytes_written": sum(stats["compressed_bytes"] for stats in moved),
+    "bytes_transferred": sum(stats["compressed_bytes"] for stats in moved),
+    "files": sum(stats["files"] for stats in moved), "start": None, "end": None,
+})
+stage_metrics.sort(key=lambda metrics: STAGES.index(metrics["stage"]))
+print("\nStage metrics:")
+print(f"  {'Stage':<10} {'Wall s':>8} {'CPU s':>8} {'Peak MB':>8} {'Records in':>11} {'Records out':>12} "
+      f"{'MB read':>9} {'MB written':>11} {'MB moved':>9}")
+for metrics in stage_metrics:
+    cpu = "-" if metrics["cpu_seconds"] is None else f"{metrics['cpu_seconds']:.2f}"
+    rss = "-" if metrics["peak_rss_mb"] is None else f"{metrics['peak_rss_mb']:.0f}"
+    print(f"  {metrics['stage']:<10} {metrics['wall_seconds']:>8.2f} {cpu:>8} {rss:>8} "
+          f"{metrics['records_in']:>11} {metrics['records_out']:>12} "
+          f"{metrics['bytes_read'] / (1024 * 1024):>9.2f} {metrics['bytes_written'] / (1024 * 1024):>11.2f} "
+          f"{metrics['bytes_transferred'] / (1024 * 1024):>9.2f}")
+metrics_output = os.path.join(OUTPUT_DIR, "friend_rec_metrics.json")
+with open(metrics_output, "w") as f:
+    json.dump({
+        "pipeline_seconds": pipeline_seconds,
+        "input": DATA_FILE,
+        "users": num_users,
+        "mappers": num_mappers,
+        "reducers": num_reducers,
+        "transport": TRANSPORT,
+        "shuffle": SHUFFLE_MODE,
+        "compression": COMPRESSION,
+        "intermediate_format": INTERMEDIATE_FORMAT,
+        "stages": stage_metrics,
+        "tasks": task_timings,
+    }, f, indent=2)
+print(f"  Saved stage metrics to {metrics_output}")
+
+if COMPARE_ENGINE:
+    print("\nComparing with the sparse-matrix engine...")
+    engine_output = os.path.join("data", "engine_recommendations.txt")
+    engine_stats_path = os.path.join(OUTPUT_DIR, "engine_comparison.json")
+    if os.path.exists(engine_stats_path):
+        os.remove(engine_stats_path)
+    result = subprocess.run(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "matrix_engine.py"),
+         "--compare", final_output, "--stats", engine_stats_path, DATA_FILE, engine_output],
+    )
+    if not os.path.exists(engine_stats_path):
+        sys.exit(f"ERROR: matrix engine failed (exit code {result.returncode})")
+    with open(engine_stats_path) as f:
+        engine_stats = json.load(f)
+    engine_stats["mapreduce_seconds"] = pipeline_seconds
+    engine_stats["mapreduce_users_per_second"] = num_users / pipeline_seconds
+    with open(engine_stats_path, "w") as f:
+        json.dump(engine_stats, f, indent=2)
+    print(f"  {'Pipeline':<12} {'Time (s)':>10} {'Users/s':>12}")
+    print(f"  {'mapreduce':<12} {pipeline_seconds:>10.2f} {engine_stats['mapreduce_users_per_second']:>12.0f}")
+    print(f"  {'matrix':<12} {engine_stats['elapsed_seconds']:>10.2f} {engine_stats['users_per_second']:>12.0f}")
+    print(f"  Outputs identical: {engine_stats.get('identical')}")
+    print(f"  Saved comparison to {engine_stats_path}")
+
 print("\n" + "="*50)
 print("Friend Recommendation MapReduce Complete! OK")
 print("="*50)
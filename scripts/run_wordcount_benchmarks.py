@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
-import json, os, sys, subprocess, time
+import json, os, sys, time
 import urllib.request
 import shutil
 
+from remote import Remote
+
 KEY_PATH = os.getenv("AWS_KEY_PATH")
 if not KEY_PATH:
     sys.exit("Missing AWS_KEY_PATH. Run: set -a; source .env; set +a")
@@ -11,7 +13,6 @@ with open("artifacts/wordcount_instance.json") as f:
     instance = json.load(f)
 
 HOST = instance["public_ip"]
-SSH_USER = "ubuntu"
 
 # Dataset URLs from the PDF
 DATASETS = [
@@ -26,31 +27,17 @@ DATASETS = [
     "https://tinyurl.com/weh83uyn",
 ]
 
-SSH_BASE = [
-    "ssh",
-    "-o", "StrictHostKeyChecking=no",
-    "-o", "BatchMode=yes",
-    "-o", "ServerAliveInterval=15",
-    "-o", "ServerAliveCountMax=3",
-    "-o", "ConnectTimeout=20",
-]
+remote = Remote(KEY_PATH)
 
 def ssh(cmd):
     """Execute command on remote host"""
-    remote = f"bash -lc '{cmd}'"
-    result = subprocess.run(
-        SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{HOST}", remote],
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-    )
+    result = remote.run(HOST, cmd)
+    # Callers parse stdout and stderr together
+    result.stdout = (result.stdout or "") + (result.stderr or "")
     return result
 
-def scp_upload(local_path, remote_path):
-    result = subprocess.run(
-        ["scp", "-o", "StrictHostKeyChecking=no", "-i", KEY_PATH,
-         local_path, f"{SSH_USER}@{HOST}:{remote_path}"],
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-    )
-    return result
+def scp_upload(local_paths, remote_path):
+    return remote.upload(HOST, local_paths, remote_path)
 
 print("=== WordCount Benchmarking Suite ===\n")
 
@@ -85,16 +72,15 @@ print(f"\nOK {len(dataset_files)} datasets ready\n")
 
 # Step 2: Upload wordcount scripts to remote
 print("Step 2: Uploading WordCount scripts to instance...")
-ssh("mkdir -p ~/wordcount")
-scp_upload("wordcount/hadoop_wordcount.sh", "~/wordcount/")
-scp_upload("wordcount/spark_wordcount.py", "~/wordcount/")
-scp_upload("wordcount/linux_wordcount.sh", "~/wordcount/")
+remote.connect(HOST)
+ssh("mkdir -p ~/wordcount ~/datasets")
+scp_upload(["wordcount/hadoop_wordcount.sh", "wordcount/spark_wordcount.py", "wordcount/linux_wordcount.sh"],
+           "~/wordcount/")
 ssh("chmod +x ~/wordcount/*.sh")
 print("OK Scripts uploaded\n")
 
 # Step 3: Upload datasets to remote
 print("Step 3: Uploading datasets to instance...")
-ssh("mkdir -p ~/datasets")
 for dataset_name, local_path in dataset_files:
     print(f"  Uploading {dataset_name}...")
     scp_upload(local_path, f"~/datasets/{dataset_name}")
@@ -167,6 +153,9 @@ for dataset_name, _ in dataset_files:
             elif method_name == "spark":
                 ssh(f"rm -rf /tmp/spark_output_{dataset_name} || true")
 
+# Per-call ssh/scp latency, next to the benchmark timings
+remote_calls = remote.report()
+
 # Save results
 print("\n=== Saving Results ===")
 output_file = "artifacts/benchmark_results.json"
@@ -175,6 +164,11 @@ with open(output_file, "w") as f:
 
 print(f"OK Results saved to {output_file}")
 
+latency_file = "artifacts/wordcount_remote_latency.json"
+with open(latency_file, "w") as f:
+    json.dump(remote_calls, f, indent=2)
+print(f"OK Remote call latency saved to {latency_file}")
+
 print("\n=== Summary ===")
 successful_runs = sum(1 for r in results if r["success"])
 print(f"Total runs: {len(results)}")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from generate_graph import DEFAULT_AVG_DEGREE, DEFAULT_EXPONENT, cached_graph
+
+# Strong / weak scaling study of the friend recommendation pipeline over a mapper x reducer grid,
+# on local host pools (scripts/provision_local.py).
+#   python scripts/scaling_study.py [strong|weak|both] [input_file]
+#
+# Every grid point provisions and deploys its own pool under data/scaling/hosts, then runs
+# scripts/run_friend_recommendation.py with its outputs under data/scaling/. Strong scaling keeps
+# the input fixed (default: data/soc-LiveJournal1Adj.txt); weak scaling generates a graph of
+# BENCHMARK_USERS_PER_HOST users per host (scripts/generate_graph.py). Hosts are pinned to
+# BENCHMARK_CPUS_PER_HOST CPUs each so adding a host adds capacity. The instances file in
+# artifacts/ is restored at the end. Plots: python plots/generate_plots.py
+
+
+def parse_counts(env_key, default):
+    value = os.getenv(env_key, default)
+    try:
+        counts = sorted({int(count) for count in value.split(",") if count.strip()})
+        if not counts or counts[0] <= 0:
+            raise ValueError
+        return counts
+    except ValueError:
+        sys.exit(f"Invalid value for {env_key}: {value}. Must be comma-separated positive integers.")
+
+
+MODES = {"strong": ["strong"], "weak": ["weak"], "both": ["strong", "weak"]}
+if len(sys.argv) > 1 and sys.argv[1] not in MODES:
+    sys.exit(f"Usage: scaling_study.py [{'|'.join(MODES)}] [input_file]")
+STUDY_MODES = MODES[sys.argv[1] if len(sys.argv) > 1 else "both"]
+INPUT_FILE = sys.argv[2] if len(sys.argv) > 2 else "data/soc-LiveJournal1Adj.txt"
+MAPPER_COUNTS = parse_counts("BENCHMARK_MAPPERS", "1,2,4")
+REDUCER_COUNTS = parse_counts("BENCHMARK_REDUCERS", "1,2,4")
+ITERATIONS = int(os.getenv("BENCHMARK_ITERATIONS", "1"))
+CPUS_PER_HOST = int(os.getenv("BENCHMARK_CPUS_PER_HOST", "1"))
+USERS_PER_HOST = int(os.getenv("BENCHMARK_USERS_PER_HOST", "10000"))
+AVG_DEGREE = float(os.getenv("BENCHMARK_AVG_DEGREE", DEFAULT_AVG_DEGREE))
+EXPONENT = float(os.getenv("BENCHMARK_EXPONENT", DEFAULT_EXPONENT))
+MAX_DEGREE = int(os.getenv("BENCHMARK_MAX_DEGREE", "0")) or None
+SEED = int(os.getenv("BENCHMARK_SEED", "0"))
+# A phase has stopped scaling once its parallel efficiency falls below this
+EFFICIENCY_THRESHOLD = float(os.getenv("BENCHMARK_EFFICIENCY_THRESHOLD", "0.5"))
+# Diminishing returns: the smallest grid point within this fraction of the fastest time
+KNEE_TOLERANCE = float(os.getenv("BENCHMARK_KNEE_TOLERANCE", "0.1"))
+
+STUDY_DIR = "data/scaling"
+INSTANCES_FILE = "artifacts/mapreduce_instances.json"
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("split", "map", "partition", "reduce", "merge")
+
+if "strong" in STUDY_MODES and not os.path.exists(INPUT_FILE):
+    sys.exit(f"ERROR: Input file not found: {INPUT_FILE}")
+
+
+def run_script(name, env, log_path):
+    with open(log_path, "a") as log_file:
+        return subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, name)], env=env,
+                              stdout=log_file, stderr=subprocess.STDOUT).returncode
+
+
+def stage_parallelism(stage, mappers, reducers):
+    """Hosts a stage can use: map runs on the mappers, reduce on the reducers, the rest on the driver."""
+    return {"map": mappers, "reduce": reducers}.get(stage, 1)
+
+
+def run_point(mode, mappers, reducers, input_file, env, log_path):
+    """Mean pipeline and stage wall times of one grid point, or None if a run failed."""
+    output_dir = os.path.join(STUDY_DIR, f"{mode}_m{mappers}_r{reducers}")
+    os.makedirs(output_dir, exist_ok=True)
+    metrics_path = os.path.join(output_dir, "friend_rec_metrics.json")
+    seconds = []
+    stage_seconds = {stage: [] for stage in STAGES}
+    for iteration in range(1, ITERATIONS + 1):
+        if os.path.exists(metrics_path):
+            os.remove(metrics_path)
+        returncode = run_script("run_friend_recommendation.py",
+                                dict(env, MAPREDUCE_INPUT=input_file, MAPREDUCE_OUTPUT_DIR=output_dir), log_path)
+        if returncode != 0 or not os.path.exists(metrics_path):
+            print(f"  ✗ {mode} m={mappers} r={reducers} iteration={iteration}: "
+                  f"driver exited with code {returncode} (log: {log_path})")
+            return None
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+        seconds.append(metrics["pipeline_seconds"])
+        for stage in metrics["stages"]:
+            if stage["stage"] in stage_seconds:
+                stage_seconds[stage["stage"]].append(stage["wall_seconds"])
+        print(f"  ✓ {mode} m={mappers} r={reducers} iteration={iteration}: {seconds[-1]:.2f}s")
+    return {
+        "mappers": mappers,
+        "reducers": reducers,
+        "hosts": mappers + reducers,
+        "input_file": input_file,
+        "seconds": statistics.mean(seconds),
+        "stage_seconds": {stage: statistics.mean(values) for stage, values in stage_seconds.items() if values},
+    }
+
+
+def analyse(mode, points):
+    """Speedup and efficiency of every grid point against the smallest one, plus where scaling stops.
+
+    Strong: speedup = T(base) / T, efficiency = speedup / (hosts / base hosts).
+    Weak:   efficiency = T(base) / T (the work per host is fixed), scaled speedup = efficiency * hosts / base hosts.
+    Stages are measured against the hosts they run on: mappers for map, reducers for reduce, one driver otherwise.
+    """
+    points = sorted(points, key=lambda point: (point["hosts"], point["mappers"]))
+    base = points[0]
+    for point in points:
+        ratio = base["seconds"] / point["seconds"]
+        growth = point["hosts"] / base["hosts"]
+        point["speedup"] = ratio if mode == "strong" else ratio * growth
+        point["efficiency"] = ratio / growth if mode == "strong" else ratio
+        point["stage_efficiency"] = {}
+        for stage, seconds in point["stage_seconds"].items():
+            base_seconds = base["stage_seconds"].get(stage)
+            if not base_seconds or not seconds:
+                continue
+            stage_growth = (stage_parallelism(stage, point["mappers"], point["reducers"])
+                            / stage_parallelism(stage, base["mappers"], base["reducers"]))
+            stage_ratio = base_seconds / seconds
+            point["stage_efficiency"][stage] = stage_ratio / stage_growth if mode == "strong" else stage_ratio
+
+    # The phase that stops scaling first falls below the threshold at the fewest hosts
+    limits = {}
+    for stage in ("map", "reduce"):
+        for point in points:
+            if point["stage_efficiency"].get(stage, 1.0) < EFFICIENCY_THRESHOLD:
+                limits[stage] = {"mappers": point["mappers"], "reducers": point["reducers"], "hosts": point["hosts"],
+                                 "efficiency": point["stage_efficiency"][stage]}
+                break
+    largest = points[-1]
+    serial = sum(largest["stage_seconds"].get(stage, 0.0) for stage in STAGES if stage not in ("map", "reduce"))
+    summary = {
+        "base": {"mappers": base["mappers"], "reducers": base["reducers"]},
+        "points": points,
+        "phase_limits": limits,
+        "first_to_stop": min(limits, key=lambda stage: limits[stage]["hosts"]) if limits else None,
+        # Amdahl: the driver-only stages do not shrink with more hosts
+        "serial_share": serial / largest["seconds"] if largest["seconds"] else 0.0,
+    }
+    if mode == "strong":
+        fastest = min(point["seconds"] for point in points)
+        knee = next(point for point in points if point["seconds"] <= fastest * (1 + KNEE_TOLERANCE))
+        summary["knee"] = {"mappers": knee["mappers"], "reducers": knee["reducers"], "hosts": knee["hosts"],
+                           "seconds": knee["seconds"]}
+    return summary
+
+
+grid = [(mappers, reducers) for mappers in MAPPER_COUNTS for reducers in REDUCER_COUNTS]
+print("=== Friend Recommendation Scaling Study ===\n")
+print(f"Modes:     {', '.join(STUDY_MODES)}")
+print(f"Mappers:   {MAPPER_COUNTS}")
+print(f"Reducers:  {REDUCER_COUNTS}")
+print(f"CPUs/host: {CPUS_PER_HOST or 'unpinned'} (machine: {os.cpu_count()})")
+if "strong" in STUDY_MODES:
+    print(f"Strong:    {INPUT_FILE} ({os.path.getsize(INPUT_FILE) / (1024 * 1024):.2f} MB)")
+if "weak" in STUDY_MODES:
+    print(f"Weak:      {USERS_PER_HOST} users per host (mean degree {AVG_DEGREE:g}, exponent {EXPONENT:g})")
+print(f"Iterations: {ITERATIONS}\n")
+
+os.makedirs(STUDY_DIR, exist_ok=True)
+original_instances = None
+if os.path.exists(INSTANCES_FILE):
+    with open(INSTANCES_FILE, "rb") as f:
+        original_instances = f.read()
+
+results = {mode: [] for mode in STUDY_MODES}
+try:
+    for mappers, reducers in grid:
+        print(f"Grid point: {mappers} mapper(s) x {reducers} reducer(s)")
+        log_path = os.path.join(STUDY_DIR, f"m{mappers}_r{reducers}.log")
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        env = dict(os.environ, MAPREDUCE_NUM_MAPPERS=str(mappers), MAPREDUCE_NUM_REDUCERS=str(reducers),
+                   MAPREDUCE_LOCAL_ROOT=os.path.join(STUDY_DIR, "hosts"), MAPREDUCE_LOCAL_OVERWRITE="1",
+                   MAPREDUCE_LOCAL_CPUS_PER_HOST=str(CPUS_PER_HOST) if CPUS_PER_HOST else "")
+        env.pop("AWS_KEY_PATH", None)
+        if run_script("provision_local.py", env, log_path) != 0 or run_script("deploy_mapreduce.py", env, log_path) != 0:
+            print(f"  ✗ provisioning / deploying the local pool failed (log: {log_path})")
+            continue
+        for mode in STUDY_MODES:
+            input_file = INPUT_FILE
+            if mode == "weak":
+                input_file, _ = cached_graph(STUDY_DIR, USERS_PER_HOST * (mappers + reducers), AVG_DEGREE, EXPONENT,
+                                             SEED, MAX_DEGREE)
+            point = run_point(mode, mappers, reducers, input_file, env, log_path)
+            if point is not None:
+                results[mode].append(point)
+        print()
+finally:
+    if original_instances is not None:
+        with open(INSTANCES_FILE, "wb") as f:
+            f.write(original_instances)
+
+study = {
+    "mappers": MAPPER_COUNTS, "reducers": REDUCER_COUNTS, "cpus_per_host": CPUS_PER_HOST,
+    "cpu_count": os.cpu_count(), "iterations": ITERATIONS, "efficiency_threshold": EFFICIENCY_THRESHOLD,
+}
+for mode in STUDY_MODES:
+    if not results[mode]:
+        print(f"WARN: no successful {mode} scaling runs")
+        continue
+    summary = analyse(mode, results[mode])
+    study[mode] = summary
+    print(f"{mode.capitalize()} scaling (base: {summary['base']['mappers']} mapper(s) x "
+          f"{summary['base']['reducers']} reducer(s)):")
+    print(f"  {'Mappers':<8} {'Reducers':<9} {'Time (s)':<10} {'Speedup':<9} {'Efficiency':<11} "
+          + " ".join(f"{stage + ' s':<12}" for stage in STAGES))
+    for point in summary["points"]:
+        print(f"  {point['mappers']:<8} {point['reducers']:<9} {point['seconds']:<10.2f} {point['speedup']:<9.2f} "
+              f"{point['efficiency']:<11.2f} "
+              + " ".join(f"{point['stage_seconds'].get(stage, 0.0):<12.2f}" for stage in STAGES))
+    for stage, limit in summary["phase_limits"].items():
+        print(f"  {stage} efficiency drops below {EFFICIENCY_THRESHOLD:.2f} at {limit['mappers']} mapper(s) x "
+              f"{limit['reducers']} reducer(s) ({limit['efficiency']:.2f})")
+    if summary["first_to_stop"]:
+        print(f"  First phase to stop scaling: {summary['first_to_stop']}")
+    print(f"  Driver-only stages at the largest grid point: {summary['serial_share']:.1%} of the time")
+    if "knee" in summary:
+        knee = summary["knee"]
+        print(f"  Diminishing returns from {knee['mappers']} mapper(s) x {knee['reducers']} reducer(s): "
+              f"{knee['seconds']:.2f}s, within {KNEE_TOLERANCE:.0%} of the fastest")
+    print()
+
+os.makedirs("artifacts", exist_ok=True)
+output_path = "artifacts/scaling_study.json"
+with open(output_path, "w") as f:
+    json.dump(study, f, indent=2)
+print(f"OK Results saved to {output_path}")
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
-import json, os, sys, subprocess, time, urllib.request, shlex
+import json, os, sys, time, urllib.request
 
 import boto3
 from botocore.exceptions import ClientError
 
+from remote import SSH_USER, Remote
+
 KEY_PATH = os.getenv("AWS_KEY_PATH")
 if not KEY_PATH:
     sys.exit("Missing AWS_KEY_PATH. Run: set -a; source .env; set +a")
@@ -12,19 +14,10 @@ with open("artifacts/wordcount_instance.json") as f:
     instance = json.load(f)
 
 HOST = instance["public_ip"]
-SSH_USER = "ubuntu"
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 SG_ID = os.getenv("AWS_INSTANCE_SG_ID")
 
-SSH_BASE = [
-    "ssh",
-    "-o", "StrictHostKeyChecking=no",
-    "-o", "BatchMode=yes",
-    "-o", "ServerAliveInterval=15",
-    "-o", "ServerAliveCountMax=3",
-    "-o", "ConnectTimeout=20",
-    "-o", "ConnectionAttempts=10",
-]
+remote = Remote(KEY_PATH)
 
 def ensure_ssh_access():
     if not SG_ID:
@@ -59,31 +52,24 @@ def ensure_ssh_access():
             print(f"WARN: Failed to authorize SSH {cidr}: {err}")
 
 def ssh(cmd, show_output=True):
-    remote = f"bash -lc {shlex.quote(cmd)}"
-    proc = subprocess.Popen(
-        SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{HOST}", remote],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
-    output_lines = []
-    try:
-        if proc.stdout:
-            for line in proc.stdout:
-                output_lines.append(line)
-                if show_output:
-                    print(line, end="")
-    finally:
-        proc.wait()
-    if proc.returncode != 0:
-        print(f"ERROR: Command failed with exit code {proc.returncode}")
-        if show_output:
-            sys.exit(1)
-        else:
-            print("".join(output_lines))
+    result = remote.run(HOST, cmd, stream=True,
+                        on_line=(lambda line: print(line, end="")) if show_output else (lambda line: None))
+    if result.returncode != 0:
+        print(f"ERROR: Command failed with exit code {result.returncode}")
+        if not show_output:
+            print(result.stdout)
         sys.exit(1)
-    return "".join(output_lines)
+    return result.stdout
+
+def ssh_batch(commands):
+    """Several short commands in one remote session; stops at the first failure."""
+    results = remote.run_batch(HOST, commands, on_line=lambda line: print(line, end=""))
+    for result in results:
+        if result.returncode != 0:
+            print(f"ERROR: Command failed with exit code {result.returncode}: {result.args}")
+            sys.exit(1)
+    if len(results) != len(commands):
+        sys.exit("ERROR: Remote session ended early")
 
 ensure_ssh_access()
 
@@ -91,15 +77,13 @@ print(f"Setting up Hadoop and Spark on {HOST}...")
 print("\n=== Step 1: Wait for SSH to be ready ===")
 for i in range(30):
     try:
-        result = subprocess.run(
-            SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{HOST}", "echo ready"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=10
-        )
-        if result.returncode == 0:
+        # Opens the master connection that every later step reuses
+        result = remote.connect(HOST, timeout=10)
+        if result.returncode == 0 and remote.run(HOST, "echo ready", timeout=10).returncode == 0:
             print("SSH is ready!")
             break
         else:
-            msg = result.stderr.strip() if result.stderr else result.stdout.strip()
+            msg = (result.stderr or result.stdout or "").strip()
             if msg:
                 print(f"SSH attempt {i+1} failed: {msg}")
     except Exception as exc:
@@ -302,10 +286,12 @@ print("\n=== Step 13: Format HDFS ===")
 ssh(f"{env_prefix}~/hadoop/bin/hdfs namenode -format -force")
 
 print("\n=== Step 14: Start Hadoop services ===")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs --daemon start namenode")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs --daemon start datanode")
-ssh(f"{env_prefix}~/hadoop/bin/yarn --daemon start resourcemanager")
-ssh(f"{env_prefix}~/hadoop/bin/yarn --daemon start nodemanager")
+ssh_batch([
+    f"{env_prefix}~/hadoop/bin/hdfs --daemon start namenode",
+    f"{env_prefix}~/hadoop/bin/hdfs --daemon start datanode",
+    f"{env_prefix}~/hadoop/bin/yarn --daemon start resourcemanager",
+    f"{env_prefix}~/hadoop/bin/yarn --daemon start nodemanager",
+])
 
 print("\n=== Step 15: Verify Hadoop is running ===")
 time.sleep(5)
@@ -369,15 +355,20 @@ print("\n=== Step 18: Verify Spark installation ===")
 ssh(f"{env_prefix}~/spark/bin/spark-submit --version")
 
 print("\n=== Step 19: Create HDFS input directory ===")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /input")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /output")
+ssh_batch([
+    f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /input",
+    f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /output",
+])
 
 print("\n=== Step 20: Prepare HDFS staging directories ===")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /tmp")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs dfs -chmod -R 1777 /tmp")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /user/{SSH_USER}")
-ssh(f"{env_prefix}~/hadoop/bin/hdfs dfs -chown -R {SSH_USER} /user/{SSH_USER}")
+ssh_batch([
+    f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /tmp",
+    f"{env_prefix}~/hadoop/bin/hdfs dfs -chmod -R 1777 /tmp",
+    f"{env_prefix}~/hadoop/bin/hdfs dfs -mkdir -p /user/{SSH_USER}",
+    f"{env_prefix}~/hadoop/bin/hdfs dfs -chown -R {SSH_USER} /user/{SSH_USER}",
+])
 
 print("\nOK Hadoop and Spark installation complete!")
 print("Hadoop NameNode: http://{}:9870".format(HOST))
 print("YARN:            http://{}:8088".format(HOST))
+remote.report()
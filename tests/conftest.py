@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app/ modules import each other flat, as they run on the hosts (~/mapreduce)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
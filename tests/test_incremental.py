@@ -0,0 +1,68 @@
+from collections import Counter
+
+import pytest
+
+from incremental import update
+
+# 6 has an empty friend list ("6<TAB>"), 7 only appears in the delta
+GRAPH = "0\t1,2,3\n1\t0,2,4\n2\t0,1,5\n3\t0\n4\t1,5\n5\t2,4\n6\t\n"
+
+
+def read_graph(path):
+    friends = {}
+    with open(path) as f:
+        for line in f:
+            user, _, listed = line.rstrip("\n").partition("\t")
+            assert user not in friends, f"user {user} has two lines"
+            friends[user] = [friend for friend in listed.split(",") if friend]
+    return friends
+
+
+def full_recompute(friends, top_k=10):
+    """Reference output of a full run: every user, top candidates by mutual friends then ID."""
+    users = set(friends) | {friend for listed in friends.values() for friend in listed}
+    lines = []
+    for user in sorted(users, key=int):
+        counts = Counter()
+        for friend in friends.get(user, ()):
+            counts.update(friends.get(friend, ()))
+        blocked = set(friends.get(user, ())) | {user}
+        ranked = sorted((c for c in counts if c not in blocked), key=lambda c: (-counts[c], int(c)))
+        lines.append(f"{user}\t{','.join(ranked[:top_k])}\n")
+    return "".join(lines)
+
+
+@pytest.mark.parametrize("delta", [
+    "+ 3 4",
+    "- 0 1",
+    "- 3 0",         # 3 loses its only friend but keeps its line
+    "- 6 0",         # removes a friendship of the empty-list user that does not exist
+    "+ 6 3",         # the empty-list user gains a friend
+    "+ 7 0\n+ 7 6",  # new user
+    "+ 1 3\n- 1 3",
+])
+def test_incremental_matches_full_recompute(tmp_path, delta):
+    graph = tmp_path / "graph.txt"
+    graph.write_text(GRAPH)
+    recommendations = tmp_path / "recommendations.txt"
+    recommendations.write_text(full_recompute(read_graph(graph)))
+    delta_file = tmp_path / "delta.txt"
+    delta_file.write_text(delta + "\n")
+
+    update(str(delta_file), str(graph), str(recommendations))
+
+    assert recommendations.read_text() == full_recompute(read_graph(graph))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["delta.txt", "graph.txt", "recommendations.txt"]
+
+
+def test_failed_update_leaves_graph_unchanged(tmp_path):
+    graph = tmp_path / "graph.txt"
+    graph.write_text(GRAPH)
+    delta_file = tmp_path / "delta.txt"
+    delta_file.write_text("+ 3 4\n")
+
+    with pytest.raises(OSError):
+        update(str(delta_file), str(graph), str(tmp_path / "missing.txt"))
+
+    assert graph.read_text() == GRAPH
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["delta.txt", "graph.txt"]
@@ -0,0 +1,16 @@
+from lookup import RecommendationIndex, build_index
+from splitter import UserSet
+
+
+def test_lookup_finds_zero_padded_ids_next_to_numeric_ones(tmp_path):
+    users = UserSet()
+    users.add_block(b"3\t8,007\nabc\t7,07,0\n")
+    output = tmp_path / "friend_recommendations.txt"
+    output.write_text("".join(f"{user}\tr{user}\n" for user in users))
+    build_index(str(output))
+
+    with RecommendationIndex(str(output), rebuild=False) as index:
+        for user in users:
+            assert index.get(user) == [f"r{user}"]
+        for missing in ("0007", "9", "zz"):
+            assert index.get(missing) is None
@@ -0,0 +1,71 @@
+import argparse
+from bisect import bisect_right
+from itertools import islice
+
+import pytest
+
+from records import BINARY, TEXT, RecordWriter, parse_id, read_records
+from reducer import (range_boundaries, range_key, reduce_friends, reduce_range, sample_records, sort_user_key,
+                     split_by_user_range)
+
+USERS = 400
+WORKERS = 4
+SAMPLE = 200
+
+
+def sorted_pairs():
+    """Pair records sorted by (a, b), like a partition after a combiner spill."""
+    return [(a, b, (a * b) % 5 - 1) for a in range(USERS) for b in range(a + 1, min(a + 12, USERS))]
+
+
+def write_input(path, fmt, pair_records):
+    with RecordWriter(str(path), fmt) as writer:
+        writer.write_many(pair_records)
+    return str(path)
+
+
+def options(fmt, streaming):
+    return argparse.Namespace(format=fmt, streaming=streaming, top_k=10, memory_mb=1, spill_dir=None,
+                              aggregate=None)
+
+
+def output_users(path):
+    with open(path) as f:
+        return [sort_user_key(line.split("\t", 1)[0]) for line in f]
+
+
+@pytest.mark.parametrize("fmt", [BINARY, TEXT])
+def test_sample_of_sorted_input_gives_balanced_ranges(tmp_path, fmt):
+    input_file = write_input(tmp_path / "input", fmt, sorted_pairs())
+
+    boundaries = range_boundaries(sample_records([input_file], fmt, size=SAMPLE), WORKERS, fmt)
+    paths = split_by_user_range(read_records(input_file, fmt), fmt, boundaries, str(tmp_path))
+    sizes = [sum(1 for _ in read_records(path, fmt)) for path in paths]
+
+    assert len(paths) == WORKERS
+    assert max(sizes) <= 1.5 * min(sizes), sizes
+    # The head of the same input would put (nearly) every user in the last range
+    head = range_boundaries(list(islice(read_records(input_file, fmt), SAMPLE)), WORKERS, fmt)
+    key = range_key(fmt)
+    assert bisect_right(head, key(parse_id(fmt)(USERS // 10))) == WORKERS - 1
+
+
+@pytest.mark.parametrize("fmt", [BINARY, TEXT])
+@pytest.mark.parametrize("streaming", [False, True])
+def test_ranges_cover_every_user_once(tmp_path, fmt, streaming):
+    input_file = write_input(tmp_path / "input", fmt, sorted_pairs())
+    expected = tmp_path / "expected.txt"
+    reduce_friends([input_file], str(expected), fmt)
+
+    boundaries = range_boundaries(sample_records([input_file], fmt, size=SAMPLE), WORKERS, fmt)
+    paths = split_by_user_range(read_records(input_file, fmt), fmt, boundaries, str(tmp_path))
+    outputs = []
+    for index, path in enumerate(paths):
+        output = tmp_path / f"output_{index}.txt"
+        reduce_range(index, boundaries, path, str(output), options(fmt, streaming))
+        outputs.append(output)
+
+    users = [user for output in outputs for user in output_users(output)]
+    assert users == sorted(set(users))
+    assert users == output_users(expected)
+    assert "".join(output.read_text() for output in outputs) == expected.read_text()
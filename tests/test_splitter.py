@@ -0,0 +1,39 @@
+from splitter import UserSet, join_users, user_order_key
+
+
+def test_user_set_iterates_in_user_order_key_order():
+    users = UserSet()
+    users.add_block(b"3\t8,007\nabc\t7,07,0\n")
+    users.add("12")
+
+    order = list(users)
+    assert order == sorted(order, key=user_order_key)
+    # Zero-padded IDs by value, between the plain numeric ones
+    assert order.index("3") < order.index("007") < order.index("8")
+    assert order[-1] == "abc"
+    assert len(users) == 8
+    assert "007" in users and "7" in users and "0007" not in users
+
+
+def test_join_keeps_zero_padded_ids_next_to_numeric_ones():
+    users = UserSet()
+    users.add_block(b"3\t8,007\n")
+    # Merged reducer outputs: zero-padded IDs sort by value, between 3 and 8
+    entries = [("3", {"8": 1}), ("007", {"3": 2}), ("8", {"007": 1})]
+    counters = {}
+
+    assert list(join_users(users, entries, counters)) == entries
+    assert counters["unknown_users"] == 0
+
+
+def test_join_matches_ids_with_equal_keys_in_any_order():
+    users = UserSet()
+    users.add_block(b"7\t007,9\n")
+    # "007" and "7" share an order key and may come in either order; 5 and 10 are not users
+    entries = [("5", {"9": 1}), ("007", {"9": 1}), ("7", {"9": 2}), ("10", {"7": 1})]
+    counters = {}
+
+    joined = dict(join_users(users, entries, counters))
+
+    assert joined == {"7": {"9": 2}, "007": {"9": 1}, "9": None}
+    assert counters["unknown_users"] == 2